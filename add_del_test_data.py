@@ -1,6 +1,8 @@
 # test_data_manager.py
+import argparse
 import sys
 import os
+import time
 
 # Добавляем путь к текущей директории для импорта модулей
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -8,6 +10,7 @@ sys.path.append(current_dir)
 
 from edb.config import DatabaseConfig
 from edb.database import Database
+from edb.datagen import DataGenerator
 
 class TestDataManager:
     def __init__(self):
@@ -18,7 +21,7 @@ class TestDataManager:
         """Подключается к базе данных"""
         try:
             connection_params = self.config.get_connection_params()
-            self.db = Database(**connection_params)
+            self.db = Database(**connection_params, **self.config.get_pool_params())
             print("Успешно подключено к базе данных")
             return True
         except Exception as e:
@@ -294,28 +297,25 @@ class TestDataManager:
             return False
     
     def _clean_test_data(self):
-        """Очищает только тестовые данные, сохраняя стандартных пользователей"""
-        try:
-            # Удаляем в правильном порядке с учетом внешних ключей
-            self._execute_sql("DELETE FROM delivery_group_items")
-            self._execute_sql("DELETE FROM delivery_groups")
-            self._execute_sql("DELETE FROM deliveries")
-            self._execute_sql("DELETE FROM sales")
-            self._execute_sql("DELETE FROM customers")
-            self._execute_sql("DELETE FROM product_warehouse")
-            self._execute_sql("DELETE FROM products")
-            
-            # Удаляем только тестовых сотрудников (кроме стандартных)
-            self._execute_sql("DELETE FROM employees WHERE login NOT IN ('admin', 'cashier', 'storekeeper')")
-            
-            # Удаляем только тестовые склады (кроме основного)
-            self._execute_sql("DELETE FROM warehouses WHERE name != 'Основной склад'")
-            
-            # Сбрасываем последовательности
-            self._reset_sequences()
-            
-        except Exception as e:
-            print(f"Ошибка при очистке тестовых данных: {e}")
+        """Очищает все данные одним TRUNCATE со сбросом последовательностей.
+        
+        Основной склад и стандартные сотрудники создаются заново.
+        """
+        return DataGenerator(self.db).truncate()
+    
+    def generate_bulk_data(self, seed=0, **sizes):
+        """Заполняет базу синтетическими данными заданного объема через COPY"""
+        if not self.db:
+            print("Нет подключения к базе данных")
+            return False
+        
+        print(f"Генерация данных: {sizes}, seed={seed}")
+        started = time.perf_counter()
+        counts = DataGenerator(self.db, seed=seed).generate(**sizes)
+        if counts is None:
+            return False
+        print(f"Сгенерировано за {time.perf_counter() - started:.1f} с: {counts}")
+        return True
     
     def remove_test_data(self):
         """Удаляет тестовые данные из базы"""
@@ -325,7 +325,8 @@ class TestDataManager:
         
         try:
             print("Удаление тестовых данных...")
-            self._clean_test_data()
+            if not self._clean_test_data():
+                return False
             print("Тестовые данные успешно удалены!")
             return True
             
@@ -378,39 +379,16 @@ class TestDataManager:
     
     def _execute_sql(self, sql):
         """Выполняет SQL запрос напрямую"""
-        conn = self.db._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute(sql)
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка выполнения SQL: {e}")
-            conn.rollback()
-            return False
-        finally:
-            conn.close()
-    
-    def _reset_sequences(self):
-        """Сбрасывает последовательности ID"""
-        sequences = [
-            'warehouses_id_seq',
-            'employees_id_seq',
-            'products_id_seq',
-            'product_warehouse_id_seq',
-            'sales_id_seq',
-            'customers_id_seq',
-            'deliveries_id_seq',
-            'delivery_groups_id_seq',
-            'delivery_group_items_id_seq'
-        ]
-        
-        for seq in sequences:
+        with self.db._connection() as conn:
+            cursor = conn.cursor()
             try:
-                self._execute_sql(f"ALTER SEQUENCE {seq} RESTART WITH 1")
-            except:
-                # Игнорируем ошибки, если последовательности не существует
-                pass
+                cursor.execute(sql)
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка выполнения SQL: {e}")
+                conn.rollback()
+                return False
     
     def _get_warehouse_by_name(self, name):
         """Находит склад по имени"""
@@ -442,28 +420,39 @@ class TestDataManager:
     
     def _get_last_sale_id(self):
         """Получает ID последней добавленной продажи"""
-        conn = self.db._get_connection()
-        cursor = conn.cursor()
-        try:
+        with self.db._connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("SELECT MAX(id) FROM sales")
             result = cursor.fetchone()[0]
             return result if result else None
-        finally:
-            conn.close()
     
     def _get_last_delivery_id(self):
         """Получает ID последней добавленной доставки"""
-        conn = self.db._get_connection()
-        cursor = conn.cursor()
-        try:
+        with self.db._connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("SELECT MAX(id) FROM deliveries")
             result = cursor.fetchone()[0]
             return result if result else None
-        finally:
-            conn.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Тестовые данные магазина. Без параметров запускается меню.'
+    )
+    parser.add_argument('--generate', action='store_true',
+                        help='очистить базу и сгенерировать данные заданного объема')
+    parser.add_argument('--truncate', action='store_true', help='только очистить базу')
+    parser.add_argument('--warehouses', type=int, default=5)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--customers', type=int, default=10000)
+    parser.add_argument('--sales', type=int, default=100000)
+    parser.add_argument('--deliveries', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=365, help='за сколько последних дней продажи')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
 
 def main():
     """Главная функция приложения"""
+    args = parse_args()
     manager = TestDataManager()
     
     print("МЕНЕДЖЕР ТЕСТОВЫХ ДАННЫХ ДЛЯ МАГАЗИНА БЫТОВОЙ ТЕХНИКИ")
@@ -474,6 +463,16 @@ def main():
         print("Не удалось подключиться к базе данных. Проверьте настройки в database_config.json")
         return
     
+    if args.truncate:
+        manager.remove_test_data()
+        return
+    if args.generate:
+        manager.generate_bulk_data(
+            seed=args.seed, warehouses=args.warehouses, products=args.products,
+            customers=args.customers, sales=args.sales, deliveries=args.deliveries, days=args.days
+        )
+        return
+    
     while True:
         print("\nВЫБЕРИТЕ ДЕЙСТВИЕ:")
         print("1. Добавить тестовые данные")
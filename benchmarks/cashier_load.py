@@ -0,0 +1,362 @@
+"""Нагрузочный прогон: параллельные кассы против одной базы.
+
+Каждая касса - поток, который работает с Database так же, как
+CashierWindow: загружает каталог склада, добавляет в корзину несколько
+товаров (перечитывая остаток каждого), иногда ищет или заводит клиента
+для доставки и оформляет продажу через checkout. Кассы распределяются
+по --warehouses складам с наибольшим числом кассиров.
+
+Для каждого числа касс из --cashiers прогон длится --duration секунд,
+затем печатаются продажи в секунду, задержки операций (p50/p95/p99 и
+гистограмма оформления), число взаимоблокировок по pg_stat_database
+и нарушения остатков: отрицательные количества в product_warehouse и
+расхождение списанного со складов с проданным. Прогон оформляет
+настоящие продажи, запускать его следует на тестовой базе, например
+заполненной через add_del_test_data.py --generate.
+
+    python benchmarks/cashier_load.py --cashiers 10,25,50,100 --warehouses 10 --duration 60
+"""
+import argparse
+import bisect
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from edb.config import DatabaseConfig
+from edb.database import Database
+
+# Верхние границы корзин гистограммы, мс
+HISTOGRAM_BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class Stats:
+    """Задержки и счетчики, общие для всех касс одного прогона"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.counters = defaultdict(int)
+        # id склада -> единиц товара, проданных кассами прогона
+        self.sold = defaultdict(int)
+
+    def record(self, operation, seconds):
+        with self._lock:
+            self.timings[operation].append(seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] += value
+
+    def sold_units(self, warehouse_id, units):
+        with self._lock:
+            self.sold[warehouse_id] += units
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по ближайшему рангу"""
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def histogram(timings):
+    """Число операций в каждой корзине HISTOGRAM_BOUNDS и выше последней"""
+    buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+    for seconds in timings:
+        buckets[bisect.bisect_left(HISTOGRAM_BOUNDS, seconds * 1000)] += 1
+    return buckets
+
+
+class Cashier(threading.Thread):
+    """Касса: повторяет продажи, пока не выставлен stop"""
+
+    def __init__(self, db, cashier_id, warehouse_id, phones, stats, stop, args, seed):
+        super().__init__(daemon=True)
+        self.db = db
+        self.cashier_id = cashier_id
+        self.warehouse_id = warehouse_id
+        self.phones = phones
+        self.stats = stats
+        self.stop = stop
+        self.args = args
+        self.random = random.Random(seed)
+
+    def timed(self, operation, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        except Exception as e:
+            # Database сама перехватывает ошибки запросов; сюда доходят
+            # ошибки пула, например нехватка соединений
+            self.stats.count('exceptions')
+            print(f"Касса {self.cashier_id}: {operation}: {e}")
+            return None
+        finally:
+            self.stats.record(operation, time.perf_counter() - started)
+
+    def pause(self):
+        if self.args.think:
+            self.stop.wait(self.random.uniform(0, 2 * self.args.think / 1000))
+
+    def run(self):
+        while not self.stop.is_set():
+            self.sale()
+
+    def sale(self):
+        products = self.timed('get_products_with_quantity', self.db.get_products_with_quantity,
+                              self.warehouse_id)
+        available = [p for p in products or [] if p['quantity'] > 0]
+        if not available:
+            self.stats.count('empty_catalog')
+            self.stop.wait(1)
+            return
+
+        cart = {}
+        for product in self.random.sample(available, min(len(available), self.random.randint(1, self.args.cart))):
+            self.pause()
+            if self.stop.is_set():
+                return
+            # Как и окно кассира, перед добавлением перечитываем остаток
+            current = self.timed('get_product_with_quantity', self.db.get_product_with_quantity,
+                                 product['id'], self.warehouse_id)
+            if current and current['quantity'] > 0:
+                quantity = min(current['quantity'], self.random.randint(1, 3))
+                cart[product['id']] = {'id': product['id'], 'quantity': quantity, 'price': current['price']}
+        if not cart:
+            return
+
+        delivery = None
+        if self.random.random() < self.args.delivery_rate:
+            delivery = self.delivery()
+
+        self.pause()
+        result = self.timed('checkout', self.db.checkout, list(cart.values()), self.cashier_id,
+                            self.warehouse_id, delivery)
+        if result is None:
+            self.stats.count('checkout_errors')
+        elif result['shortages']:
+            self.stats.count('shortages')
+        else:
+            self.stats.count('sales')
+            self.stats.sold_units(self.warehouse_id, sum(item['quantity'] for item in cart.values()))
+            if result['delivery_id']:
+                self.stats.count('deliveries')
+
+    def delivery(self):
+        """Клиент доставки: существующий по телефону, иногда новый"""
+        if self.phones and self.random.random() < 0.8:
+            phone = self.random.choice(self.phones)
+        else:
+            phone = f"+7556{self.cashier_id % 1000:03d}{self.random.randrange(10 ** 7):07d}"
+            self.timed('create_customer', self.db.create_customer,
+                       'Клиент нагрузки', phone, 'load@example.com', 'Адрес нагрузки')
+        customer = self.timed('get_customer_by_phone', self.db.get_customer_by_phone, phone)
+        if not customer:
+            return None
+        return {'customer_id': customer['id'], 'address': customer.get('address') or 'Адрес нагрузки',
+                'notes': ''}
+
+
+def load_tills(db, warehouses):
+    """Склады с наибольшим числом кассиров и их кассиры: {склад: [id кассира]}"""
+    with db._connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT warehouse_id, array_agg(id ORDER BY id) FROM employees
+            WHERE role = 'cashier' AND warehouse_id IS NOT NULL
+            GROUP BY warehouse_id
+            ORDER BY COUNT(*) DESC, warehouse_id
+            LIMIT %s
+        ''', (warehouses,))
+        tills = dict(cursor.fetchall())
+        cursor.execute("SELECT phone FROM customers ORDER BY random() LIMIT 1000")
+        phones = [row[0] for row in cursor.fetchall()]
+        conn.rollback()
+    return tills, phones
+
+
+def server_state(db, warehouse_ids):
+    """Остатки складов прогона, число отрицательных остатков и взаимоблокировок"""
+    with db._connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT warehouse_id, SUM(quantity), COUNT(*) FILTER (WHERE quantity < 0)
+            FROM product_warehouse WHERE warehouse_id = ANY(%s)
+            GROUP BY warehouse_id
+        ''', (list(warehouse_ids),))
+        stock = {}
+        negative = 0
+        for warehouse_id, total, below_zero in cursor.fetchall():
+            stock[warehouse_id] = total
+            negative += below_zero
+        cursor.execute("SELECT deadlocks FROM pg_stat_database WHERE datname = current_database()")
+        deadlocks = cursor.fetchone()[0]
+        conn.rollback()
+    return stock, negative, deadlocks
+
+
+def restock(db, warehouse_ids, quantity):
+    """Выставляет остатки складов; кэш каталога обновят уведомления триггера"""
+    with db._connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE product_warehouse SET quantity = %s WHERE warehouse_id = ANY(%s)",
+                       (quantity, list(warehouse_ids)))
+        conn.commit()
+
+
+def run_step(db, tills, phones, count, args):
+    """Прогон с count кассами, возвращает сводку"""
+    warehouse_ids = list(tills)
+    # Кассы по кругу раздаются складам, кассиры склада - кассам
+    assignments = []
+    for i in range(count):
+        warehouse_id = warehouse_ids[i % len(warehouse_ids)]
+        cashiers = tills[warehouse_id]
+        assignments.append((cashiers[(i // len(warehouse_ids)) % len(cashiers)], warehouse_id))
+
+    if args.restock is not None:
+        restock(db, warehouse_ids, args.restock)
+    stock_before, _, deadlocks_before = server_state(db, warehouse_ids)
+
+    stats = Stats()
+    stop = threading.Event()
+    threads = [Cashier(db, cashier_id, warehouse_id, phones, stats, stop, args, args.seed * 100003 + i)
+               for i, (cashier_id, warehouse_id) in enumerate(assignments)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    stop.wait(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stock_after, negative, deadlocks_after = server_state(db, warehouse_ids)
+    # Списанное со склада должно совпадать с проданным кассами прогона
+    mismatched = {
+        warehouse_id: (stock_before.get(warehouse_id, 0) - stock_after.get(warehouse_id, 0),
+                       stats.sold[warehouse_id])
+        for warehouse_id in warehouse_ids
+        if stock_before.get(warehouse_id, 0) - stock_after.get(warehouse_id, 0) != stats.sold[warehouse_id]
+    }
+
+    operations = {}
+    for operation, timings in sorted(stats.timings.items()):
+        timings.sort()
+        operations[operation] = {
+            'calls': len(timings),
+            'per_sec': len(timings) / elapsed,
+            'p50_ms': percentile(timings, 0.50) * 1000,
+            'p95_ms': percentile(timings, 0.95) * 1000,
+            'p99_ms': percentile(timings, 0.99) * 1000,
+            'max_ms': timings[-1] * 1000,
+            'histogram': histogram(timings),
+        }
+    return {
+        'cashiers': count,
+        'elapsed': elapsed,
+        'sales_per_sec': stats.counters['sales'] / elapsed,
+        'counters': dict(stats.counters),
+        'deadlocks': deadlocks_after - deadlocks_before,
+        'negative_stock': negative,
+        'stock_mismatch': {str(k): v for k, v in mismatched.items()},
+        'operations': operations,
+    }
+
+
+def print_step(result):
+    counters = result['counters']
+    print(f"\n=== Касс: {result['cashiers']}, {result['elapsed']:.1f} с ===")
+    print(f"Продаж: {counters.get('sales', 0)} ({result['sales_per_sec']:.1f}/с), "
+          f"с доставкой: {counters.get('deliveries', 0)}, "
+          f"нехватка товара: {counters.get('shortages', 0)}, "
+          f"ошибок оформления: {counters.get('checkout_errors', 0)}, "
+          f"исключений: {counters.get('exceptions', 0)}")
+    print(f"{'Операция':<30}{'вызовов':>10}{'в с':>10}{'p50, мс':>10}{'p95, мс':>10}"
+          f"{'p99, мс':>10}{'макс, мс':>10}")
+    for name, op in result['operations'].items():
+        print(f"{name:<30}{op['calls']:>10}{op['per_sec']:>10.1f}{op['p50_ms']:>10.2f}"
+              f"{op['p95_ms']:>10.2f}{op['p99_ms']:>10.2f}{op['max_ms']:>10.1f}")
+
+    checkout = result['operations'].get('checkout')
+    if checkout:
+        print("Гистограмма checkout:")
+        labels = [f"<={bound} мс" for bound in HISTOGRAM_BOUNDS] + [f">{HISTOGRAM_BOUNDS[-1]} мс"]
+        total = checkout['calls']
+        for label, count in zip(labels, checkout['histogram']):
+            if count:
+                print(f"  {label:>10} {count:>8} {'#' * max(1, round(40 * count / total))}")
+
+    print(f"Взаимоблокировок: {result['deadlocks']}, отрицательных остатков: {result['negative_stock']}")
+    for warehouse_id, (written_off, sold) in result['stock_mismatch'].items():
+        print(f"  Склад {warehouse_id}: списано {written_off}, продано {sold}")
+
+
+def violations(result):
+    return result['deadlocks'] or result['negative_stock'] or result['stock_mismatch']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cashiers', default='10',
+                        help='число касс, через запятую - несколько прогонов подряд')
+    parser.add_argument('--warehouses', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=60, help='длительность прогона, с')
+    parser.add_argument('--think', type=float, default=0,
+                        help='средняя пауза кассира между действиями, мс')
+    parser.add_argument('--cart', type=int, default=5, help='наибольшее число позиций в корзине')
+    parser.add_argument('--delivery-rate', type=float, default=0.1, help='доля продаж с доставкой')
+    parser.add_argument('--restock', type=int,
+                        help='перед каждым прогоном выставить это количество всем товарам складов')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='читать каталог из базы, без кэша каталога')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='сохранить результаты в файл')
+    args = parser.parse_args()
+
+    steps = [int(value) for value in args.cashiers.split(',')]
+    config = DatabaseConfig()
+    pool_params = config.get_pool_params()
+    # Каждой кассе - свое соединение, как у отдельного приложения
+    pool_params['pool_max_size'] = max(pool_params['pool_max_size'], max(steps) + 1)
+    db = Database(**config.get_connection_params(), **pool_params, catalog_cache=not args.no_cache)
+    db.start()
+    try:
+        tills, phones = load_tills(db, args.warehouses)
+        if not tills:
+            print("В базе нет кассиров, привязанных к складам")
+            sys.exit(1)
+        print(f"Складов: {len(tills)}, кассиров: {sum(len(c) for c in tills.values())}")
+
+        results = []
+        for count in steps:
+            result = run_step(db, tills, phones, count, args)
+            print_step(result)
+            results.append(result)
+
+        print(f"\n{'Касс':>6}{'продаж/с':>12}{'checkout p95, мс':>20}{'нарушений':>12}")
+        for result in results:
+            checkout = result['operations'].get('checkout', {})
+            print(f"{result['cashiers']:>6}{result['sales_per_sec']:>12.1f}"
+                  f"{checkout.get('p95_ms', 0):>20.1f}{'да' if violations(result) else 'нет':>12}")
+
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({'args': vars(args), 'histogram_bounds_ms': HISTOGRAM_BOUNDS,
+                           'steps': results}, f, ensure_ascii=False, indent=2)
+            print(f"\nРезультаты сохранены в {args.json}")
+
+        if any(violations(result) for result in results):
+            sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""Замеры задержек публичных методов Database.
+
+Скрипт подключается к базе из edb/database_config.json, при --generate
+заново заполняет ее генератором edb/datagen.py и вызывает каждый метод
+Database заданное число раз. Для каждого метода печатаются p50/p95/p99,
+строк в секунду и пиковая память процесса, результаты можно сохранить
+в JSON и сравнить с сохраненными ранее (например, с прогоном на
+предыдущем коммите). Методы, меняющие данные, замеряются только с
+--writes. --generate и --writes меняют базу, запускать их следует
+на тестовой базе. --memory дополнительно замеряет память, которую
+занимает полный отчет по продажам склада.
+
+    python benchmarks/database_bench.py --generate --sales 1000000 --writes --json base.json
+    python benchmarks/database_bench.py --writes --compare base.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+try:
+    import resource
+except ImportError:
+    # Windows: пиковая память не замеряется
+    resource = None
+
+from edb.config import DatabaseConfig
+from edb.database import Database
+from edb.datagen import DataGenerator
+
+
+def peak_rss_mb():
+    """Пиковый размер резидентной памяти процесса в МБ или None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux сообщает килобайты, macOS - байты
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по ближайшему рангу"""
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def count_rows(result):
+    if result is None:
+        return 0
+    if isinstance(result, list):
+        return len(result)
+    # get_deliveries_changed_since возвращает (доставки, курсор)
+    if type(result) is tuple and result and isinstance(result[0], list):
+        return len(result[0])
+    return 1
+
+
+def measure_memory(fn):
+    """Пиковый и оставшийся после вызова fn прирост памяти Python в МБ
+    и байт на строку результата"""
+    tracemalloc.start()
+    try:
+        result = fn()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    rows = count_rows(result)
+    return {
+        'rows': rows,
+        'peak_mb': peak / (1024 * 1024),
+        'bytes_per_row': peak / rows if rows else 0.0,
+        'retained_bytes_per_row': retained / rows if rows else 0.0,
+    }
+
+
+def load_context(db):
+    """id, на которых выполняются замеры: самый загруженный склад и его сотрудники"""
+    with db._connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT warehouse_id FROM sales
+            GROUP BY warehouse_id ORDER BY COUNT(*) DESC LIMIT 1
+        ''')
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("SELECT MIN(id) FROM warehouses")
+            row = cursor.fetchone()
+        warehouse_id = row[0]
+
+        def employee(role):
+            cursor.execute('''
+                SELECT id, login, password FROM employees
+                WHERE role = %s ORDER BY warehouse_id = %s DESC, id LIMIT 1
+            ''', (role, warehouse_id))
+            return cursor.fetchone()
+
+        cashier = employee('cashier')
+        storekeeper = employee('storekeeper')
+        cursor.execute('''
+            SELECT p.id, p.price FROM products p
+            JOIN product_warehouse pw ON pw.product_id = p.id AND pw.warehouse_id = %s
+            ORDER BY pw.quantity DESC LIMIT 1
+        ''', (warehouse_id,))
+        product = cursor.fetchone()
+        cursor.execute("SELECT phone FROM customers ORDER BY id DESC LIMIT 1")
+        customer = cursor.fetchone()
+        cursor.execute('''
+            SELECT sale_date, id FROM sales
+            WHERE warehouse_id = %s ORDER BY sale_date DESC, id DESC OFFSET 199 LIMIT 1
+        ''', (warehouse_id,))
+        page_key = cursor.fetchone()
+        conn.rollback()
+
+    return {
+        'warehouse_id': warehouse_id,
+        'cashier': cashier,
+        'storekeeper_id': storekeeper[0] if storekeeper else None,
+        'product_id': product[0] if product else None,
+        'price': float(product[1]) if product else 0,
+        'phone': customer[0] if customer else '',
+        'page_key': tuple(page_key) if page_key else None,
+        'since': datetime.now() - timedelta(hours=1),
+    }
+
+
+def read_benchmarks(db, direct, ctx):
+    """(имя, вызов) для методов чтения; direct - Database без кэша каталога"""
+    warehouse_id = ctx['warehouse_id']
+    cashier = ctx['cashier']
+    month_ago = datetime.now() - timedelta(days=30)
+    return [
+        ('get_products_with_quantity(warehouse)', lambda: db.get_products_with_quantity(warehouse_id)),
+        ('get_products_with_quantity(all)', lambda: db.get_products_with_quantity()),
+        ('get_products_with_quantity(warehouse, no cache)',
+         lambda: direct.get_products_with_quantity(warehouse_id)),
+        ('get_product_with_quantity', lambda: db.get_product_with_quantity(ctx['product_id'], warehouse_id)),
+        ('get_sales_report(warehouse, page 1)',
+         lambda: db.get_sales_report(warehouse_id, limit=200)),
+        ('get_sales_report(warehouse, page 2)',
+         lambda: db.get_sales_report(warehouse_id, after=ctx['page_key'], limit=200)),
+        ('get_sales_report(all, page 1)', lambda: db.get_sales_report(limit=200)),
+        ('get_all_deliveries(warehouse, 200)', lambda: db.get_all_deliveries(warehouse_id, limit=200)),
+        ('get_all_deliveries(active)',
+         lambda: db.get_all_deliveries(warehouse_id, statuses=['pending', 'assigned', 'in_progress'])),
+        ('get_pending_deliveries', lambda: db.get_pending_deliveries(warehouse_id)),
+        ('get_deliveries_changed_since',
+         lambda: db.get_deliveries_changed_since(ctx['since'], warehouse_id)),
+        ('get_delivery_groups', lambda: db.get_delivery_groups(ctx['storekeeper_id'])),
+        ('search_customers', lambda: db.search_customers(ctx['phone'][-4:])),
+        ('get_customer_by_phone', lambda: db.get_customer_by_phone(ctx['phone'])),
+        ('authenticate_user', lambda: db.authenticate_user(cashier[1], cashier[2])),
+        ('get_all_employees', db.get_all_employees),
+        ('get_employees_by_warehouse', lambda: db.get_employees_by_warehouse(warehouse_id)),
+        ('get_all_warehouses', db.get_all_warehouses),
+        ('reports.revenue(day, 30 days)', lambda: db.reports.revenue('day', date_from=month_ago)),
+        ('reports.revenue(month, by warehouse)', lambda: db.reports.revenue('month', group_by='warehouse')),
+        ('reports.top_products(30 days)', lambda: db.reports.top_products(date_from=month_ago)),
+    ]
+
+
+def write_benchmarks(db, ctx):
+    """(имя, вызов) для методов, меняющих данные"""
+    warehouse_id = ctx['warehouse_id']
+    cashier_id = ctx['cashier'][0]
+    product_id = ctx['product_id']
+    price = ctx['price']
+    counter = iter(range(10 ** 9))
+    stamp = int(time.time())
+    cart = [{'id': product_id, 'quantity': 1, 'price': price}]
+    return [
+        ('add_sale', lambda: db.add_sale(product_id, 1, price, cashier_id, warehouse_id)),
+        ('checkout(1 item)', lambda: db.checkout(cart, cashier_id, warehouse_id)),
+        ('reserve_stock', lambda: db.reserve_stock([(product_id, 1)], warehouse_id)),
+        ('update_product_quantity',
+         lambda: db.update_product_quantity(product_id, warehouse_id, 100000)),
+        ('create_customer',
+         lambda: db.create_customer('Клиент замера', f'+7555{stamp % 10 ** 6:06d}{next(counter):05d}',
+                                    'bench@example.com', 'Адрес замера')),
+    ]
+
+
+def measure(fn, iterations, warmup):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    rows = 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+        rows += count_rows(result)
+    timings.sort()
+    total = sum(timings)
+    return {
+        'calls': iterations,
+        'mean_ms': total / iterations * 1000,
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'rows_per_sec': rows / total if total else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(current_dir),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None, threshold=1.2):
+    """Печатает таблицу результатов, возвращает имена замедлившихся методов"""
+    header = f"{'Метод':<50}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'строк/с':>12}{'RSS, МБ':>10}"
+    if baseline:
+        header += f"{'p50 было':>10}{'изм.':>8}"
+    print(header)
+    regressions = []
+    for name, r in results.items():
+        rss = f"{r['peak_rss_mb']:.0f}" if r['peak_rss_mb'] is not None else '-'
+        line = (f"{name:<50}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+                f"{r['rows_per_sec']:>12.0f}{rss:>10}")
+        before = (baseline or {}).get(name)
+        if before:
+            ratio = r['p50_ms'] / before['p50_ms'] if before['p50_ms'] else float('inf')
+            mark = ' !' if ratio > threshold else ''
+            line += f"{before['p50_ms']:>10.2f}{ratio:>7.2f}x{mark}"
+            if ratio > threshold:
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--generate', action='store_true', help='заново заполнить базу перед замерами')
+    parser.add_argument('--warehouses', type=int, default=20)
+    parser.add_argument('--products', type=int, default=2_000)
+    parser.add_argument('--customers', type=int, default=100_000)
+    parser.add_argument('--sales', type=int, default=1_000_000)
+    parser.add_argument('--deliveries', type=int, default=50_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--only', help='замерять только методы, в имени которых есть эта строка')
+    parser.add_argument('--writes', action='store_true', help='замерять и методы, меняющие данные')
+    parser.add_argument('--memory', action='store_true',
+                        help='замерить память полного отчета по продажам склада')
+    parser.add_argument('--json', help='сохранить результаты в файл')
+    parser.add_argument('--compare', help='сравнить с результатами из файла')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='во сколько раз p50 может вырасти без признания регрессии')
+    args = parser.parse_args()
+
+    config = DatabaseConfig()
+    db = Database(**config.get_connection_params(), **config.get_pool_params())
+    # Как в приложении: кэш каталога работает, пока слушатель подключен
+    db.start()
+    direct = Database(**config.get_connection_params(), pool_min_size=0, catalog_cache=False)
+    try:
+        dataset = None
+        if args.generate:
+            started = time.perf_counter()
+            dataset = DataGenerator(db, seed=args.seed).generate(
+                warehouses=args.warehouses, products=args.products, customers=args.customers,
+                sales=args.sales, deliveries=args.deliveries
+            )
+            if dataset is None:
+                sys.exit(1)
+            print(f"База заполнена за {time.perf_counter() - started:.1f} с: {dataset}")
+
+        ctx = load_context(db)
+        benchmarks = read_benchmarks(db, direct, ctx)
+        if args.writes:
+            benchmarks += write_benchmarks(db, ctx)
+        if args.only:
+            benchmarks = [(name, fn) for name, fn in benchmarks if args.only in name]
+
+        results = {}
+        for name, fn in benchmarks:
+            results[name] = measure(fn, args.iterations, args.warmup)
+
+        baseline = None
+        if args.compare:
+            with open(args.compare, encoding='utf-8') as f:
+                baseline = json.load(f)['results']
+        regressions = print_results(results, baseline, args.threshold)
+
+        memory = None
+        if args.memory:
+            # Без limit - все продажи склада одним списком, как при выгрузке отчета
+            memory = measure_memory(lambda: db.get_sales_report(ctx['warehouse_id']))
+            print(f"\nПолный отчет по продажам: {memory['rows']} строк, "
+                  f"{memory['peak_mb']:.1f} МБ, {memory['bytes_per_row']:.0f} байт на строку "
+                  f"в пике, {memory['retained_bytes_per_row']:.0f} - в результате")
+
+        if args.json:
+            report = {
+                'commit': git_commit(),
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'iterations': args.iterations,
+                'dataset': dataset,
+                'context': {key: ctx[key] for key in ('warehouse_id', 'storekeeper_id', 'product_id')},
+                'results': results,
+                'memory': memory,
+            }
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"\nРезультаты сохранены в {args.json}")
+
+        if regressions:
+            print(f"\nЗамедлились более чем в {args.threshold} раза: {', '.join(regressions)}")
+            sys.exit(1)
+    finally:
+        direct.close()
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""Сравнение планов горячих запросов без вторичных индексов и с ними.
+
+Скрипт наполняет базу синтетическими продажами (по умолчанию 1 млн строк)
+и доставками, выполняет EXPLAIN (ANALYZE, BUFFERS) для запросов из
+edb/database.py сначала без индексов миграции 2, затем с ними.
+Вся работа идет в одной транзакции, которая в конце откатывается,
+поэтому данные в базе не меняются. На время прогона таблицы заблокированы,
+запускать следует на тестовой базе.
+
+    python benchmarks/index_plans.py --sales 1000000 --plans
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+import psycopg2
+
+from edb.config import DatabaseConfig
+from edb.database import Database
+from edb.migrations import INDEXES, _v2_secondary_indexes
+
+# Запросы в том виде, в котором их выполняет Database
+QUERIES = {
+    'get_sales_report(warehouse)': '''
+        SELECT s.id, p.name, s.quantity, s.total_price, s.sale_date, e.full_name, s.status, w.name
+        FROM sales s
+        JOIN products p ON s.product_id = p.id
+        JOIN employees e ON s.cashier_id = e.id
+        JOIN warehouses w ON s.warehouse_id = w.id
+        WHERE s.warehouse_id = %(warehouse_id)s
+        ORDER BY s.sale_date DESC
+    ''',
+    'get_pending_deliveries(warehouse)': '''
+        SELECT d.id, d.delivery_address, d.status, d.created_date,
+               c.full_name, c.phone, c.email,
+               p.name as product_name, s.quantity,
+               e.full_name as cashier_name,
+               w.name as warehouse_name
+        FROM deliveries d
+        JOIN customers c ON d.customer_id = c.id
+        JOIN sales s ON d.sale_id = s.id
+        JOIN products p ON s.product_id = p.id
+        JOIN employees e ON s.cashier_id = e.id
+        JOIN warehouses w ON s.warehouse_id = w.id
+        WHERE d.status = 'pending' AND s.warehouse_id = %(warehouse_id)s
+        ORDER BY d.created_date
+    ''',
+    'get_all_deliveries(status)': '''
+        SELECT d.id, d.delivery_address, d.status, d.created_date, d.delivery_date,
+               c.full_name, c.phone, c.email,
+               p.name as product_name, s.quantity,
+               e.full_name as cashier_name, emp.full_name as storekeeper_name,
+               w.name as warehouse_name, dg.vehicle_info
+        FROM deliveries d
+        JOIN customers c ON d.customer_id = c.id
+        JOIN sales s ON d.sale_id = s.id
+        JOIN products p ON s.product_id = p.id
+        JOIN employees e ON s.cashier_id = e.id
+        LEFT JOIN employees emp ON d.assigned_storekeeper_id = emp.id
+        LEFT JOIN delivery_group_items dgi ON d.id = dgi.delivery_id
+        LEFT JOIN delivery_groups dg ON dgi.delivery_group_id = dg.id
+        JOIN warehouses w ON s.warehouse_id = w.id
+        WHERE d.status = ANY(ARRAY['assigned'])
+        ORDER BY d.created_date DESC, d.id DESC
+    ''',
+    'get_delivery_groups(storekeeper)': '''
+        SELECT dg.id, dg.vehicle_info, dg.status, dg.created_date, dg.completed_date,
+               e.full_name as storekeeper_name,
+               COUNT(dgi.delivery_id) as delivery_count
+        FROM delivery_groups dg
+        JOIN employees e ON dg.storekeeper_id = e.id
+        LEFT JOIN delivery_group_items dgi ON dg.id = dgi.delivery_group_id
+        WHERE dg.storekeeper_id = %(storekeeper_id)s
+        GROUP BY dg.id, dg.vehicle_info, dg.status, dg.created_date, dg.completed_date, e.full_name
+        ORDER BY dg.created_date DESC
+    ''',
+    'get_customer_by_phone': '''
+        SELECT id, full_name, phone, email, address
+        FROM customers
+        WHERE phone = %(phone)s
+    ''',
+}
+
+
+def fill_data(cursor, sales, customers, products, warehouses, delivery_ratio):
+    """Наполняет базу синтетическими данными внутри текущей транзакции"""
+    cursor.execute('''
+        INSERT INTO warehouses (name, address)
+        SELECT 'Склад ' || g, 'Адрес ' || g FROM generate_series(1, %s) g
+    ''', (warehouses,))
+    cursor.execute('''
+        INSERT INTO employees (login, password, full_name, role, warehouse_id)
+        SELECT 'bench_' || r || '_' || w.id, 'x', 'Сотрудник ' || r || ' ' || w.id, r, w.id
+        FROM warehouses w CROSS JOIN (VALUES ('cashier'), ('storekeeper')) AS roles(r)
+    ''')
+    cursor.execute('''
+        INSERT INTO products (name, category, brand, price, min_quantity)
+        SELECT 'Товар ' || g, 'Категория ' || (g %% 20), 'Бренд ' || (g %% 50),
+               (100 + random() * 90000)::numeric(10, 2), 1
+        FROM generate_series(1, %s) g
+    ''', (products,))
+    cursor.execute('''
+        INSERT INTO customers (full_name, phone, email, address)
+        SELECT 'Клиент ' || g, '7' || lpad(g::text, 10, '0'), NULL, 'Адрес ' || g
+        FROM generate_series(1, %s) g
+    ''', (customers,))
+
+    # Массивы id собираются один раз (InitPlan), случайный элемент берется для каждой строки
+    cursor.execute('''
+        INSERT INTO sales (product_id, quantity, total_price, sale_date, cashier_id, warehouse_id)
+        SELECT (a.products)[1 + floor(random() * cardinality(a.products))::int],
+               1 + floor(random() * 3)::int,
+               (100 + random() * 90000)::numeric(10, 2),
+               now() - random() * interval '3 years',
+               (a.cashiers)[1 + floor(random() * cardinality(a.cashiers))::int],
+               (a.warehouses)[1 + floor(random() * cardinality(a.warehouses))::int]
+        FROM (
+            SELECT (SELECT array_agg(id) FROM products) AS products,
+                   (SELECT array_agg(id) FROM employees WHERE role = 'cashier') AS cashiers,
+                   (SELECT array_agg(id) FROM warehouses) AS warehouses
+            OFFSET 0
+        ) a, generate_series(1, %s) g
+    ''', (sales,))
+    # Без свежей статистики проверки внешних ключей доставок идут перебором sales
+    cursor.execute("ANALYZE sales")
+    cursor.execute("ANALYZE customers")
+
+    # Кладовщик назначен и у ожидающих доставок: на выборку по статусу это не влияет
+    cursor.execute('''
+        INSERT INTO deliveries (sale_id, customer_id, delivery_address, status,
+                                assigned_storekeeper_id, created_date)
+        SELECT s.id,
+               (a.customers)[1 + floor(random() * cardinality(a.customers))::int],
+               'Адрес доставки',
+               (ARRAY['pending', 'assigned', 'in_progress', 'delivered', 'delivered',
+                      'delivered', 'delivered', 'cancelled'])[1 + floor(random() * 8)::int],
+               (a.storekeepers)[1 + floor(random() * cardinality(a.storekeepers))::int],
+               s.sale_date
+        FROM (
+            SELECT (SELECT array_agg(id) FROM customers) AS customers,
+                   (SELECT array_agg(id) FROM employees WHERE role = 'storekeeper') AS storekeepers
+            OFFSET 0
+        ) a, sales s
+        WHERE random() < %s
+    ''', (delivery_ratio,))
+
+    cursor.execute('''
+        INSERT INTO delivery_groups (storekeeper_id, vehicle_info, status, created_date)
+        SELECT e.id, 'Машина ' || g, 'completed', now() - random() * interval '3 years'
+        FROM employees e CROSS JOIN generate_series(1, 200) g
+        WHERE e.role = 'storekeeper'
+    ''')
+
+    for table in ('warehouses', 'employees', 'products', 'deliveries', 'delivery_groups', 'delivery_group_items', 'product_warehouse'):
+        cursor.execute(f"ANALYZE {table}")
+
+
+def explain(cursor, sql, params, show_plan):
+    cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+    plan = [row[0] for row in cursor.fetchall()]
+    execution = next(line for line in plan if line.startswith('Execution Time'))
+    ms = float(re.search(r'([\d.]+) ms', execution).group(1))
+    if show_plan:
+        print('\n'.join('    ' + line for line in plan))
+    return ms
+
+
+def run_queries(cursor, params, show_plans, title):
+    print(f"\n=== {title} ===")
+    timings = {}
+    for name, sql in QUERIES.items():
+        if show_plans:
+            print(f"\n-- {name}")
+        timings[name] = explain(cursor, sql, params, show_plans)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sales', type=int, default=1_000_000)
+    parser.add_argument('--customers', type=int, default=100_000)
+    parser.add_argument('--products', type=int, default=2_000)
+    parser.add_argument('--warehouses', type=int, default=20)
+    parser.add_argument('--delivery-ratio', type=float, default=0.05)
+    parser.add_argument('--plans', action='store_true', help='печатать планы целиком')
+    args = parser.parse_args()
+
+    config = DatabaseConfig()
+    # Создание Database доводит схему до актуальной версии
+    Database(**config.get_connection_params(), pool_min_size=0, catalog_cache=False).close()
+
+    conn = psycopg2.connect(**config.get_connection_params())
+    cursor = conn.cursor()
+    try:
+        started = time.perf_counter()
+        fill_data(cursor, args.sales, args.customers, args.products,
+                  args.warehouses, args.delivery_ratio)
+        print(f"Сгенерировано {args.sales} продаж за {time.perf_counter() - started:.1f} с")
+
+        cursor.execute("SELECT MAX(id) FROM warehouses")
+        warehouse_id = cursor.fetchone()[0]
+        cursor.execute("SELECT MAX(id) FROM employees WHERE role = 'storekeeper'")
+        storekeeper_id = cursor.fetchone()[0]
+        params = {
+            'warehouse_id': warehouse_id,
+            'storekeeper_id': storekeeper_id,
+            'phone': '7' + str(args.customers // 2).zfill(10)
+        }
+
+        for statement in INDEXES:
+            index_name = statement.split(' ON ')[0].split()[-1]
+            cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+        before = run_queries(cursor, params, args.plans, 'Без индексов')
+
+        _v2_secondary_indexes(cursor)
+        for table in ('sales', 'deliveries', 'customers', 'delivery_groups'):
+            cursor.execute(f"ANALYZE {table}")
+        after = run_queries(cursor, params, args.plans, 'С индексами')
+
+        print(f"\n{'Запрос':<38}{'до, мс':>12}{'после, мс':>12}{'ускорение':>12}")
+        for name in QUERIES:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            print(f"{name:<38}{before[name]:>12.2f}{after[name]:>12.2f}{speedup:>11.1f}x")
+    finally:
+        # Ничего не сохраняем: данные и изменения индексов откатываются
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Выигрыш от подготовленных запросов (edb/prepared.py).
+
+Скрипт открывает два Database с одним соединением в пуле, с подготовкой
+запросов и без нее, и по очереди вызывает на обоих горячие методы.
+Разница задержек - время разбора и планирования, которое экономит
+EXECUTE уже подготовленного запроса. Для каждого запроса дополнительно
+выводится, сколько выполнений обошлось общим планом без планирования
+(pg_prepared_statements, PostgreSQL 14+). add_sale меняет данные
+и замеряется только с --writes, запускать его следует на тестовой базе.
+
+    python benchmarks/prepared_statements.py --iterations 500
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(current_dir))
+
+from edb.config import DatabaseConfig
+from edb.database import Database
+from edb.prepared import prepared_text
+
+
+def load_context(db):
+    """Самый загруженный склад, товар с наибольшим остатком на нем и кассир"""
+    with db._connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT warehouse_id FROM sales
+            GROUP BY warehouse_id ORDER BY COUNT(*) DESC LIMIT 1
+        ''')
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("SELECT MIN(id) FROM warehouses")
+            row = cursor.fetchone()
+        warehouse_id = row[0]
+        cursor.execute('''
+            SELECT product_id FROM product_warehouse
+            WHERE warehouse_id = %s ORDER BY quantity DESC LIMIT 1
+        ''', (warehouse_id,))
+        product = cursor.fetchone()
+        cursor.execute("SELECT id FROM employees WHERE role = 'cashier' ORDER BY id LIMIT 1")
+        cashier = cursor.fetchone()
+        cursor.execute("SELECT phone FROM customers ORDER BY id DESC LIMIT 1")
+        customer = cursor.fetchone()
+        conn.rollback()
+    return {
+        'warehouse_id': warehouse_id,
+        'product_id': product[0] if product else None,
+        'cashier_id': cashier[0] if cashier else None,
+        'phone': customer[0] if customer else '',
+    }
+
+
+def benchmarks(ctx, writes):
+    """(имя, вызов с Database)"""
+    warehouse_id = ctx['warehouse_id']
+    product_id = ctx['product_id']
+    result = [
+        ('get_pending_deliveries', lambda db: db.get_pending_deliveries(warehouse_id)),
+        ('get_all_deliveries(warehouse, 200)', lambda db: db.get_all_deliveries(warehouse_id, limit=200)),
+        ('get_product_with_quantity', lambda db: db.get_product_with_quantity(product_id, warehouse_id)),
+        ('get_customer_by_phone', lambda db: db.get_customer_by_phone(ctx['phone'])),
+        ('get_products_with_quantity(warehouse)', lambda db: db.get_products_with_quantity(warehouse_id)),
+        # Выполняется без подготовки на обоих - для сравнения
+        ('get_sales_report(warehouse, 200)', lambda db: db.get_sales_report(warehouse_id, limit=200)),
+    ]
+    if writes:
+        result.append(('add_sale', lambda db: db.add_sale(product_id, 1, 1, ctx['cashier_id'], warehouse_id)))
+    return result
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure(fn, plain, prepared, iterations):
+    """Медианы задержки в мс без подготовки и с ней; вызовы чередуются,
+    чтобы оба варианта попадали в одинаковые условия"""
+    timings = {plain: [], prepared: []}
+    # Первый вызов подготавливает запрос - в замер не входит
+    fn(plain)
+    fn(prepared)
+    for _ in range(iterations):
+        for db in (plain, prepared):
+            started = time.perf_counter()
+            fn(db)
+            timings[db].append(time.perf_counter() - started)
+    return median(timings[plain]) * 1000, median(timings[prepared]) * 1000
+
+
+def plan_usage(db):
+    """Сколько раз подготовленные запросы соединения db выполнялись
+    с общим планом (без планирования) и с планом под параметры.
+
+    Счетчики pg_prepared_statements есть с PostgreSQL 14, на более
+    старых версиях возвращает пустой список.
+    """
+    with db._connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT name, generic_plans, custom_plans FROM pg_prepared_statements ORDER BY name")
+            rows = cursor.fetchall()
+        except Exception:
+            rows = []
+        conn.rollback()
+    return [(' '.join(prepared_text(f"EXECUTE {name}").split())[:70], generic, custom)
+            for name, generic, custom in rows]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--writes', action='store_true', help='замерять и add_sale')
+    parser.add_argument('--json', help='сохранить результаты в файл')
+    args = parser.parse_args()
+
+    config = DatabaseConfig()
+    params = config.get_connection_params()
+    # Одно соединение на Database - все вызовы попадают на подготовленные запросы
+    plain = Database(**params, pool_min_size=1, pool_max_size=1, catalog_cache=False,
+                     prepare_statements=False)
+    prepared = Database(**params, pool_min_size=1, pool_max_size=1, catalog_cache=False)
+    try:
+        ctx = load_context(plain)
+        results = {}
+        print(f"{'Метод':<40}{'без, мс':>10}{'с, мс':>10}{'выигрыш':>10}")
+        for name, fn in benchmarks(ctx, args.writes):
+            plain_ms, prepared_ms = measure(fn, plain, prepared, args.iterations)
+            saved = (plain_ms - prepared_ms) / plain_ms * 100 if plain_ms else 0.0
+            results[name] = {'plain_ms': plain_ms, 'prepared_ms': prepared_ms, 'saved_percent': saved}
+            print(f"{name:<40}{plain_ms:>10.3f}{prepared_ms:>10.3f}{saved:>9.1f}%")
+
+        usage = plan_usage(prepared)
+        if usage:
+            print(f"\n{'Подготовленный запрос':<72}{'общий план':>12}{'свой план':>12}")
+            for text, generic, custom in usage:
+                print(f"{text:<72}{generic:>12}{custom:>12}")
+
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({'iterations': args.iterations, 'results': results}, f, ensure_ascii=False, indent=2)
+            print(f"\nРезультаты сохранены в {args.json}")
+    finally:
+        prepared.close()
+        plain.close()
+
+
+if __name__ == '__main__':
+    main()
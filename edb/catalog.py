@@ -0,0 +1,251 @@
+import threading
+
+from edb.migrations import CATALOG_CHANNEL
+from edb.prepared import execute_prepared
+from edb.rows import Product
+
+# Товары с количеством на складе (%s - склад) или суммарно по всем складам
+_WAREHOUSE_QUERY = '''
+    SELECT p.id, p.name, p.category, p.brand, p.price, p.min_quantity,
+           COALESCE(pw.quantity, 0) as quantity
+    FROM products p
+    LEFT JOIN product_warehouse pw ON p.id = pw.product_id AND pw.warehouse_id = %s
+    {where}
+'''
+_TOTAL_QUERY = '''
+    SELECT p.id, p.name, p.category, p.brand, p.price, p.min_quantity,
+           COALESCE(SUM(pw.quantity), 0) as quantity
+    FROM products p
+    LEFT JOIN product_warehouse pw ON p.id = pw.product_id
+    {where}
+    GROUP BY p.id, p.name, p.category, p.brand, p.price, p.min_quantity
+'''
+
+
+class CatalogCache:
+    """Кэш товаров с остатками в памяти процесса.
+
+    Ключ кэша - склад (None - суммарные остатки по всем складам), склад
+    загружается целиком при первом обращении. Триггеры миграции 4 сообщают
+    через NOTIFY об измененных товарах и остатках, слушатель уведомлений
+    Database передает их кэшу, и тот перечитывает только затронутые товары.
+
+    Кэш отвечает на запросы, только пока слушатель подключен: пропущенные
+    уведомления не восстановить, поэтому при разрыве соединения кэш
+    сбрасывается, а Database обращается к базе напрямую.
+
+    Собственные изменения Database только помечает устаревшими: их
+    перечитывает пришедшее следом уведомление, а если чтение успело
+    раньше него - само чтение, и только помеченные товары.
+
+    Перечитывания одного товара могут идти одновременно из разных потоков
+    и завершаться не в порядке запуска. Каждое получает номер до запроса,
+    и записывается только результат последнего запущенного: он прочитан
+    позже всех изменений, о которых знали остальные.
+    """
+
+    def __init__(self, db, listener):
+        self.db = db
+
+        self._lock = threading.Lock()
+        self._listening = False
+        self._stock = {}    # склад -> {id товара: запись Product}
+        self._loading = {}  # склад -> id товаров, измененных во время загрузки
+        self._versions = {}  # склад -> {id товара: номер последнего перечитывания}
+        self._dirty = {}     # склад -> id товаров, измененных, но еще не перечитанных
+        self._version = 0
+
+        listener.subscribe(CATALOG_CHANNEL, self._notified, self._set_listening)
+
+    # Чтение
+
+    def products(self, warehouse_id, product_ids=None):
+        """Товары склада по возрастанию id или None, если кэш недоступен.
+
+        product_ids - только эти товары, None - все.
+        """
+        stock = self._warehouse(warehouse_id)
+        if stock is None:
+            return None
+        self._refresh_dirty(warehouse_id, product_ids)
+        with self._lock:
+            if product_ids is None:
+                rows = list(stock.values())
+            else:
+                rows = [stock[product_id] for product_id in product_ids if product_id in stock]
+        # Записи неизменяемы - отдаем их без копирования
+        return sorted(rows)
+
+    def product(self, product_id, warehouse_id):
+        """Товар со складским остатком.
+
+        Возвращает (True, товар или None, если товара нет) либо
+        (False, None), если кэш недоступен.
+        """
+        stock = self._warehouse(warehouse_id)
+        if stock is None:
+            return False, None
+        self._refresh_dirty(warehouse_id, (product_id,))
+        return True, stock.get(product_id)
+
+    def _warehouse(self, warehouse_id):
+        warehouse_id = warehouse_id or None
+        with self._lock:
+            if not self._listening:
+                return None
+            stock = self._stock.get(warehouse_id)
+            if stock is not None or warehouse_id in self._loading:
+                # Склад загружается в другом потоке - пока читаем из базы
+                return stock
+            self._loading[warehouse_id] = set()
+
+        try:
+            stock = {row[0]: row for row in self._query(warehouse_id)}
+        except Exception as e:
+            print(f"Ошибка загрузки каталога: {e}")
+            with self._lock:
+                self._loading.pop(warehouse_id, None)
+            return None
+
+        with self._lock:
+            changed = self._loading.pop(warehouse_id, set())
+            if not self._listening:
+                return None
+            self._stock[warehouse_id] = stock
+            # Перечитывания, начатые до загрузки, старше нее
+            self._versions.pop(warehouse_id, None)
+            self._dirty.pop(warehouse_id, None)
+        if changed:
+            # Товары, измененные пока шла загрузка, могли попасть в нее устаревшими
+            self._refresh(warehouse_id, changed)
+        return stock
+
+    # Обновление
+
+    def invalidate(self, product_ids=(), stock=()):
+        """Помечает устаревшими товары product_ids и остатки stock - пары (товар, склад).
+
+        Database вызывает его после своих изменений, чтобы следующее чтение
+        их уже видело, не дожидаясь уведомления. Запросов не выполняет.
+        """
+        changes = self._changes(product_ids, stock)
+        with self._lock:
+            for warehouse_id, changed in changes.items():
+                if warehouse_id in self._loading:
+                    self._loading[warehouse_id].update(changed)
+                elif warehouse_id in self._stock:
+                    self._dirty.setdefault(warehouse_id, set()).update(changed)
+
+    def _refresh_dirty(self, warehouse_id, product_ids=None):
+        """Перечитывает помеченные устаревшими товары из product_ids (None - все)"""
+        warehouse_id = warehouse_id or None
+        with self._lock:
+            dirty = self._dirty.get(warehouse_id)
+            if not dirty:
+                return
+            changed = set(dirty) if product_ids is None else dirty.intersection(product_ids)
+        if changed:
+            self._refresh(warehouse_id, changed)
+
+    def _changes(self, product_ids, stock):
+        """Изменения товаров и остатков в {склад: id товаров} для закэшированных складов"""
+        with self._lock:
+            keys = list(self._stock) + list(self._loading)
+        changes = {}
+        for product_id in product_ids:
+            for key in keys:
+                changes.setdefault(key, set()).add(product_id)
+        for product_id, warehouse_id in stock:
+            for key in (warehouse_id, None):
+                if key in keys:
+                    changes.setdefault(key, set()).add(product_id)
+        return changes
+
+    def _apply(self, changes):
+        """changes - {склад: id товаров}"""
+        for warehouse_id, product_ids in changes.items():
+            with self._lock:
+                if warehouse_id in self._loading:
+                    self._loading[warehouse_id].update(product_ids)
+                    continue
+                if warehouse_id not in self._stock:
+                    continue
+            self._refresh(warehouse_id, product_ids)
+
+    def _refresh(self, warehouse_id, product_ids):
+        product_ids = list(product_ids)
+        with self._lock:
+            self._version += 1
+            version = self._version
+            versions = self._versions.setdefault(warehouse_id, {})
+            for product_id in product_ids:
+                versions[product_id] = version
+            # Запрос увидит все изменения, помеченные до этого момента
+            dirty = self._dirty.get(warehouse_id)
+            if dirty:
+                dirty.difference_update(product_ids)
+        try:
+            rows = {row[0]: row for row in self._query(warehouse_id, product_ids)}
+        except Exception as e:
+            # Состояние склада неизвестно - загрузим его заново при следующем чтении
+            print(f"Ошибка обновления каталога: {e}")
+            with self._lock:
+                self._stock.pop(warehouse_id, None)
+                self._versions.pop(warehouse_id, None)
+                self._dirty.pop(warehouse_id, None)
+            return
+
+        with self._lock:
+            stock = self._stock.get(warehouse_id)
+            versions = self._versions.get(warehouse_id, {})
+            for product_id in product_ids:
+                if versions.get(product_id) != version:
+                    # Товар перечитывается позже - этот результат мог устареть
+                    continue
+                del versions[product_id]
+                if stock is None:
+                    continue
+                if product_id in rows:
+                    stock[product_id] = rows[product_id]
+                else:
+                    # Товар удален
+                    stock.pop(product_id, None)
+
+    def _query(self, warehouse_id, product_ids=None):
+        where = 'WHERE p.id = ANY(%s)' if product_ids is not None else ''
+        with self.db._connection() as conn:
+            cursor = conn.cursor()
+            if warehouse_id:
+                params = (warehouse_id,) if product_ids is None else (warehouse_id, product_ids)
+                execute_prepared(cursor, _WAREHOUSE_QUERY.format(where=where), params)
+            else:
+                params = () if product_ids is None else (product_ids,)
+                execute_prepared(cursor, _TOTAL_QUERY.format(where=where), params)
+            rows = list(map(Product._make, cursor.fetchall()))
+            conn.rollback()
+            return rows
+
+    # Уведомления
+
+    def _set_listening(self, listening):
+        with self._lock:
+            self._listening = listening
+            if not listening:
+                self._stock.clear()
+                self._versions.clear()
+                self._dirty.clear()
+
+    def _notified(self, payloads):
+        self._apply(self._changes(*parse_catalog_payloads(payloads)))
+
+
+def parse_catalog_payloads(payloads):
+    """Уведомления триггеров каталога в (id товаров, пары (товар, склад))"""
+    product_ids, stock = [], []
+    for payload in payloads:
+        product_id, _, warehouse_id = payload.partition(':')
+        if warehouse_id:
+            stock.append((int(product_id), int(warehouse_id)))
+        else:
+            product_ids.append(int(product_id))
+    return product_ids, stock
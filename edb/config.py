@@ -1,6 +1,24 @@
 import json
 import os
 
+# Параметры подключения к PostgreSQL
+CONNECTION_KEYS = ['host', 'port', 'user', 'password', 'database']
+
+# Параметры пула соединений и их значения по умолчанию
+POOL_DEFAULTS = {
+    'pool_min_size': 1,
+    'pool_max_size': 10,
+    'pool_idle_timeout': 300
+}
+
+# Журнал медленных запросов и его значения по умолчанию; относительный
+# путь журнала считается от папки файла конфигурации
+QUERY_LOG_DEFAULTS = {
+    'slow_query_ms': 500,
+    'slow_query_log': 'slow_queries.log',
+    'slow_query_explain': False
+}
+
 class DatabaseConfig:
     def __init__(self, config_file='database_config.json'):
         # Если передан относительный путь, создаем файл в папке приложения
@@ -17,18 +35,14 @@ class DatabaseConfig:
                 with open(self.config_file, 'r', encoding='utf-8') as f:
                     config_data = json.load(f)
                     # Удаляем лишние параметры, которые могут быть в файле
-                    valid_keys = ['host', 'port', 'user', 'password', 'database']
-                    cleaned_config = {k: config_data.get(k) for k in valid_keys}
-                    return cleaned_config
+                    return self._clean_config(config_data)
             except (json.JSONDecodeError, UnicodeDecodeError) as e:
                 print(f"Ошибка чтения конфигурации: {e}")
                 # Пробуем прочитать с другой кодировкой
                 try:
                     with open(self.config_file, 'r', encoding='cp1251') as f:
                         config_data = json.load(f)
-                        valid_keys = ['host', 'port', 'user', 'password', 'database']
-                        cleaned_config = {k: config_data.get(k) for k in valid_keys}
-                        return cleaned_config
+                        return self._clean_config(config_data)
                 except:
                     # Если файл поврежден, создаем новый
                     print("Создаем новый файл конфигурации")
@@ -40,6 +54,13 @@ class DatabaseConfig:
             # Создаем файл с конфигурацией по умолчанию
             return self._create_default_config()
     
+    def _clean_config(self, config_data):
+        """Оставляет только известные параметры, недостающие настройки пула и журнала берет по умолчанию"""
+        cleaned_config = {k: config_data.get(k) for k in CONNECTION_KEYS}
+        for key, default in {**POOL_DEFAULTS, **QUERY_LOG_DEFAULTS}.items():
+            cleaned_config[key] = config_data.get(key, default)
+        return cleaned_config
+    
     def _create_default_config(self):
         """Создает конфигурацию по умолчанию и сохраняет в файл"""
         default_config = {
@@ -47,7 +68,9 @@ class DatabaseConfig:
             "port": 5432,
             "user": "postgres",
             "password": "",
-            "database": "appliance_store"
+            "database": "appliance_store",
+            **POOL_DEFAULTS,
+            **QUERY_LOG_DEFAULTS
         }
         self._save_config(default_config)
         print(f"Создан файл конфигурации: {self.config_file}")
@@ -67,16 +90,27 @@ class DatabaseConfig:
     def update_config(self, new_config):
         """Обновляет конфигурацию и сохраняет в файл"""
         # Очищаем новые настройки от лишних параметров
-        valid_keys = ['host', 'port', 'user', 'password', 'database']
-        cleaned_config = {k: new_config.get(k) for k in valid_keys}
+        known_keys = CONNECTION_KEYS + list(POOL_DEFAULTS) + list(QUERY_LOG_DEFAULTS)
+        cleaned_config = {k: new_config[k] for k in known_keys if k in new_config}
         
         self.config.update(cleaned_config)
         self._save_config(self.config)
     
     def get_connection_params(self):
         """Возвращает параметры подключения (очищенные от лишних параметров)"""
-        valid_keys = ['host', 'port', 'user', 'password', 'database']
-        return {k: self.config.get(k) for k in valid_keys}
+        return {k: self.config.get(k) for k in CONNECTION_KEYS}
+    
+    def get_pool_params(self):
+        """Возвращает параметры пула соединений"""
+        return {k: self.config.get(k, default) for k, default in POOL_DEFAULTS.items()}
+    
+    def get_query_log_params(self):
+        """Возвращает параметры журнала медленных запросов"""
+        params = {k: self.config.get(k, default) for k, default in QUERY_LOG_DEFAULTS.items()}
+        log_path = params['slow_query_log']
+        if log_path and not os.path.isabs(log_path):
+            params['slow_query_log'] = os.path.join(os.path.dirname(self.config_file), log_path)
+        return params
     
     def get_config_file_path(self):
         """Возвращает путь к файлу конфигурации"""
@@ -1,9 +1,50 @@
 import psycopg2
-from datetime import datetime
+from psycopg2.extras import execute_values
+from datetime import datetime, timedelta
 import sys
+from edb.pool import ConnectionPool
+from edb.migrations import (migrate, CATALOG_CHANNEL, DELIVERIES_CHANNEL, SALES_CHANNEL,
+                            SALES_ARCHIVE_SCHEMA, PRODUCT_IMPORT_LOCK_KEY)
+from edb.datagen import CopyStream
+from edb.catalog import CatalogCache
+from edb.notifications import NotificationListener
+from edb.reports import SalesReports
+from edb.inventory import InventoryLedger, MOVEMENT_CONDITION, movement_params, set_movement
+from edb.instrumentation import QueryMetrics
+from edb.prepared import execute_prepared
+from edb.rows import (Customer, Product, Sale, PendingDelivery, Delivery, GroupDelivery,
+                      DeliveryGroup, SALE_SHARED, make_records)
 
 class Database:
-    def __init__(self, host, port, user, password, database):
+    # Запас курсора изменений доставок на транзакции, зафиксированные с задержкой
+    DELIVERY_CURSOR_LAG = timedelta(seconds=10)
+    # На сколько месяцев вперед заранее создаются секции продаж
+    SALES_PARTITIONS_AHEAD = 2
+    # Проверки строк загрузки товаров: (текст ошибки - выражение SQL, условие).
+    # Строке достается первая найденная ошибка, и она не загружается.
+    # Сначала проверяется запись значений, затем - после приведения типов - смысл
+    IMPORT_FORMAT_CHECKS = [
+        ("'Неверный ID товара: ' || product_id", "product_id !~ '^[0-9]{1,9}$'"),
+        ("'Неверная цена: ' || price", "price !~ '^[0-9]{1,8}([.][0-9]{1,2})?$'"),
+        ("'Цена должна быть больше нуля'", "price ~ '^0+([.]0+)?$'"),
+        ("'Неверное мин. количество: ' || min_quantity", "min_quantity !~ '^[0-9]{1,9}$'"),
+        ("'Неверное количество: ' || quantity", "quantity !~ '^[0-9]{1,9}$'"),
+        ("'Название длиннее 200 символов'", "length(name) > 200"),
+        ("'Категория длиннее 100 символов'", "length(category) > 100"),
+        ("'Бренд длиннее 100 символов'", "length(brand) > 100"),
+    ]
+    IMPORT_CHECKS = [
+        ("'Не указаны ID и название товара'", "product IS NULL AND name IS NULL"),
+        ("'Товар не найден: ID ' || product",
+         "product IS NOT NULL AND NOT EXISTS (SELECT 1 FROM products p WHERE p.id = import_rows.product)"),
+        ("'Склад не найден: ' || warehouse", "warehouse IS NOT NULL AND warehouse_id IS NULL"),
+        ("'Не указан склад'", "new_quantity IS NOT NULL AND warehouse_id IS NULL"),
+    ]
+    
+    def __init__(self, host, port, user, password, database,
+                 pool_min_size=1, pool_max_size=10, pool_idle_timeout=300,
+                 catalog_cache=True, slow_query_ms=None, slow_query_log=None,
+                 slow_query_explain=False, prepare_statements=True):
         self.connection_params = {
             'host': host,
             'port': port,
@@ -11,1116 +52,1597 @@ class Database:
             'password': password,
             'database': database
         }
-        self._create_tables()
+        # Время, строки и ожидание соединения каждого запроса по имени метода;
+        # запросы дольше slow_query_ms пишутся в журнал slow_query_log
+        self.metrics = QueryMetrics(slow_query_ms, slow_query_log, slow_query_explain)
+        self.pool = ConnectionPool(
+            self.connection_params,
+            min_size=pool_min_size,
+            max_size=pool_max_size,
+            idle_timeout=pool_idle_timeout,
+            metrics=self.metrics,
+            # Горячие запросы подготавливаются на сервере один раз на соединение
+            prepare_statements=prepare_statements
+        )
+        # Режим поиска клиентов определяется при первом поиске
+        self._customer_search_substring = None
+        self._migrate()
+        # Одно соединение на процесс слушает уведомления триггеров; поток
+        # слушателя запускает start
+        self.notifications = NotificationListener(
+            self.connection_params, (CATALOG_CHANNEL, DELIVERIES_CHANNEL, SALES_CHANNEL)
+        )
+        # Товары с остатками отдаются из памяти, пока кэш получает уведомления об изменениях
+        self.catalog = CatalogCache(self, self.notifications) if catalog_cache else None
+        # Отчеты по дневным итогам продаж
+        self.reports = SalesReports(self)
+        # Журнал движения товаров
+        self.inventory = InventoryLedger(self)
+    
+    def start(self):
+        """Запуск приложения: секции продаж на ближайшие месяцы, недостающие
+        снимки остатков и поток слушателя уведомлений.
+        
+        Конструктор этого не делает, чтобы временные экземпляры (проверка
+        настроек, скрипты, замеры) создавались быстро и без лишних потоков.
+        Пока start не вызван, кэш каталога не работает и чтения идут в базу.
+        """
+        self.ensure_sales_partitions()
+        self.inventory.take_snapshots()
+        self.notifications.start()
+    
+    def _connection(self):
+        """Берет соединение из пула на время блока with"""
+        return self.pool.connection()
+    
+    def _catalog_changed(self, product_ids=(), stock=()):
+        """Помечает в кэше каталога собственные изменения: их перечитает
+        уведомление или следующее чтение, а не пишущий поток"""
+        if self.catalog is not None:
+            self.catalog.invalidate(product_ids, stock)
+    
+    def close(self):
+        """Закрывает все соединения пула"""
+        self.notifications.close()
+        self.pool.closeall()
     
-    def _get_connection(self):
-        try:
-            return psycopg2.connect(**self.connection_params)
-        except Exception as e:
-            print(f"Ошибка подключения к БД: {e}")
-            raise
+    def _migrate(self):
+        """Доводит схему базы данных до актуальной версии"""
+        with self._connection() as conn:
+            try:
+                applied = migrate(conn)
+                if applied:
+                    print(f"Применены миграции схемы: {', '.join(map(str, applied))}")
+            except Exception as e:
+                print(f"Ошибка при обновлении схемы: {e}")
+                raise
     
-    def _create_tables(self):
-        conn = self._get_connection()
-        cursor = conn.cursor()
+    def ensure_sales_partitions(self, months_ahead=None):
+        """Создает секции продаж текущего и следующих months_ahead месяцев"""
+        if months_ahead is None:
+            months_ahead = self.SALES_PARTITIONS_AHEAD
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    SELECT create_sales_partition((date_trunc('month', now()) + n * interval '1 month')::date)
+                    FROM generate_series(0, %s) AS n
+                ''', (months_ahead,))
+                created = sum(1 for (is_new,) in cursor.fetchall() if is_new)
+                conn.commit()
+                return created
+            except Exception as e:
+                print(f"Ошибка создания секций продаж: {e}")
+                conn.rollback()
+                return 0
+    
+    def archive_sales_partitions(self, keep_months=24):
+        """Отключает секции продаж старше keep_months месяцев и переносит их в архивную схему.
         
-        try:
-            # Таблица складов
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS warehouses (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(200) NOT NULL,
-                    address VARCHAR(300) NOT NULL
-                )
-            ''')
-            
-            # Таблица сотрудников 
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS employees (
-                    id SERIAL PRIMARY KEY,
-                    login VARCHAR(100) UNIQUE NOT NULL,
-                    password VARCHAR(100) NOT NULL,
-                    full_name VARCHAR(200) NOT NULL,
-                    role VARCHAR(50) NOT NULL,
-                    phone VARCHAR(20),
-                    email VARCHAR(100),
-                    warehouse_id INTEGER REFERENCES warehouses(id)
-                )
-            ''')
-            
-            # Таблица товаров
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS products (
-                    id SERIAL PRIMARY KEY,
-                    name VARCHAR(200) NOT NULL,
-                    category VARCHAR(100) NOT NULL,
-                    brand VARCHAR(100),
-                    price DECIMAL(10, 2) NOT NULL,
-                    min_quantity INTEGER NOT NULL DEFAULT 0
-                )
-            ''')
-            
-            # Таблица наличия товаров на складах
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS product_warehouse (
-                    id SERIAL PRIMARY KEY,
-                    product_id INTEGER REFERENCES products(id),
-                    warehouse_id INTEGER REFERENCES warehouses(id),
-                    quantity INTEGER NOT NULL DEFAULT 0,
-                    UNIQUE(product_id, warehouse_id)
-                )
-            ''')
-            
-            # Таблица продаж
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sales (
-                    id SERIAL PRIMARY KEY,
-                    product_id INTEGER REFERENCES products(id),
-                    quantity INTEGER NOT NULL,
-                    total_price DECIMAL(10, 2) NOT NULL,
-                    sale_date TIMESTAMP NOT NULL,
-                    cashier_id INTEGER REFERENCES employees(id),
-                    warehouse_id INTEGER REFERENCES warehouses(id),
-                    status VARCHAR(20) DEFAULT 'completed'
-                )
-            ''')
-            
-            # НОВАЯ ТАБЛИЦА: Клиенты
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS customers (
-                    id SERIAL PRIMARY KEY,
-                    full_name VARCHAR(200) NOT NULL,
-                    phone VARCHAR(20) NOT NULL,
-                    email VARCHAR(100),
-                    address TEXT NOT NULL,
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # НОВАЯ ТАБЛИЦА: Доставки
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS deliveries (
-                    id SERIAL PRIMARY KEY,
-                    sale_id INTEGER REFERENCES sales(id),
-                    customer_id INTEGER REFERENCES customers(id),
-                    delivery_address TEXT NOT NULL,
-                    status VARCHAR(50) DEFAULT 'pending', -- pending, assigned, in_progress, delivered, cancelled
-                    assigned_storekeeper_id INTEGER REFERENCES employees(id),
-                    delivery_date TIMESTAMP,
-                    notes TEXT,
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # НОВАЯ ТАБЛИЦА: Группы доставки (несколько заказов в одной машине)
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS delivery_groups (
-                    id SERIAL PRIMARY KEY,
-                    storekeeper_id INTEGER REFERENCES employees(id),
-                    vehicle_info VARCHAR(200),
-                    status VARCHAR(50) DEFAULT 'preparing', -- preparing, in_progress, completed
-                    created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    completed_date TIMESTAMP
-                )
-            ''')
-            
-            # НОВАЯ ТАБЛИЦА: Связь доставок с группами
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS delivery_group_items (
-                    id SERIAL PRIMARY KEY,
-                    delivery_group_id INTEGER REFERENCES delivery_groups(id),
-                    delivery_id INTEGER REFERENCES deliveries(id),
-                    UNIQUE(delivery_id)
-                )
-            ''')
-            
-            # Добавляем основной склад по умолчанию
-            cursor.execute("SELECT COUNT(*) FROM warehouses")
-            if cursor.fetchone()[0] == 0:
-                cursor.execute(
-                    "INSERT INTO warehouses (name, address) VALUES (%s, %s) RETURNING id",
-                    ('Основной склад', 'Главный адрес склада')
-                )
-                main_warehouse_id = cursor.fetchone()[0]
-                
-            # Добавляем администратора по умолчанию
-            cursor.execute("SELECT COUNT(*) FROM employees WHERE role = 'admin'")
-            if cursor.fetchone()[0] == 0:
-                cursor.execute(
-                    "INSERT INTO employees (login, password, full_name, role, warehouse_id) VALUES (%s, %s, %s, %s, %s)",
-                    ('admin', 'admin123', 'Администратор', 'admin', main_warehouse_id)
-                )
+        Продажи архивных месяцев пропадают из отчетов по строкам, но
+        остаются в итогах sales_daily; их доставки остаются в списках без
+        товара. Секции, по продажам которых есть незавершенные доставки,
+        пропускаются. Возвращает имена перенесенных секций или None при ошибке.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    SELECT c.relname
+                    FROM pg_inherits i
+                    JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = 'sales'::regclass AND c.relname ~ '^sales_[0-9]{4}_[0-9]{2}$'
+                    ORDER BY c.relname
+                ''')
+                partitions = [row[0] for row in cursor.fetchall()]
                 
-            # Добавляем кассира по умолчанию
-            cursor.execute("SELECT COUNT(*) FROM employees WHERE role = 'cashier'")
-            if cursor.fetchone()[0] == 0:
-                cursor.execute(
-                    "INSERT INTO employees (login, password, full_name, role, warehouse_id) VALUES (%s, %s, %s, %s, %s)",
-                    ('cashier', 'cashier123', 'Кассир', 'cashier', main_warehouse_id)
-                )
+                today = datetime.now()
+                months = today.year * 12 + today.month - 1 - keep_months
+                cutoff = f"sales_{months // 12:04d}_{months % 12 + 1:02d}"
                 
-            # Добавляем кладовщика по умолчанию
-            cursor.execute("SELECT COUNT(*) FROM employees WHERE role = 'storekeeper'")
-            if cursor.fetchone()[0] == 0:
-                cursor.execute(
-                    "INSERT INTO employees (login, password, full_name, role, warehouse_id) VALUES (%s, %s, %s, %s, %s)",
-                    ('storekeeper', 'storekeeper123', 'Работник склада', 'storekeeper', main_warehouse_id)
-                )
-            
-            conn.commit()
-            print("Таблицы успешно созданы/проверены")
-            
-        except Exception as e:
-            print(f"Ошибка при создании таблиц: {e}")
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
+                archived = []
+                # Имена секций сравниваются как даты: sales_ГГГГ_ММ
+                for name in partitions:
+                    if name >= cutoff:
+                        break
+                    cursor.execute(f'''
+                        SELECT EXISTS (
+                            SELECT 1 FROM deliveries d
+                            JOIN {name} s ON s.id = d.sale_id
+                            WHERE d.status NOT IN ('delivered', 'cancelled')
+                        )
+                    ''')
+                    if cursor.fetchone()[0]:
+                        continue
+                    cursor.execute(f"ALTER TABLE sales DETACH PARTITION {name}")
+                    cursor.execute(f"ALTER TABLE {name} SET SCHEMA {SALES_ARCHIVE_SCHEMA}")
+                    archived.append(name)
+                conn.commit()
+                return archived
+            except Exception as e:
+                print(f"Ошибка архивации секций продаж: {e}")
+                conn.rollback()
+                return None
     
     def create_customer(self, full_name, phone, email, address):
         """Создает нового клиента"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                INSERT INTO customers (full_name, phone, email, address)
-                VALUES (%s, %s, %s, %s)
-            ''', (full_name, phone, email, address))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка создания клиента: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO customers (full_name, phone, email, address)
+                    VALUES (%s, %s, %s, %s)
+                ''', (full_name, phone, email, address))
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка создания клиента: {e}")
+                return False
     
     def get_customer_by_phone(self, phone):
         """Находит клиента по телефону"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                SELECT id, full_name, phone, email, address 
-                FROM customers 
-                WHERE phone = %s
-            ''', (phone,))
-            result = cursor.fetchone()
-            
-            if result:
-                return {
-                    'id': result[0],
-                    'full_name': result[1],
-                    'phone': result[2],
-                    'email': result[3],
-                    'address': result[4]
-                }
-            return None
-        except Exception as e:
-            print(f"Ошибка поиска клиента: {e}")
-            return None
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                execute_prepared(cursor, '''
+                    SELECT id, full_name, phone, email, address, created_date
+                    FROM customers 
+                    WHERE phone = %s
+                ''', (phone,))
+                result = cursor.fetchone()
+                return Customer._make(result) if result else None
+            except Exception as e:
+                print(f"Ошибка поиска клиента: {e}")
+                return None
     
     def get_all_customers(self):
         """Получает всех клиентов"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                SELECT id, full_name, phone, email, address, created_date
-                FROM customers 
-                ORDER BY created_date DESC
-            ''')
-            customers = cursor.fetchall()
-            
-            result = []
-            for customer in customers:
-                result.append({
-                    'id': customer[0],
-                    'full_name': customer[1],
-                    'phone': customer[2],
-                    'email': customer[3],
-                    'address': customer[4],
-                    'created_date': customer[5].strftime("%Y-%m-%d %H:%M:%S")
-                })
-            return result
-        except Exception as e:
-            print(f"Ошибка получения клиентов: {e}")
-            return []
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    SELECT id, full_name, phone, email, address, created_date
+                    FROM customers 
+                    ORDER BY created_date DESC
+                ''')
+                return list(map(Customer._make, cursor.fetchall()))
+            except Exception as e:
+                print(f"Ошибка получения клиентов: {e}")
+                return []
+    
+    def search_customers(self, query, limit=100):
+        """Ищет клиентов по ФИО или телефону.
+
+        С pg_trgm ищется подстрока, без него - префикс (см. миграцию 3).
+        Пустой запрос возвращает последних добавленных клиентов.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if self._customer_search_substring is None:
+                    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                    self._customer_search_substring = cursor.fetchone() is not None
+                
+                query = query.strip()
+                if not query:
+                    cursor.execute('''
+                        SELECT id, full_name, phone, email, address, created_date
+                        FROM customers
+                        ORDER BY created_date DESC
+                        LIMIT %s
+                    ''', (limit,))
+                else:
+                    # Спецсимволы LIKE в запросе ищутся как обычные символы,
+                    # регистр приводится на сервере, как и в индексе
+                    pattern = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                    if self._customer_search_substring:
+                        pattern = '%' + pattern
+                    cursor.execute('''
+                        SELECT id, full_name, phone, email, address, created_date
+                        FROM customers
+                        WHERE lower(full_name) LIKE lower(%s) OR phone LIKE %s
+                        ORDER BY full_name
+                        LIMIT %s
+                    ''', (pattern, pattern, limit))
+                return list(map(Customer._make, cursor.fetchall()))
+            except Exception as e:
+                print(f"Ошибка поиска клиентов: {e}")
+                return []
     
     def get_customer_by_id(self, customer_id):
         """Получает клиента по ID"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                SELECT id, full_name, phone, email, address 
-                FROM customers 
-                WHERE id = %s
-            ''', (customer_id,))
-            result = cursor.fetchone()
-            
-            if result:
-                return {
-                    'id': result[0],
-                    'full_name': result[1],
-                    'phone': result[2],
-                    'email': result[3],
-                    'address': result[4]
-                }
-            return None
-        except Exception as e:
-            print(f"Ошибка получения клиента: {e}")
-            return None
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    SELECT id, full_name, phone, email, address, created_date
+                    FROM customers 
+                    WHERE id = %s
+                ''', (customer_id,))
+                result = cursor.fetchone()
+                return Customer._make(result) if result else None
+            except Exception as e:
+                print(f"Ошибка получения клиента: {e}")
+                return None
     
     def update_customer(self, customer_id, full_name, phone, email, address):
         """Обновляет данные клиента"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                UPDATE customers 
-                SET full_name = %s, phone = %s, email = %s, address = %s
-                WHERE id = %s
-            ''', (full_name, phone, email, address, customer_id))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка обновления клиента: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    UPDATE customers 
+                    SET full_name = %s, phone = %s, email = %s, address = %s
+                    WHERE id = %s
+                ''', (full_name, phone, email, address, customer_id))
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка обновления клиента: {e}")
+                return False
     
     def delete_customer(self, customer_id):
         """Удаляет клиента"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("DELETE FROM customers WHERE id = %s", (customer_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка удаления клиента: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("DELETE FROM customers WHERE id = %s", (customer_id,))
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка удаления клиента: {e}")
+                return False
     
     def create_delivery(self, sale_id, customer_id, delivery_address, notes=''):
         """Создает доставку для продажи"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                INSERT INTO deliveries (sale_id, customer_id, delivery_address, notes)
-                VALUES (%s, %s, %s, %s)
-            ''', (sale_id, customer_id, delivery_address, notes))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка создания доставки: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO deliveries (sale_id, customer_id, delivery_address, notes)
+                    VALUES (%s, %s, %s, %s)
+                ''', (sale_id, customer_id, delivery_address, notes))
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка создания доставки: {e}")
+                return False
     
     def get_pending_deliveries(self, warehouse_id=None):
         """Получает ожидающие доставки"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            if warehouse_id:
-                cursor.execute('''
-                    SELECT d.id, d.delivery_address, d.status, d.created_date,
-                           c.full_name, c.phone, c.email,
-                           p.name as product_name, s.quantity,
-                           e.full_name as cashier_name,
-                           w.name as warehouse_name
-                    FROM deliveries d
-                    JOIN customers c ON d.customer_id = c.id
-                    JOIN sales s ON d.sale_id = s.id
-                    JOIN products p ON s.product_id = p.id
-                    JOIN employees e ON s.cashier_id = e.id
-                    JOIN warehouses w ON s.warehouse_id = w.id
-                    WHERE d.status = 'pending' AND s.warehouse_id = %s
-                    ORDER BY d.created_date
-                ''', (warehouse_id,))
-            else:
-                cursor.execute('''
-                    SELECT d.id, d.delivery_address, d.status, d.created_date,
-                           c.full_name, c.phone, c.email,
-                           p.name as product_name, s.quantity,
-                           e.full_name as cashier_name,
-                           w.name as warehouse_name
-                    FROM deliveries d
-                    JOIN customers c ON d.customer_id = c.id
-                    JOIN sales s ON d.sale_id = s.id
-                    JOIN products p ON s.product_id = p.id
-                    JOIN employees e ON s.cashier_id = e.id
-                    JOIN warehouses w ON s.warehouse_id = w.id
-                    WHERE d.status = 'pending'
-                    ORDER BY d.created_date
-                ''')
-            
-            deliveries = cursor.fetchall()
-            
-            result = []
-            for delivery in deliveries:
-                result.append({
-                    'id': delivery[0],
-                    'delivery_address': delivery[1],
-                    'status': delivery[2],
-                    'created_date': delivery[3].strftime("%Y-%m-%d %H:%M:%S"),
-                    'customer_name': delivery[4],
-                    'customer_phone': delivery[5],
-                    'customer_email': delivery[6],
-                    'product_name': delivery[7],
-                    'quantity': delivery[8],
-                    'cashier_name': delivery[9],
-                    'warehouse_name': delivery[10]
-                })
-            return result
-        except Exception as e:
-            print(f"Ошибка получения доставок: {e}")
-            return []
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if warehouse_id:
+                    execute_prepared(cursor, '''
+                        SELECT d.id, d.delivery_address, d.status, d.created_date,
+                               c.full_name, c.phone, c.email,
+                               COALESCE(p.name, 'Продажа в архиве') as product_name, s.quantity,
+                               e.full_name as cashier_name,
+                               w.name as warehouse_name
+                        FROM deliveries d
+                        JOIN customers c ON d.customer_id = c.id
+                        LEFT JOIN sales s ON d.sale_id = s.id
+                        LEFT JOIN products p ON s.product_id = p.id
+                        LEFT JOIN employees e ON s.cashier_id = e.id
+                        LEFT JOIN warehouses w ON s.warehouse_id = w.id
+                        WHERE d.status = 'pending' AND s.warehouse_id = %s
+                        ORDER BY d.created_date
+                    ''', (warehouse_id,))
+                else:
+                    execute_prepared(cursor, '''
+                        SELECT d.id, d.delivery_address, d.status, d.created_date,
+                               c.full_name, c.phone, c.email,
+                               COALESCE(p.name, 'Продажа в архиве') as product_name, s.quantity,
+                               e.full_name as cashier_name,
+                               w.name as warehouse_name
+                        FROM deliveries d
+                        JOIN customers c ON d.customer_id = c.id
+                        LEFT JOIN sales s ON d.sale_id = s.id
+                        LEFT JOIN products p ON s.product_id = p.id
+                        LEFT JOIN employees e ON s.cashier_id = e.id
+                        LEFT JOIN warehouses w ON s.warehouse_id = w.id
+                        WHERE d.status = 'pending'
+                        ORDER BY d.created_date
+                    ''')
+                
+                return list(map(PendingDelivery._make, cursor.fetchall()))
+            except Exception as e:
+                print(f"Ошибка получения доставок: {e}")
+                return []
     
-    def get_all_deliveries(self, warehouse_id=None):
-        """Получает все доставки"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            if warehouse_id:
-                cursor.execute('''
-                    SELECT d.id, d.delivery_address, d.status, d.created_date, d.delivery_date,
-                           c.full_name, c.phone, c.email,
-                           p.name as product_name, s.quantity,
-                           e.full_name as cashier_name, emp.full_name as storekeeper_name,
-                           w.name as warehouse_name, dg.vehicle_info
-                    FROM deliveries d
-                    JOIN customers c ON d.customer_id = c.id
-                    JOIN sales s ON d.sale_id = s.id
-                    JOIN products p ON s.product_id = p.id
-                    JOIN employees e ON s.cashier_id = e.id
-                    LEFT JOIN employees emp ON d.assigned_storekeeper_id = emp.id
-                    LEFT JOIN delivery_group_items dgi ON d.id = dgi.delivery_id
-                    LEFT JOIN delivery_groups dg ON dgi.delivery_group_id = dg.id
-                    JOIN warehouses w ON s.warehouse_id = w.id
-                    WHERE s.warehouse_id = %s
-                    ORDER BY d.created_date DESC
-                ''', (warehouse_id,))
-            else:
-                cursor.execute('''
-                    SELECT d.id, d.delivery_address, d.status, d.created_date, d.delivery_date,
-                           c.full_name, c.phone, c.email,
-                           p.name as product_name, s.quantity,
-                           e.full_name as cashier_name, emp.full_name as storekeeper_name,
-                           w.name as warehouse_name, dg.vehicle_info
-                    FROM deliveries d
-                    JOIN customers c ON d.customer_id = c.id
-                    JOIN sales s ON d.sale_id = s.id
-                    JOIN products p ON s.product_id = p.id
-                    JOIN employees e ON s.cashier_id = e.id
-                    LEFT JOIN employees emp ON d.assigned_storekeeper_id = emp.id
-                    LEFT JOIN delivery_group_items dgi ON d.id = dgi.delivery_id
-                    LEFT JOIN delivery_groups dg ON dgi.delivery_group_id = dg.id
-                    JOIN warehouses w ON s.warehouse_id = w.id
-                    ORDER BY d.created_date DESC
-                ''')
-            
-            deliveries = cursor.fetchall()
-            
-            result = []
-            for delivery in deliveries:
-                result.append({
-                    'id': delivery[0],
-                    'delivery_address': delivery[1],
-                    'status': delivery[2],
-                    'created_date': delivery[3].strftime("%Y-%m-%d %H:%M:%S"),
-                    'delivery_date': delivery[4].strftime("%Y-%m-%d %H:%M:%S") if delivery[4] else '',
-                    'customer_name': delivery[5],
-                    'customer_phone': delivery[6],
-                    'customer_email': delivery[7],
-                    'product_name': delivery[8],
-                    'quantity': delivery[9],
-                    'cashier_name': delivery[10],
-                    'storekeeper_name': delivery[11] or 'Не назначен',
-                    'warehouse_name': delivery[12],
-                    'vehicle_info': delivery[13] or 'Не назначен'
-                })
-            return result
-        except Exception as e:
-            print(f"Ошибка получения доставок: {e}")
-            return []
-        finally:
-            conn.close()
+    def get_all_deliveries(self, warehouse_id=None, statuses=None, storekeeper_id=None,
+                           date_from=None, date_to=None, limit=None):
+        """Получает доставки от новых к старым.
+
+        statuses - допустимые статусы, storekeeper_id - назначенный кладовщик,
+        date_from/date_to - диапазон даты создания [date_from, date_to),
+        limit - сколько доставок вернуть. None - без ограничения.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                conditions = []
+                params = []
+                if warehouse_id:
+                    conditions.append("s.warehouse_id = %s")
+                    params.append(warehouse_id)
+                if statuses:
+                    conditions.append("d.status = ANY(%s)")
+                    params.append(list(statuses))
+                if storekeeper_id:
+                    conditions.append("d.assigned_storekeeper_id = %s")
+                    params.append(storekeeper_id)
+                if date_from:
+                    conditions.append("d.created_date >= %s")
+                    params.append(date_from)
+                if date_to:
+                    conditions.append("d.created_date < %s")
+                    params.append(date_to)
+                
+                return self._select_deliveries(cursor, conditions, params, limit)
+            except Exception as e:
+                print(f"Ошибка получения доставок: {e}")
+                return []
+    
+    def get_deliveries_changed_since(self, since, warehouse_id=None):
+        """Доставки, измененные после since, и курсор для следующего вызова.
+        
+        Возвращает (доставки в формате get_all_deliveries, курсор); при
+        since=None доставок нет - только начальный курсор. Курсор отстает
+        от времени сервера на DELIVERY_CURSOR_LAG, чтобы не пропустить
+        изменения транзакций, зафиксированных позже, поэтому одна и та же
+        доставка может прийти повторно. None при ошибке.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT now() - %s", (self.DELIVERY_CURSOR_LAG,))
+                next_cursor = cursor.fetchone()[0]
+                if since is None:
+                    return [], next_cursor
+                
+                conditions = ["d.updated_at > %s"]
+                params = [since]
+                if warehouse_id:
+                    conditions.append("s.warehouse_id = %s")
+                    params.append(warehouse_id)
+                
+                return self._select_deliveries(cursor, conditions, params), next_cursor
+            except Exception as e:
+                print(f"Ошибка получения изменений доставок: {e}")
+                return None
+    
+    def _deliveries_query(self, conditions):
+        """Запрос доставок с условиями conditions от новых к старым"""
+        query = '''
+            SELECT d.id, d.delivery_address, d.status, d.created_date, d.delivery_date,
+                   c.full_name, c.phone, c.email,
+                   COALESCE(p.name, 'Продажа в архиве') as product_name, s.quantity,
+                   e.full_name as cashier_name,
+                   COALESCE(emp.full_name, 'Не назначен') as storekeeper_name,
+                   w.name as warehouse_name, COALESCE(dg.vehicle_info, 'Не назначен'),
+                   d.assigned_storekeeper_id
+            FROM deliveries d
+            JOIN customers c ON d.customer_id = c.id
+            -- Продажи архивных секций уже не найти, а доставки остаются в истории
+            LEFT JOIN sales s ON d.sale_id = s.id
+            LEFT JOIN products p ON s.product_id = p.id
+            LEFT JOIN employees e ON s.cashier_id = e.id
+            LEFT JOIN employees emp ON d.assigned_storekeeper_id = emp.id
+            LEFT JOIN delivery_group_items dgi ON d.id = dgi.delivery_id
+            LEFT JOIN delivery_groups dg ON dgi.delivery_group_id = dg.id
+            LEFT JOIN warehouses w ON s.warehouse_id = w.id
+        '''
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        return query + " ORDER BY d.created_date DESC, d.id DESC"
+    
+    def _select_deliveries(self, cursor, conditions, params, limit=None):
+        """Выполняет запрос доставок с условиями conditions, строки - записи Delivery"""
+        query = self._deliveries_query(conditions)
+        params = list(params)
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit)
+        
+        execute_prepared(cursor, query, params)
+        return list(map(Delivery._make, cursor.fetchall()))
     
     def assign_delivery_to_storekeeper(self, delivery_id, storekeeper_id):
         """Назначает доставку кладовщику"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                UPDATE deliveries 
-                SET assigned_storekeeper_id = %s, status = 'assigned'
-                WHERE id = %s
-            ''', (storekeeper_id, delivery_id))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка назначения доставки: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    UPDATE deliveries 
+                    SET assigned_storekeeper_id = %s, status = 'assigned'
+                    WHERE id = %s
+                ''', (storekeeper_id, delivery_id))
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка назначения доставки: {e}")
+                return False
     
     def create_delivery_group(self, storekeeper_id, vehicle_info):
         """Создает группу доставки"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                INSERT INTO delivery_groups (storekeeper_id, vehicle_info)
-                VALUES (%s, %s)
-                RETURNING id
-            ''', (storekeeper_id, vehicle_info))
-            group_id = cursor.fetchone()[0]
-            conn.commit()
-            return group_id
-        except Exception as e:
-            print(f"Ошибка создания группы доставки: {e}")
-            return None
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO delivery_groups (storekeeper_id, vehicle_info)
+                    VALUES (%s, %s)
+                    RETURNING id
+                ''', (storekeeper_id, vehicle_info))
+                group_id = cursor.fetchone()[0]
+                conn.commit()
+                return group_id
+            except Exception as e:
+                print(f"Ошибка создания группы доставки: {e}")
+                return None
     
     def add_delivery_to_group(self, delivery_group_id, delivery_id):
         """Добавляет доставку в группу"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                INSERT INTO delivery_group_items (delivery_group_id, delivery_id)
-                VALUES (%s, %s)
-            ''', (delivery_group_id, delivery_id))
-            
-            cursor.execute('''
-                UPDATE deliveries 
-                SET status = 'in_progress'
-                WHERE id = %s
-            ''', (delivery_id,))
-            
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка добавления доставки в группу: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO delivery_group_items (delivery_group_id, delivery_id)
+                    VALUES (%s, %s)
+                ''', (delivery_group_id, delivery_id))
+                
+                cursor.execute('''
+                    UPDATE deliveries 
+                    SET status = 'in_progress'
+                    WHERE id = %s
+                ''', (delivery_id,))
+                
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка добавления доставки в группу: {e}")
+                return False
     
     def complete_delivery(self, delivery_id):
         """Завершает доставку"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                UPDATE deliveries 
-                SET status = 'delivered', delivery_date = CURRENT_TIMESTAMP
-                WHERE id = %s
-            ''', (delivery_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка завершения доставки: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    UPDATE deliveries 
+                    SET status = 'delivered', delivery_date = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                ''', (delivery_id,))
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка завершения доставки: {e}")
+                return False
+    
+    def cancel_delivery(self, delivery_id):
+        """Отменяет доставку"""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    UPDATE deliveries 
+                    SET status = 'cancelled'
+                    WHERE id = %s
+                ''', (delivery_id,))
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка отмены доставки: {e}")
+                return False
     
     def complete_delivery_group(self, delivery_group_id):
         """Завершает группу доставки"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                UPDATE delivery_groups 
-                SET status = 'completed', completed_date = CURRENT_TIMESTAMP
-                WHERE id = %s
-            ''', (delivery_group_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка завершения группы доставки: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    UPDATE delivery_groups 
+                    SET status = 'completed', completed_date = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                ''', (delivery_group_id,))
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка завершения группы доставки: {e}")
+                return False
     
     def get_delivery_groups(self, storekeeper_id=None):
         """Получает группы доставки"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            if storekeeper_id:
-                cursor.execute('''
-                    SELECT dg.id, dg.vehicle_info, dg.status, dg.created_date, dg.completed_date,
-                           e.full_name as storekeeper_name,
-                           COUNT(dgi.delivery_id) as delivery_count
-                    FROM delivery_groups dg
-                    JOIN employees e ON dg.storekeeper_id = e.id
-                    LEFT JOIN delivery_group_items dgi ON dg.id = dgi.delivery_group_id
-                    WHERE dg.storekeeper_id = %s
-                    GROUP BY dg.id, dg.vehicle_info, dg.status, dg.created_date, dg.completed_date, e.full_name
-                    ORDER BY dg.created_date DESC
-                ''', (storekeeper_id,))
-            else:
-                cursor.execute('''
-                    SELECT dg.id, dg.vehicle_info, dg.status, dg.created_date, dg.completed_date,
-                           e.full_name as storekeeper_name,
-                           COUNT(dgi.delivery_id) as delivery_count
-                    FROM delivery_groups dg
-                    JOIN employees e ON dg.storekeeper_id = e.id
-                    LEFT JOIN delivery_group_items dgi ON dg.id = dgi.delivery_group_id
-                    GROUP BY dg.id, dg.vehicle_info, dg.status, dg.created_date, dg.completed_date, e.full_name
-                    ORDER BY dg.created_date DESC
-                ''')
-            
-            groups = cursor.fetchall()
-            
-            result = []
-            for group in groups:
-                result.append({
-                    'id': group[0],
-                    'vehicle_info': group[1],
-                    'status': group[2],
-                    'created_date': group[3].strftime("%Y-%m-%d %H:%M:%S"),
-                    'completed_date': group[4].strftime("%Y-%m-%d %H:%M:%S") if group[4] else '',
-                    'storekeeper_name': group[5],
-                    'delivery_count': group[6]
-                })
-            return result
-        except Exception as e:
-            print(f"Ошибка получения групп доставки: {e}")
-            return []
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if storekeeper_id:
+                    cursor.execute('''
+                        SELECT dg.id, dg.vehicle_info, dg.status, dg.created_date, dg.completed_date,
+                               e.full_name as storekeeper_name,
+                               COUNT(dgi.delivery_id) as delivery_count
+                        FROM delivery_groups dg
+                        JOIN employees e ON dg.storekeeper_id = e.id
+                        LEFT JOIN delivery_group_items dgi ON dg.id = dgi.delivery_group_id
+                        WHERE dg.storekeeper_id = %s
+                        GROUP BY dg.id, dg.vehicle_info, dg.status, dg.created_date, dg.completed_date, e.full_name
+                        ORDER BY dg.created_date DESC
+                    ''', (storekeeper_id,))
+                else:
+                    cursor.execute('''
+                        SELECT dg.id, dg.vehicle_info, dg.status, dg.created_date, dg.completed_date,
+                               e.full_name as storekeeper_name,
+                               COUNT(dgi.delivery_id) as delivery_count
+                        FROM delivery_groups dg
+                        JOIN employees e ON dg.storekeeper_id = e.id
+                        LEFT JOIN delivery_group_items dgi ON dg.id = dgi.delivery_group_id
+                        GROUP BY dg.id, dg.vehicle_info, dg.status, dg.created_date, dg.completed_date, e.full_name
+                        ORDER BY dg.created_date DESC
+                    ''')
+                
+                return list(map(DeliveryGroup._make, cursor.fetchall()))
+            except Exception as e:
+                print(f"Ошибка получения групп доставки: {e}")
+                return []
     
     def get_deliveries_in_group(self, delivery_group_id):
         """Получает доставки в группе"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                SELECT d.id, d.delivery_address, d.status,
-                       c.full_name, c.phone,
-                       p.name as product_name, s.quantity
-                FROM deliveries d
-                JOIN delivery_group_items dgi ON d.id = dgi.delivery_id
-                JOIN customers c ON d.customer_id = c.id
-                JOIN sales s ON d.sale_id = s.id
-                JOIN products p ON s.product_id = p.id
-                WHERE dgi.delivery_group_id = %s
-            ''', (delivery_group_id,))
-            
-            deliveries = cursor.fetchall()
-            
-            result = []
-            for delivery in deliveries:
-                result.append({
-                    'id': delivery[0],
-                    'delivery_address': delivery[1],
-                    'status': delivery[2],
-                    'customer_name': delivery[3],
-                    'customer_phone': delivery[4],
-                    'product_name': delivery[5],
-                    'quantity': delivery[6]
-                })
-            return result
-        except Exception as e:
-            print(f"Ошибка получения доставок в группе: {e}")
-            return []
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    SELECT d.id, d.delivery_address, d.status,
+                           c.full_name, c.phone,
+                           COALESCE(p.name, 'Продажа в архиве') as product_name, s.quantity
+                    FROM deliveries d
+                    JOIN delivery_group_items dgi ON d.id = dgi.delivery_id
+                    JOIN customers c ON d.customer_id = c.id
+                    LEFT JOIN sales s ON d.sale_id = s.id
+                    LEFT JOIN products p ON s.product_id = p.id
+                    WHERE dgi.delivery_group_id = %s
+                ''', (delivery_group_id,))
+                
+                return list(map(GroupDelivery._make, cursor.fetchall()))
+            except Exception as e:
+                print(f"Ошибка получения доставок в группе: {e}")
+                return []
            
     def authenticate_user(self, username, password):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                SELECT e.id, e.full_name, e.role, e.warehouse_id, w.name as warehouse_name
-                FROM employees e
-                LEFT JOIN warehouses w ON e.warehouse_id = w.id
-                WHERE e.login = %s AND e.password = %s
-            ''', (username, password))
-            result = cursor.fetchone()
-            
-            if result:
-                return {
-                    'id': result[0],
-                    'full_name': result[1],
-                    'role': result[2],
-                    'warehouse_id': result[3],
-                    'warehouse_name': result[4]
-                }
-            return None
-        except Exception as e:
-            print(f"Ошибка аутентификации: {e}")
-            return None
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    SELECT e.id, e.full_name, e.role, e.warehouse_id, w.name as warehouse_name
+                    FROM employees e
+                    LEFT JOIN warehouses w ON e.warehouse_id = w.id
+                    WHERE e.login = %s AND e.password = %s
+                ''', (username, password))
+                result = cursor.fetchone()
+                
+                if result:
+                    return {
+                        'id': result[0],
+                        'full_name': result[1],
+                        'role': result[2],
+                        'warehouse_id': result[3],
+                        'warehouse_name': result[4]
+                    }
+                return None
+            except Exception as e:
+                print(f"Ошибка аутентификации: {e}")
+                return None
     
     def register_employee(self, login, password, full_name, role, warehouse_id, phone=' ', email=' '):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                INSERT INTO employees (login, password, full_name, role, warehouse_id, phone, email)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ''', (login, password, full_name, role, warehouse_id, phone, email))
-            conn.commit()
-            return True
-        except psycopg2.IntegrityError:
-            return False
-        except Exception as e:
-            print(f"Ошибка регистрации: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO employees (login, password, full_name, role, warehouse_id, phone, email)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ''', (login, password, full_name, role, warehouse_id, phone, email))
+                conn.commit()
+                return True
+            except psycopg2.IntegrityError:
+                return False
+            except Exception as e:
+                print(f"Ошибка регистрации: {e}")
+                return False
     
     def get_all_warehouses(self):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("SELECT id, name, address FROM warehouses ORDER BY id")
-            warehouses = cursor.fetchall()
-            
-            result = []
-            for warehouse in warehouses:
-                result.append({
-                    'id': warehouse[0],
-                    'name': warehouse[1],
-                    'address': warehouse[2]
-                })
-            return result
-        except Exception as e:
-            print(f"Ошибка получения складов: {e}")
-            return []
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT id, name, address FROM warehouses ORDER BY id")
+                warehouses = cursor.fetchall()
+                
+                result = []
+                for warehouse in warehouses:
+                    result.append({
+                        'id': warehouse[0],
+                        'name': warehouse[1],
+                        'address': warehouse[2]
+                    })
+                return result
+            except Exception as e:
+                print(f"Ошибка получения складов: {e}")
+                return []
     
     def add_warehouse(self, name, address):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute(
-                "INSERT INTO warehouses (name, address) VALUES (%s, %s)",
-                (name, address)
-            )
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка добавления склада: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "INSERT INTO warehouses (name, address) VALUES (%s, %s)",
+                    (name, address)
+                )
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка добавления склада: {e}")
+                return False
     
-    def get_products_with_quantity(self, warehouse_id=None):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            if warehouse_id:
-                # Товары с количеством на конкретном складе
-                cursor.execute('''
+    def get_products_with_quantity(self, warehouse_id=None, product_ids=None):
+        """Товары с остатком на складе или суммарным по всем складам.
+
+        product_ids - только эти товары, None - все.
+        """
+        if self.catalog is not None:
+            products = self.catalog.products(warehouse_id, product_ids)
+            if products is not None:
+                return products
+        
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                where = "WHERE p.id = ANY(%s)" if product_ids is not None else ""
+                ids = (list(product_ids),) if product_ids is not None else ()
+                if warehouse_id:
+                    # Товары с количеством на конкретном складе
+                    execute_prepared(cursor, f'''
+                        SELECT p.id, p.name, p.category, p.brand, p.price, p.min_quantity,
+                               COALESCE(pw.quantity, 0) as quantity
+                        FROM products p
+                        LEFT JOIN product_warehouse pw ON p.id = pw.product_id AND pw.warehouse_id = %s
+                        {where}
+                        ORDER BY p.id
+                    ''', (warehouse_id,) + ids)
+                else:
+                    # Товары с общим количеством по всем складам
+                    execute_prepared(cursor, f'''
+                        SELECT p.id, p.name, p.category, p.brand, p.price, p.min_quantity,
+                               COALESCE(SUM(pw.quantity), 0) as quantity
+                        FROM products p
+                        LEFT JOIN product_warehouse pw ON p.id = pw.product_id
+                        {where}
+                        GROUP BY p.id, p.name, p.category, p.brand, p.price, p.min_quantity
+                        ORDER BY p.id
+                    ''', ids)
+                
+                return list(map(Product._make, cursor.fetchall()))
+            except Exception as e:
+                print(f"Ошибка получения товаров: {e}")
+                return []
+    
+    def get_product_with_quantity(self, product_id, warehouse_id):
+        """Получает один товар с количеством на складе"""
+        if self.catalog is not None:
+            cached, product = self.catalog.product(product_id, warehouse_id)
+            if cached:
+                return product
+        
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                execute_prepared(cursor, '''
                     SELECT p.id, p.name, p.category, p.brand, p.price, p.min_quantity,
                            COALESCE(pw.quantity, 0) as quantity
                     FROM products p
                     LEFT JOIN product_warehouse pw ON p.id = pw.product_id AND pw.warehouse_id = %s
-                    ORDER BY p.id
-                ''', (warehouse_id,))
-            else:
-                # Товары с общим количеством по всем складам
-                cursor.execute('''
-                    SELECT p.id, p.name, p.category, p.brand, p.price, p.min_quantity,
-                           COALESCE(SUM(pw.quantity), 0) as quantity
-                    FROM products p
-                    LEFT JOIN product_warehouse pw ON p.id = pw.product_id
-                    GROUP BY p.id, p.name, p.category, p.brand, p.price, p.min_quantity
-                    ORDER BY p.id
-                ''')
-            
-            products = cursor.fetchall()
-            
-            result = []
-            for product in products:
-                result.append({
-                    'id': product[0],
-                    'name': product[1],
-                    'category': product[2],
-                    'brand': product[3],
-                    'price': float(product[4]),
-                    'min_quantity': product[5],
-                    'quantity': product[6]
-                })
-            return result
-        except Exception as e:
-            print(f"Ошибка получения товаров: {e}")
-            return []
-        finally:
-            conn.close()
+                    WHERE p.id = %s
+                ''', (warehouse_id, product_id))
+                product = cursor.fetchone()
+                return Product._make(product) if product else None
+            except Exception as e:
+                print(f"Ошибка получения товара: {e}")
+                return None
     
     def add_product(self, name, category, brand, price, min_quantity):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                INSERT INTO products (name, category, brand, price, min_quantity)
-                VALUES (%s, %s, %s, %s, %s)
-            ''', (name, category, brand, price, min_quantity))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка добавления товара: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO products (name, category, brand, price, min_quantity)
+                    VALUES (%s, %s, %s, %s, %s)
+                    RETURNING id
+                ''', (name, category, brand, price, min_quantity))
+                product_id = cursor.fetchone()[0]
+                conn.commit()
+                self._catalog_changed(product_ids=[product_id])
+                return True
+            except Exception as e:
+                print(f"Ошибка добавления товара: {e}")
+                return False
     
     def update_product_quantity(self, product_id, warehouse_id, new_quantity):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            # Проверяем существует ли запись
-            cursor.execute('''
-                SELECT COUNT(*) FROM product_warehouse 
-                WHERE product_id = %s AND warehouse_id = %s
-            ''', (product_id, warehouse_id))
-            
-            if cursor.fetchone()[0] > 0:
-                # Обновляем существующую запись
-                cursor.execute('''
-                    UPDATE product_warehouse 
-                    SET quantity = %s 
-                    WHERE product_id = %s AND warehouse_id = %s
-                ''', (new_quantity, product_id, warehouse_id))
-            else:
-                # Создаем новую запись
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                set_movement(cursor, 'adjust')
+                # Одна команда вместо проверки и вставки: без гонки с другим клиентом
                 cursor.execute('''
                     INSERT INTO product_warehouse (product_id, warehouse_id, quantity)
                     VALUES (%s, %s, %s)
+                    ON CONFLICT (product_id, warehouse_id) DO UPDATE SET quantity = EXCLUDED.quantity
                 ''', (product_id, warehouse_id, new_quantity))
-            
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка обновления количества: {e}")
-            return False
-        finally:
-            conn.close()
+                
+                conn.commit()
+                self._catalog_changed(stock=[(product_id, warehouse_id)])
+                return True
+            except Exception as e:
+                print(f"Ошибка обновления количества: {e}")
+                return False
     
     def delete_product(self, product_id):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка удаления товара: {e}")
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("DELETE FROM products WHERE id = %s", (product_id,))
+                conn.commit()
+                self._catalog_changed(product_ids=[product_id])
+                return True
+            except Exception as e:
+                print(f"Ошибка удаления товара: {e}")
+                return False
     
-    def add_sale(self, product_id, quantity, total_price, cashier_id, warehouse_id):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                INSERT INTO sales (product_id, quantity, total_price, sale_date, cashier_id, warehouse_id)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            ''', (product_id, quantity, total_price, datetime.now(), cashier_id, warehouse_id))
-            
-            # Обновляем количество на складе
+    # Загрузка товаров
+    
+    def import_products(self, rows, warehouse_id=None, own_warehouse_only=False, check_only=False):
+        """Загружает товары и остатки из строк rows одной транзакцией.
+        
+        rows - (номер строки, значения edb.importer.FIELDS), например
+        edb.importer.read_rows(path). Строки идут через COPY во временную
+        таблицу, проверяются и сливаются с products и product_warehouse
+        запросами SQL. Товар ищется по ID, без ID - по названию и бренду,
+        не найденный создается. Количество заменяет остаток на складе
+        строки, а если склад не указан - на складе warehouse_id; с
+        own_warehouse_only остатки других складов не загружаются. Строки
+        с ошибками пропускаются. check_only - только проверить: изменения
+        откатываются, но счетчики те же, что дала бы загрузка.
+        
+        Возвращает словарь: rows, created, updated, stock - число строк,
+        созданных и измененных товаров, измененных остатков; errors -
+        список (номер строки, ошибка). None при ошибке загрузки.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # Загрузки идут по очереди, чтобы не создать один новый товар дважды
+                cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PRODUCT_IMPORT_LOCK_KEY,))
+                set_movement(cursor, 'import')
+                cursor.execute('''
+                    CREATE TEMP TABLE import_rows (
+                        line INTEGER,
+                        product_id TEXT, name TEXT, category TEXT, brand TEXT,
+                        price TEXT, min_quantity TEXT, warehouse TEXT, quantity TEXT,
+                        error TEXT,
+                        product INTEGER, warehouse_id INTEGER, new_price NUMERIC(10, 2),
+                        new_min_quantity INTEGER, new_quantity INTEGER
+                    ) ON COMMIT DROP
+                ''')
+                stream = CopyStream((line,) + tuple(values) for line, values in rows)
+                cursor.copy_expert('''
+                    COPY import_rows (line, product_id, name, category, brand,
+                                      price, min_quantity, warehouse, quantity)
+                    FROM STDIN
+                ''', stream)
+                # Без статистики планировщик считает временную таблицу маленькой
+                cursor.execute("ANALYZE import_rows")
+                
+                errors = self._check_import_rows(cursor, warehouse_id, own_warehouse_only)
+                updated, created, stock = self._merge_import_rows(cursor)
+                if check_only:
+                    conn.rollback()
+                else:
+                    conn.commit()
+                    self._catalog_changed(product_ids=updated | created, stock=stock)
+                return {
+                    'rows': stream.count,
+                    'created': len(created),
+                    'updated': len(updated),
+                    'stock': len(stock),
+                    'errors': errors,
+                }
+            except Exception as e:
+                print(f"Ошибка загрузки товаров: {e}")
+                return None
+    
+    def _check_import_rows(self, cursor, warehouse_id, own_warehouse_only):
+        """Проверяет строки import_rows и приводит их значения к типам.
+        Возвращает ошибки - [(номер строки, ошибка)]"""
+        # Числа из таблиц бывают с пробелами между разрядами и запятой
+        cursor.execute('''
+            UPDATE import_rows SET
+                price = replace(translate(price, ' ' || chr(160), ''), ',', '.'),
+                min_quantity = translate(min_quantity, ' ' || chr(160), ''),
+                quantity = translate(quantity, ' ' || chr(160), '')
+        ''')
+        for error, condition in self.IMPORT_FORMAT_CHECKS:
+            cursor.execute(f"UPDATE import_rows SET error = {error} WHERE error IS NULL AND {condition}")
+        
+        # Приводятся только строки без ошибок: SET вычисляется после отбора по WHERE.
+        # Склад указывается ID или названием
+        cursor.execute('''
+            UPDATE import_rows r SET
+                product = product_id::int,
+                new_price = price::numeric,
+                new_min_quantity = min_quantity::int,
+                new_quantity = quantity::int,
+                warehouse_id = CASE WHEN warehouse IS NULL THEN %s ELSE (
+                    SELECT w.id FROM warehouses w
+                    WHERE w.id::text = r.warehouse OR lower(w.name) = lower(r.warehouse)
+                    ORDER BY w.id::text = r.warehouse DESC, w.id
+                    LIMIT 1
+                ) END
+            WHERE error IS NULL
+        ''', (warehouse_id,))
+        for error, condition in self.IMPORT_CHECKS:
+            cursor.execute(f"UPDATE import_rows SET error = {error} WHERE error IS NULL AND {condition}")
+        if own_warehouse_only:
             cursor.execute('''
-                UPDATE product_warehouse 
-                SET quantity = quantity - %s 
-                WHERE product_id = %s AND warehouse_id = %s
-            ''', (quantity, product_id, warehouse_id))
-            
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка добавления продажи: {e}")
-            return False
-        finally:
-            conn.close()
+                UPDATE import_rows SET error = 'Остатки можно загружать только для своего склада'
+                WHERE error IS NULL AND new_quantity IS NOT NULL AND warehouse_id <> %s
+            ''', (warehouse_id,))
+        
+        # Товар без ID ищется по названию и бренду без учета регистра
+        cursor.execute('''
+            UPDATE import_rows r SET
+                product = m.id,
+                error = CASE WHEN m.count > 1
+                             THEN 'Несколько товаров с таким названием и брендом, укажите ID' END
+            FROM (
+                SELECT lower(name) AS name, lower(COALESCE(brand, '')) AS brand,
+                       MIN(id) AS id, COUNT(*) AS count
+                FROM products
+                GROUP BY 1, 2
+            ) m
+            WHERE r.error IS NULL AND r.product IS NULL
+              AND m.name = lower(r.name) AND m.brand = lower(COALESCE(r.brand, ''))
+        ''')
+        cursor.execute('''
+            UPDATE import_rows SET error = 'Для нового товара нужны категория и цена'
+            WHERE error IS NULL AND product IS NULL AND (category IS NULL OR new_price IS NULL)
+        ''')
+        # Остаток товара на складе задается одной строкой, повторные - ошибка
+        cursor.execute('''
+            WITH numbered AS (
+                SELECT line, first_value(line) OVER (
+                    PARTITION BY COALESCE(product::text, lower(name) || '|' || lower(COALESCE(brand, ''))),
+                                 warehouse_id
+                    ORDER BY line
+                ) AS first_line
+                FROM import_rows
+                WHERE error IS NULL AND new_quantity IS NOT NULL
+            )
+            UPDATE import_rows r
+            SET error = 'Количество этого товара на складе уже указано в строке ' || n.first_line
+            FROM numbered n
+            WHERE r.line = n.line AND n.line > n.first_line
+        ''')
+        
+        cursor.execute("SELECT line, error FROM import_rows WHERE error IS NOT NULL ORDER BY line")
+        return cursor.fetchall()
+    
+    def _merge_import_rows(self, cursor):
+        """Сливает проверенные строки import_rows с товарами и остатками.
+        
+        Значения товара берутся из первой его строки; пустые значения
+        не меняют имеющиеся. Возвращает id измененных и созданных товаров
+        и пары (товар, склад) измененных остатков.
+        """
+        # Неизменившиеся строки не трогаются: каждое изменение - уведомление триггера
+        cursor.execute('''
+            UPDATE products p SET
+                name = COALESCE(r.name, p.name),
+                category = COALESCE(r.category, p.category),
+                brand = COALESCE(r.brand, p.brand),
+                price = COALESCE(r.new_price, p.price),
+                min_quantity = COALESCE(r.new_min_quantity, p.min_quantity)
+            FROM (
+                SELECT DISTINCT ON (product) product, name, category, brand, new_price, new_min_quantity
+                FROM import_rows
+                WHERE error IS NULL AND product IS NOT NULL
+                ORDER BY product, line
+            ) r
+            WHERE p.id = r.product
+              AND (p.name, p.category, p.brand, p.price, p.min_quantity) IS DISTINCT FROM
+                  (COALESCE(r.name, p.name), COALESCE(r.category, p.category), COALESCE(r.brand, p.brand),
+                   COALESCE(r.new_price, p.price), COALESCE(r.new_min_quantity, p.min_quantity))
+            RETURNING p.id
+        ''')
+        updated = {row[0] for row in cursor.fetchall()}
+        
+        cursor.execute('''
+            WITH created AS (
+                INSERT INTO products (name, category, brand, price, min_quantity)
+                SELECT DISTINCT ON (lower(name), lower(COALESCE(brand, '')))
+                       name, category, brand, new_price, COALESCE(new_min_quantity, 0)
+                FROM import_rows
+                WHERE error IS NULL AND product IS NULL
+                ORDER BY lower(name), lower(COALESCE(brand, '')), line
+                RETURNING id, name, brand
+            )
+            UPDATE import_rows r SET product = c.id
+            FROM created c
+            WHERE r.error IS NULL AND r.product IS NULL
+              AND lower(r.name) = lower(c.name)
+              AND lower(COALESCE(r.brand, '')) = lower(COALESCE(c.brand, ''))
+            RETURNING c.id
+        ''')
+        created = {row[0] for row in cursor.fetchall()}
+        
+        cursor.execute('''
+            INSERT INTO product_warehouse (product_id, warehouse_id, quantity)
+            SELECT product, warehouse_id, new_quantity
+            FROM import_rows
+            WHERE error IS NULL AND new_quantity IS NOT NULL
+            ON CONFLICT (product_id, warehouse_id) DO UPDATE SET quantity = EXCLUDED.quantity
+            WHERE product_warehouse.quantity <> EXCLUDED.quantity
+            RETURNING product_id, warehouse_id
+        ''')
+        stock = cursor.fetchall()
+        return updated, created, stock
+    
+    def add_sale(self, product_id, quantity, total_price, cashier_id, warehouse_id):
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                execute_prepared(cursor, '''
+                    INSERT INTO sales (product_id, quantity, total_price, sale_date, cashier_id, warehouse_id)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    RETURNING id
+                ''', (product_id, quantity, total_price, datetime.now(), cashier_id, warehouse_id))
+                sale_id = cursor.fetchone()[0]
+                
+                # Обновляем количество на складе; причину и продажу для
+                # журнала движений ставит тот же запрос
+                execute_prepared(cursor, f'''
+                    UPDATE product_warehouse 
+                    SET quantity = quantity - %s 
+                    WHERE product_id = %s AND warehouse_id = %s AND {MOVEMENT_CONDITION}
+                ''', (quantity, product_id, warehouse_id) + movement_params('sale', cashier_id, sale_id))
+                
+                conn.commit()
+                self._catalog_changed(stock=[(product_id, warehouse_id)])
+                return True
+            except Exception as e:
+                print(f"Ошибка добавления продажи: {e}")
+                return False
     
-    def get_sales_report(self, warehouse_id=None):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            if warehouse_id:
+    def reserve_stock(self, items, warehouse_id, cursor=None, movement=None):
+        """Списывает товар со склада, только если его хватает по всем позициям.
+        
+        items - пары (product_id, quantity). Затрагиваются только нужные строки
+        product_warehouse, они блокируются до конца транзакции, поэтому
+        параллельные продажи не уводят остаток в минус. movement - movement_params
+        для журнала движений, их ставит запрос блокировки строк.
+        Возвращает {product_id: доступное количество} для позиций, которых
+        не хватает; пустой словарь - товар списан. None при ошибке.
+        Если передан cursor, работает внутри транзакции вызывающего кода.
+        """
+        if cursor is None:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    items = list(items)
+                    shortages = self.reserve_stock(items, warehouse_id, cursor,
+                                                   movement or movement_params('sale'))
+                    if shortages:
+                        conn.rollback()
+                    else:
+                        conn.commit()
+                        self._catalog_changed(stock=[(product_id, warehouse_id) for product_id, _ in items])
+                    return shortages
+                except Exception as e:
+                    print(f"Ошибка резервирования товара: {e}")
+                    conn.rollback()
+                    return None
+        
+        needed = {}
+        for product_id, quantity in items:
+            needed[product_id] = needed.get(product_id, 0) + quantity
+        if not needed:
+            return {}
+        
+        # Блокируем строки в одном порядке, чтобы параллельные продажи не взаимоблокировались
+        condition = f"AND {MOVEMENT_CONDITION}" if movement else ""
+        execute_prepared(cursor, f'''
+            SELECT product_id, quantity
+            FROM product_warehouse
+            WHERE warehouse_id = %s AND product_id = ANY(%s) {condition}
+            ORDER BY product_id
+            FOR UPDATE
+        ''', (warehouse_id, list(needed)) + tuple(movement or ()))
+        available = dict(cursor.fetchall())
+        
+        shortages = {
+            product_id: available.get(product_id, 0)
+            for product_id, quantity in needed.items()
+            if available.get(product_id, 0) < quantity
+        }
+        if shortages:
+            return shortages
+        
+        execute_values(cursor, '''
+            UPDATE product_warehouse pw
+            SET quantity = pw.quantity - v.quantity
+            FROM (VALUES %s) AS v(product_id, warehouse_id, quantity)
+            WHERE pw.product_id = v.product_id AND pw.warehouse_id = v.warehouse_id
+              AND pw.quantity >= v.quantity
+        ''', [
+            (product_id, warehouse_id, quantity)
+            for product_id, quantity in needed.items()
+        ])
+        return {}
+    
+    def apply_stock_deltas(self, warehouse_id, deltas, cursor=None):
+        """Меняет остатки склада на относительные величины одной транзакцией.
+        
+        deltas - пары (product_id, delta), одинаковые товары складываются.
+        Остаток меняется как quantity = quantity + delta одним пакетным
+        INSERT ... ON CONFLICT, поэтому изменения, сделанные параллельно
+        другими клиентами, не затираются; строка склада создается, если
+        ее не было. Если остаток какого-то товара ушел бы в минус, ничего
+        не меняется.
+        Возвращает {product_id: текущий остаток} для таких товаров; пустой
+        словарь - остатки изменены. None при ошибке.
+        Если передан cursor, работает внутри транзакции вызывающего кода.
+        """
+        if cursor is None:
+            with self._connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    deltas = list(deltas)
+                    set_movement(cursor, 'adjust')
+                    shortages = self.apply_stock_deltas(warehouse_id, deltas, cursor)
+                    if shortages:
+                        conn.rollback()
+                    else:
+                        conn.commit()
+                        self._catalog_changed(stock=[(product_id, warehouse_id) for product_id, _ in deltas])
+                    return shortages
+                except Exception as e:
+                    print(f"Ошибка изменения остатков: {e}")
+                    conn.rollback()
+                    return None
+        
+        totals = {}
+        for product_id, delta in deltas:
+            totals[product_id] = totals.get(product_id, 0) + delta
+        # Строки блокируются в порядке товаров, чтобы параллельные пакеты не взаимоблокировались
+        changes = sorted((product_id, delta) for product_id, delta in totals.items() if delta)
+        if not changes:
+            return {}
+        
+        decreases = [product_id for product_id, delta in changes if delta < 0]
+        if decreases:
+            # Уменьшаемые остатки проверяются под блокировкой, как при продаже
+            execute_prepared(cursor, '''
+                SELECT product_id, quantity
+                FROM product_warehouse
+                WHERE warehouse_id = %s AND product_id = ANY(%s)
+                ORDER BY product_id
+                FOR UPDATE
+            ''', (warehouse_id, decreases))
+            available = dict(cursor.fetchall())
+            shortages = {
+                product_id: available.get(product_id, 0)
+                for product_id in decreases
+                if available.get(product_id, 0) + totals[product_id] < 0
+            }
+            if shortages:
+                return shortages
+        
+        execute_values(cursor, '''
+            INSERT INTO product_warehouse (product_id, warehouse_id, quantity)
+            VALUES %s
+            ON CONFLICT (product_id, warehouse_id)
+            DO UPDATE SET quantity = product_warehouse.quantity + EXCLUDED.quantity
+        ''', [
+            (product_id, warehouse_id, delta)
+            for product_id, delta in changes
+        ], page_size=len(changes))
+        return {}
+    
+    def receive_stock(self, receipt_id, warehouse_id, employee_id, deltas):
+        """Проводит приемку товара: apply_stock_deltas с записью в stock_receipts.
+        
+        receipt_id - UUID сессии приемки (uuid.UUID или строка). Приемка
+        с тем же идентификатором проводится один раз, так что повтор после
+        сбоя, когда неизвестно, дошла ли фиксация, остатки не меняет.
+        Возвращает {'shortages': {...}, 'repeated': bool} либо None при
+        ошибке. Если остаток ушел бы в минус, приемка не проводится,
+        а shortages - как у apply_stock_deltas.
+        """
+        deltas = list(deltas)
+        # psycopg2 без register_uuid не передает uuid.UUID
+        receipt_id = str(receipt_id)
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
                 cursor.execute('''
-                    SELECT s.id, p.name, s.quantity, s.total_price, s.sale_date, e.full_name, s.status, w.name
-                    FROM sales s
-                    JOIN products p ON s.product_id = p.id
-                    JOIN employees e ON s.cashier_id = e.id
-                    JOIN warehouses w ON s.warehouse_id = w.id
-                    WHERE s.warehouse_id = %s
-                    ORDER BY s.sale_date DESC
-                ''', (warehouse_id,))
-            else:
+                    INSERT INTO stock_receipts (id, warehouse_id, employee_id, lines, units)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (id) DO NOTHING
+                ''', (receipt_id, warehouse_id, employee_id, len(deltas), sum(delta for _, delta in deltas)))
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    return {'shortages': {}, 'repeated': True}
+                
+                set_movement(cursor, 'receive', employee_id, receipt_id)
+                shortages = self.apply_stock_deltas(warehouse_id, deltas, cursor)
+                if shortages:
+                    conn.rollback()
+                    return {'shortages': shortages, 'repeated': False}
+                
+                conn.commit()
+                self._catalog_changed(stock=[(product_id, warehouse_id) for product_id, _ in deltas])
+                return {'shortages': {}, 'repeated': False}
+            except Exception as e:
+                print(f"Ошибка проведения приемки: {e}")
+                conn.rollback()
+                return None
+    
+    def transfer_stock(self, product_id, from_warehouse_id, to_warehouse_id, quantity, employee_id=None):
+        """Перемещает quantity единиц товара между складами одной транзакцией.
+        
+        Возвращает {product_id: остаток на складе-источнике}, если товара
+        не хватает (ничего не перемещается); пустой словарь - перемещено.
+        None при ошибке базы данных. ValueError до обращения к базе, если
+        количество не больше нуля или склады совпадают.
+        """
+        if quantity <= 0:
+            raise ValueError(f"Некорректное количество для перемещения: {quantity}")
+        if from_warehouse_id == to_warehouse_id:
+            raise ValueError("Склад-источник и склад назначения совпадают")
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # Обе строки блокируются в порядке складов: встречные перемещения
+                # одного товара не взаимоблокируются
                 cursor.execute('''
-                    SELECT s.id, p.name, s.quantity, s.total_price, s.sale_date, e.full_name, s.status, w.name
-                    FROM sales s
-                    JOIN products p ON s.product_id = p.id
-                    JOIN employees e ON s.cashier_id = e.id
-                    JOIN warehouses w ON s.warehouse_id = w.id
-                    ORDER BY s.sale_date DESC
-                ''')
-            
-            sales = cursor.fetchall()
-            
-            result = []
-            for sale in sales:
-                result.append({
-                    'id': sale[0],
-                    'product_name': sale[1],
-                    'quantity': sale[2],
-                    'total_price': float(sale[3]),
-                    'sale_date': sale[4].strftime("%Y-%m-%d %H:%M:%S"),
-                    'cashier_name': sale[5],
-                    'status': sale[6],
-                    'warehouse_name': sale[7]
+                    SELECT warehouse_id FROM product_warehouse
+                    WHERE product_id = %s AND warehouse_id IN (%s, %s)
+                    ORDER BY warehouse_id
+                    FOR UPDATE
+                ''', (product_id, from_warehouse_id, to_warehouse_id))
+                set_movement(cursor, 'transfer', employee_id, f"{from_warehouse_id}->{to_warehouse_id}")
+                shortages = self.apply_stock_deltas(from_warehouse_id, [(product_id, -quantity)], cursor)
+                if shortages:
+                    conn.rollback()
+                    return shortages
+                self.apply_stock_deltas(to_warehouse_id, [(product_id, quantity)], cursor)
+                conn.commit()
+                self._catalog_changed(stock=[(product_id, from_warehouse_id), (product_id, to_warehouse_id)])
+                return {}
+            except Exception as e:
+                print(f"Ошибка перемещения товара: {e}")
+                conn.rollback()
+                return None
+    
+    def checkout(self, cart, cashier_id, warehouse_id, delivery=None):
+        """Оформляет продажу всей корзины одной транзакцией.
+        
+        cart - список позиций {'id', 'quantity', 'price'},
+        delivery - None или {'customer_id', 'address', 'notes'}.
+        Возвращает {'sale_ids': [...], 'delivery_id': id или None, 'shortages': {...}}
+        либо None при ошибке. Если товара не хватает, продажа не оформляется,
+        а shortages содержит {product_id: доступное количество}.
+        """
+        if not cart:
+            return None
+        
+        sale_date = datetime.now()
+        
+        # Одинаковые товары списываем со склада одной строкой
+        stock_deltas = {}
+        for item in cart:
+            stock_deltas[item['id']] = stock_deltas.get(item['id'], 0) + item['quantity']
+        
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # Продажи пишутся первыми: их id - документы движений товаров
+                # в журнале. Строки идут по товарам, чтобы параллельные корзины
+                # брали блокировки итогов sales_daily в одном порядке
+                rows = execute_values(cursor, '''
+                    INSERT INTO sales (product_id, quantity, total_price, sale_date, cashier_id, warehouse_id)
+                    VALUES %s
+                    RETURNING id, product_id
+                ''', [
+                    (item['id'], item['quantity'], item['quantity'] * item['price'],
+                     sale_date, cashier_id, warehouse_id)
+                    for item in sorted(cart, key=lambda item: item['id'])
+                ], fetch=True)
+                sale_ids = sorted(row[0] for row in rows)
+                references = {}
+                for sale_id, product_id in sorted(rows):
+                    references.setdefault(product_id, []).append(str(sale_id))
+                
+                # Проверяем и списываем остатки под блокировкой строк склада;
+                # причину и продажи для журнала движений ставит запрос блокировки
+                movement = movement_params('sale', cashier_id, references={
+                    product_id: ','.join(ids) for product_id, ids in references.items()
                 })
-            return result
-        except Exception as e:
-            print(f"Ошибка получения отчета: {e}")
-            return []
-        finally:
-            conn.close()
+                shortages = self.reserve_stock(stock_deltas.items(), warehouse_id, cursor, movement)
+                if shortages:
+                    conn.rollback()
+                    return {'sale_ids': [], 'delivery_id': None, 'shortages': shortages}
+                
+                delivery_id = None
+                if delivery:
+                    # Доставка привязывается к первой строке продажи
+                    cursor.execute('''
+                        INSERT INTO deliveries (sale_id, customer_id, delivery_address, notes)
+                        VALUES (%s, %s, %s, %s)
+                        RETURNING id
+                    ''', (sale_ids[0], delivery['customer_id'], delivery['address'], delivery.get('notes', '')))
+                    delivery_id = cursor.fetchone()[0]
+                
+                conn.commit()
+                self._catalog_changed(stock=[(product_id, warehouse_id) for product_id in stock_deltas])
+                return {'sale_ids': sale_ids, 'delivery_id': delivery_id, 'shortages': {}}
+            except Exception as e:
+                print(f"Ошибка оформления продажи: {e}")
+                conn.rollback()
+                return None
+    
+    def get_sales_report(self, warehouse_id=None, after=None, limit=None, sale_ids=None):
+        """Продажи от новых к старым.
+
+        after - ключ (sale_datetime, id) последней полученной строки:
+        следующая страница начинается сразу после нее (keyset-пагинация).
+        limit - размер страницы, None - все продажи.
+        sale_ids - только эти продажи, например измененные.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                conditions = []
+                params = []
+                if warehouse_id:
+                    conditions.append("s.warehouse_id = %s")
+                    params.append(warehouse_id)
+                if after:
+                    # Отдельное условие на sale_date отсекает секции новее страницы
+                    conditions.append("s.sale_date <= %s AND (s.sale_date, s.id) < (%s, %s)")
+                    params.extend((after[0],) + tuple(after))
+                if sale_ids is not None:
+                    conditions.append("s.id = ANY(%s)")
+                    params.append(list(sale_ids))
+                
+                query = self._sales_query(conditions)
+                if limit:
+                    query += " LIMIT %s"
+                    params.append(limit)
+                
+                # Не подготавливается: план зависит от страницы и склада, сервер
+                # строит его заново на каждое выполнение, и PREPARE только
+                # добавляет запрос (benchmarks/prepared_statements.py)
+                cursor.execute(query, params)
+                # Строки берутся из курсора по одной, без промежуточного списка
+                return make_records(Sale, cursor, SALE_SHARED)
+            except Exception as e:
+                print(f"Ошибка получения отчета: {e}")
+                return []
+    
+    def _sales_query(self, conditions):
+        """Запрос продаж с условиями conditions от новых к старым"""
+        query = '''
+            SELECT s.id, p.name, s.quantity, s.total_price, s.sale_date, e.full_name, s.status, w.name
+            FROM sales s
+            JOIN products p ON s.product_id = p.id
+            JOIN employees e ON s.cashier_id = e.id
+            JOIN warehouses w ON s.warehouse_id = w.id
+        '''
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        # id в сортировке делает ключ страницы уникальным
+        return query + " ORDER BY s.sale_date DESC, s.id DESC"
+    
+    # Выгрузка
+    
+    def _iter_records(self, record, query, params, itersize):
+        """Записи record по строкам запроса, читаемым с сервера порциями по itersize.
+        
+        Именованный (серверный) курсор не загружает результат в память
+        целиком, поэтому выгрузка любого объема идет в постоянной памяти.
+        Соединение занято, пока генератор не исчерпан или не закрыт.
+        В отличие от остальных методов ошибка передается вызывающему коду:
+        оборванная выгрузка не должна выглядеть завершенной.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor(name='export')
+            cursor.itersize = itersize
+            try:
+                cursor.execute(query, params)
+                for row in cursor:
+                    yield record._make(row)
+            except Exception as e:
+                print(f"Ошибка выгрузки: {e}")
+                raise
+    
+    def iter_sales(self, warehouse_id=None, date_from=None, date_to=None, itersize=2000):
+        """Продажи от новых к старым за [date_from, date_to), записи Sale"""
+        conditions = []
+        params = []
+        if warehouse_id:
+            conditions.append("s.warehouse_id = %s")
+            params.append(warehouse_id)
+        # Условия на sale_date отсекают секции вне периода
+        if date_from:
+            conditions.append("s.sale_date >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("s.sale_date < %s")
+            params.append(date_to)
+        return self._iter_records(Sale, self._sales_query(conditions), params, itersize)
+    
+    def iter_deliveries(self, warehouse_id=None, statuses=None, itersize=2000):
+        """Доставки от новых к старым, записи Delivery"""
+        conditions = []
+        params = []
+        if warehouse_id:
+            conditions.append("s.warehouse_id = %s")
+            params.append(warehouse_id)
+        if statuses:
+            conditions.append("d.status = ANY(%s)")
+            params.append(list(statuses))
+        return self._iter_records(Delivery, self._deliveries_query(conditions), params, itersize)
+    
+    def iter_customers(self, itersize=2000):
+        """Все клиенты от новых к старым, записи Customer"""
+        query = '''
+            SELECT id, full_name, phone, email, address, created_date
+            FROM customers
+            ORDER BY created_date DESC, id DESC
+        '''
+        return self._iter_records(Customer, query, (), itersize)
     
     def cancel_sale(self, sale_id):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            # Получаем информацию о продаже
-            cursor.execute("SELECT product_id, quantity, warehouse_id FROM sales WHERE id = %s", (sale_id,))
-            sale = cursor.fetchone()
-            
-            if sale:
-                product_id, quantity, warehouse_id = sale
-                # Возвращаем товар на склад
-                cursor.execute(
-                    "UPDATE product_warehouse SET quantity = quantity + %s WHERE product_id = %s AND warehouse_id = %s",
-                    (quantity, product_id, warehouse_id)
-                )
-                # Помечаем продажу как отмененную
-                cursor.execute(
-                    "UPDATE sales SET status = 'cancelled' WHERE id = %s",
-                    (sale_id,)
-                )
-            
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка отмены продажи: {e}")
-            return False
-        finally:
-            conn.close()
+        """Отменяет продажу и возвращает товар на склад.
+        
+        Товар возвращается только той отменой, которая сменила статус:
+        повторная отмена (например, из устаревшего списка) остатки не меняет.
+        Возвращает True, если продажа отменена сейчас или раньше.
+        """
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                # Сначала статус: строка продажи блокируется, и из параллельных
+                # отмен строку вернет только одна
+                cursor.execute('''
+                    UPDATE sales SET status = 'cancelled'
+                    WHERE id = %s AND status IS DISTINCT FROM 'cancelled'
+                    RETURNING product_id, quantity, warehouse_id
+                ''', (sale_id,))
+                sale = cursor.fetchone()
+                
+                if sale:
+                    product_id, quantity, warehouse_id = sale
+                    # Возвращаем товар на склад
+                    cursor.execute(f'''
+                        UPDATE product_warehouse SET quantity = quantity + %s
+                        WHERE product_id = %s AND warehouse_id = %s AND {MOVEMENT_CONDITION}
+                    ''', (quantity, product_id, warehouse_id) + movement_params('cancel', reference=sale_id))
+                
+                conn.commit()
+                if sale:
+                    self._catalog_changed(stock=[(product_id, warehouse_id)])
+                return True
+            except Exception as e:
+                print(f"Ошибка отмены продажи: {e}")
+                return False
     
     def get_all_employees(self):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                SELECT e.id, e.login, e.full_name, e.role, e.phone, e.email, w.name as warehouse_name
-                FROM employees e
-                LEFT JOIN warehouses w ON e.warehouse_id = w.id
-            ''')
-            employees = cursor.fetchall()
-            
-            result = []
-            for emp in employees:
-                result.append({
-                    'id': emp[0],
-                    'login': emp[1],
-                    'full_name': emp[2],
-                    'role': emp[3],
-                    'phone': emp[4],
-                    'email': emp[5],
-                    'warehouse_name': emp[6]
-                })
-            return result
-        except Exception as e:
-            print(f"Ошибка получения сотрудников: {e}")
-            return []
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    SELECT e.id, e.login, e.full_name, e.role, e.phone, e.email, w.name as warehouse_name
+                    FROM employees e
+                    LEFT JOIN warehouses w ON e.warehouse_id = w.id
+                ''')
+                employees = cursor.fetchall()
+                
+                result = []
+                for emp in employees:
+                    result.append({
+                        'id': emp[0],
+                        'login': emp[1],
+                        'full_name': emp[2],
+                        'role': emp[3],
+                        'phone': emp[4],
+                        'email': emp[5],
+                        'warehouse_name': emp[6]
+                    })
+                return result
+            except Exception as e:
+                print(f"Ошибка получения сотрудников: {e}")
+                return []
     
     def delete_employee(self, employee_id):
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("SELECT COUNT(*) FROM sales WHERE cashier_id = %s", (employee_id,))
-            sales_count = cursor.fetchone()[0]
-            
-            if sales_count > 0:
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT COUNT(*) FROM sales WHERE cashier_id = %s", (employee_id,))
+                sales_count = cursor.fetchone()[0]
+                
+                if sales_count > 0:
+                    return False
+                
+                cursor.execute("DELETE FROM employees WHERE id = %s", (employee_id,))
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка удаления сотрудника: {e}")
+                conn.rollback()
                 return False
             
-            cursor.execute("DELETE FROM employees WHERE id = %s", (employee_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка удаления сотрудника: {e}")
-            conn.rollback()
-            return False
-        finally:
-            conn.close()
-            
     def get_employee_by_id(self, employee_id):
         """Получает данные сотрудника по ID"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                SELECT e.id, e.login, e.full_name, e.role, e.phone, e.email, e.warehouse_id, w.name as warehouse_name
-                FROM employees e
-                LEFT JOIN warehouses w ON e.warehouse_id = w.id
-                WHERE e.id = %s
-            ''', (employee_id,))
-            result = cursor.fetchone()
-            
-            if result:
-                return {
-                    'id': result[0],
-                    'login': result[1],
-                    'full_name': result[2],
-                    'role': result[3],
-                    'phone': result[4],
-                    'email': result[5],
-                    'warehouse_id': result[6],
-                    'warehouse_name': result[7]
-                }
-            return None
-        except Exception as e:
-            print(f"Ошибка получения сотрудника: {e}")
-            return None
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    SELECT e.id, e.login, e.full_name, e.role, e.phone, e.email, e.warehouse_id, w.name as warehouse_name
+                    FROM employees e
+                    LEFT JOIN warehouses w ON e.warehouse_id = w.id
+                    WHERE e.id = %s
+                ''', (employee_id,))
+                result = cursor.fetchone()
+                
+                if result:
+                    return {
+                        'id': result[0],
+                        'login': result[1],
+                        'full_name': result[2],
+                        'role': result[3],
+                        'phone': result[4],
+                        'email': result[5],
+                        'warehouse_id': result[6],
+                        'warehouse_name': result[7]
+                    }
+                return None
+            except Exception as e:
+                print(f"Ошибка получения сотрудника: {e}")
+                return None
     
     def update_employee(self, employee_id, login, password, full_name, role, warehouse_id, phone, email):
         """Обновляет данные сотрудника"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            if password:
-                # Если пароль указан, обновляем его
-                cursor.execute('''
-                    UPDATE employees 
-                    SET login = %s, password = %s, full_name = %s, role = %s, 
-                        warehouse_id = %s, phone = %s, email = %s
-                    WHERE id = %s
-                ''', (login, password, full_name, role, warehouse_id, phone, email, employee_id))
-            else:
-                # Если пароль не указан, не меняем его
-                cursor.execute('''
-                    UPDATE employees 
-                    SET login = %s, full_name = %s, role = %s, 
-                        warehouse_id = %s, phone = %s, email = %s
-                    WHERE id = %s
-                ''', (login, full_name, role, warehouse_id, phone, email, employee_id))
-            
-            conn.commit()
-            return True
-        except psycopg2.IntegrityError:
-            # Если логин уже существует
-            return False
-        except Exception as e:
-            print(f"Ошибка обновления сотрудника: {e}")
-            conn.rollback()
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                if password:
+                    # Если пароль указан, обновляем его
+                    cursor.execute('''
+                        UPDATE employees 
+                        SET login = %s, password = %s, full_name = %s, role = %s, 
+                            warehouse_id = %s, phone = %s, email = %s
+                        WHERE id = %s
+                    ''', (login, password, full_name, role, warehouse_id, phone, email, employee_id))
+                else:
+                    # Если пароль не указан, не меняем его
+                    cursor.execute('''
+                        UPDATE employees 
+                        SET login = %s, full_name = %s, role = %s, 
+                            warehouse_id = %s, phone = %s, email = %s
+                        WHERE id = %s
+                    ''', (login, full_name, role, warehouse_id, phone, email, employee_id))
+                
+                conn.commit()
+                return True
+            except psycopg2.IntegrityError:
+                # Если логин уже существует
+                return False
+            except Exception as e:
+                print(f"Ошибка обновления сотрудника: {e}")
+                conn.rollback()
+                return False
     
     def get_warehouse_by_id(self, warehouse_id):
         """Получает данные склада по ID"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                SELECT id, name, address FROM warehouses WHERE id = %s
-            ''', (warehouse_id,))
-            result = cursor.fetchone()
-            
-            if result:
-                return {
-                    'id': result[0],
-                    'name': result[1],
-                    'address': result[2]
-                }
-            return None
-        except Exception as e:
-            print(f"Ошибка получения склада: {e}")
-            return None
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    SELECT id, name, address FROM warehouses WHERE id = %s
+                ''', (warehouse_id,))
+                result = cursor.fetchone()
+                
+                if result:
+                    return {
+                        'id': result[0],
+                        'name': result[1],
+                        'address': result[2]
+                    }
+                return None
+            except Exception as e:
+                print(f"Ошибка получения склада: {e}")
+                return None
     
     def update_warehouse(self, warehouse_id, name, address):
         """Обновляет данные склада"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                UPDATE warehouses 
-                SET name = %s, address = %s
-                WHERE id = %s
-            ''', (name, address, warehouse_id))
-            
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка обновления склада: {e}")
-            conn.rollback()
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    UPDATE warehouses 
+                    SET name = %s, address = %s
+                    WHERE id = %s
+                ''', (name, address, warehouse_id))
+                
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка обновления склада: {e}")
+                conn.rollback()
+                return False
     
     def delete_warehouse(self, warehouse_id):
         """Удаляет склад"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute("DELETE FROM warehouses WHERE id = %s", (warehouse_id,))
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"Ошибка удаления склада: {e}")
-            conn.rollback()
-            return False
-        finally:
-            conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("DELETE FROM warehouses WHERE id = %s", (warehouse_id,))
+                conn.commit()
+                return True
+            except Exception as e:
+                print(f"Ошибка удаления склада: {e}")
+                conn.rollback()
+                return False
     
     def get_employees_by_warehouse(self, warehouse_id):
         """Получает список сотрудников на указанном складе"""
-        conn = self._get_connection()
-        cursor = conn.cursor()
-        try:
-            cursor.execute('''
-                SELECT id, login, full_name, role 
-                FROM employees 
-                WHERE warehouse_id = %s
-            ''', (warehouse_id,))
-            employees = cursor.fetchall()
-            
-            result = []
-            for emp in employees:
-                result.append({
-                    'id': emp[0],
-                    'login': emp[1],
-                    'full_name': emp[2],
-                    'role': emp[3]
-                })
-            return result
-        except Exception as e:
-            print(f"Ошибка получения сотрудников склада: {e}")
-            return []
-        finally:
-            conn.close()
\ No newline at end of file
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    SELECT id, login, full_name, role 
+                    FROM employees 
+                    WHERE warehouse_id = %s
+                ''', (warehouse_id,))
+                employees = cursor.fetchall()
+                
+                result = []
+                for emp in employees:
+                    result.append({
+                        'id': emp[0],
+                        'login': emp[1],
+                        'full_name': emp[2],
+                        'role': emp[3]
+                    })
+                return result
+            except Exception as e:
+                print(f"Ошибка получения сотрудников склада: {e}")
+                return []
\ No newline at end of file
@@ -0,0 +1,311 @@
+"""Генератор синтетических данных для нагрузочной проверки.
+
+Строки формируются на лету и передаются через COPY FROM STDIN, без
+накопления в памяти. Данные детерминированы: одинаковые параметры
+и seed дают одинаковую базу.
+"""
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+from edb.migrations import seed_defaults
+
+# Таблицы с данными магазина; TRUNCATE очищает их разом
+DATA_TABLES = ('delivery_group_items', 'delivery_groups', 'deliveries', 'sales', 'sales_daily',
+               'stock_receipts', 'inventory_balances', 'inventory_snapshots', 'inventory_movements',
+               'customers', 'product_warehouse', 'products', 'employees', 'warehouses')
+# Таблицы, пользовательские триггеры которых (уведомления, итоги продаж)
+# отключаются на время загрузки
+TRIGGER_TABLES = ('product_warehouse', 'sales', 'deliveries')
+
+CATEGORIES = ('Холодильники', 'Стиральные машины', 'Телевизоры', 'Микроволновые печи', 'Пылесосы',
+              'Кондиционеры', 'Посудомоечные машины', 'Плиты', 'Чайники', 'Кофемашины')
+BRANDS = ('Samsung', 'LG', 'Bosch', 'Philips', 'Sony', 'Indesit', 'Haier', 'Electrolux',
+          'Beko', 'Xiaomi', 'Redmond', 'Tefal')
+FIRST_NAMES = ('Иван', 'Петр', 'Алексей', 'Сергей', 'Дмитрий', 'Анна', 'Мария', 'Елена',
+               'Ольга', 'Наталья', 'Андрей', 'Татьяна')
+LAST_NAMES = ('Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев',
+              'Соколов', 'Михайлов', 'Новиков', 'Федоров', 'Морозов')
+STREETS = ('ул. Ленина', 'ул. Пушкина', 'пр. Мира', 'ул. Гагарина', 'ул. Советская',
+           'ул. Садовая', 'ул. Лесная', 'ул. Школьная')
+CITIES = ('Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', 'Ростов-на-Дону')
+
+# Доля отмененных продаж
+CANCELLED_SALES = 0.01
+# Доставки моложе стольких дней еще не выполнены
+RECENT_DELIVERY_DAYS = 3
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, str):
+        return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+    return str(value)
+
+
+class CopyStream:
+    """Файлоподобный объект для COPY FROM STDIN: строки формируются по мере чтения"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = b''
+        self.count = 0
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = ('\t'.join(map(copy_value, row)) + '\n').encode('utf-8')
+            chunks.append(line)
+            length += len(line)
+            self.count += 1
+        data = b''.join(chunks)
+        if size < 0:
+            self._buffer = b''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+
+class DataGenerator:
+    """Заполняет базу синтетическими складами, сотрудниками, товарами,
+    клиентами, продажами и доставками.
+
+    Продажи равномерно распределены по последним days дням в порядке
+    возрастания даты, как в живой базе. Доставка оформляется на каждую
+    k-ю продажу, чтобы доставок было около deliveries.
+    """
+
+    def __init__(self, db, seed=0, cashiers_per_warehouse=5, storekeepers_per_warehouse=2):
+        self.db = db
+        self.seed = seed
+        self.cashiers_per_warehouse = cashiers_per_warehouse
+        self.storekeepers_per_warehouse = storekeepers_per_warehouse
+
+    def truncate(self, cursor=None):
+        """Очищает все данные и сбрасывает последовательности.
+
+        Основной склад и стандартные сотрудники создаются заново
+        с паролями по умолчанию. Если передан cursor, работает внутри
+        транзакции вызывающего кода.
+        """
+        if cursor is None:
+            with self.db._connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    self.truncate(cursor)
+                    conn.commit()
+                    return True
+                except Exception as e:
+                    print(f"Ошибка очистки данных: {e}")
+                    conn.rollback()
+                    return False
+
+        cursor.execute(f"TRUNCATE {', '.join(DATA_TABLES)} RESTART IDENTITY CASCADE")
+        seed_defaults(cursor)
+        return True
+
+    def generate(self, warehouses=5, products=1000, customers=10000, sales=100000,
+                 deliveries=10000, days=365, log=print):
+        """Очищает базу и заполняет ее заново. Возвращает {таблица: число строк}"""
+        rng = random.Random(self.seed)
+        counts = {}
+        with self.db._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                self.truncate(cursor)
+                now = datetime.now().replace(microsecond=0)
+                start = now - timedelta(days=days)
+                # Секции заранее: иначе все продажи лягут в sales_default
+                cursor.execute('''
+                    SELECT create_sales_partition(month::date)
+                    FROM generate_series(date_trunc('month', %s::timestamp), %s, interval '1 month') AS month
+                ''', (start, now))
+                self._set_triggers(cursor, False)
+
+                warehouse_ids = self._copy_warehouses(cursor, warehouses, rng, counts)
+                staff = self._copy_employees(cursor, warehouse_ids, counts)
+                prices = self._copy_products(cursor, products, rng, counts)
+                self._copy_stock(cursor, warehouse_ids, len(prices), rng, counts)
+                self._copy_customers(cursor, customers, rng, counts)
+                log(f"Справочники загружены: {counts}")
+
+                step = max(1, sales // deliveries) if deliveries else 0
+                with tempfile.TemporaryFile() as pending_deliveries:
+                    counts['sales'], counts['deliveries'] = self._copy_sales(
+                        cursor, sales, start, now, warehouse_ids, staff, prices, customers,
+                        step, pending_deliveries, rng
+                    )
+                    log(f"Продажи загружены: {counts['sales']}")
+                    pending_deliveries.seek(0)
+                    cursor.copy_expert('''
+                        COPY deliveries (id, sale_id, customer_id, delivery_address, status,
+                                         assigned_storekeeper_id, delivery_date, created_date)
+                        FROM STDIN
+                    ''', pending_deliveries)
+
+                self._set_triggers(cursor, True)
+                self.db.reports.rebuild(cursor)
+                # Остатки грузились без триггеров - журнал начинается с них
+                cursor.execute('''
+                    INSERT INTO inventory_movements (product_id, warehouse_id, delta, reason)
+                    SELECT product_id, warehouse_id, quantity, 'opening'
+                    FROM product_warehouse
+                    WHERE quantity <> 0
+                ''')
+                for table in ('warehouses', 'employees', 'products', 'customers', 'sales', 'deliveries'):
+                    # id задавались явно - продолжаем последовательности после них
+                    cursor.execute(f"SELECT setval('{table}_id_seq', COALESCE((SELECT MAX(id) FROM {table}), 1))")
+                conn.commit()
+            except Exception as e:
+                print(f"Ошибка генерации данных: {e}")
+                conn.rollback()
+                return None
+
+            # Статистика для планировщика по только что загруженным таблицам
+            for table in DATA_TABLES:
+                cursor.execute(f"ANALYZE {table}")
+            conn.commit()
+        return counts
+
+    def _set_triggers(self, cursor, enabled):
+        action = 'ENABLE' if enabled else 'DISABLE'
+        cursor.execute('''
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'sales'::regclass
+        ''')
+        # Секции перечисляются явно: не все версии PostgreSQL распространяют
+        # ALTER TABLE ... TRIGGER с родительской таблицы на секции
+        for table in TRIGGER_TABLES + tuple(row[0] for row in cursor.fetchall()):
+            cursor.execute(f"ALTER TABLE {table} {action} TRIGGER USER")
+
+    def _copy(self, cursor, table, columns, rows):
+        stream = CopyStream(rows)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream)
+        return stream.count
+
+    def _copy_warehouses(self, cursor, count, rng, counts):
+        # Основной склад уже создан seed_defaults
+        rows = [
+            (i, f'Склад {i}', f'{rng.choice(STREETS)}, д. {rng.randint(1, 200)}, г. {rng.choice(CITIES)}')
+            for i in range(2, count + 1)
+        ]
+        counts['warehouses'] = self._copy(cursor, 'warehouses', ('id', 'name', 'address'), rows) + 1
+        return list(range(1, count + 1))
+
+    def _copy_employees(self, cursor, warehouse_ids, counts):
+        """Кассиры и кладовщики складов: {склад: (id кассиров, id кладовщиков)}"""
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM employees")
+        next_id = cursor.fetchone()[0] + 1
+        staff = {}
+        rows = []
+        for warehouse_id in warehouse_ids:
+            cashiers, storekeepers = [], []
+            for role, ids, number in (('cashier', cashiers, self.cashiers_per_warehouse),
+                                      ('storekeeper', storekeepers, self.storekeepers_per_warehouse)):
+                for i in range(1, number + 1):
+                    rows.append((next_id, f'{role}_{warehouse_id}_{i}', 'test123',
+                                 f'Сотрудник {warehouse_id}-{role}-{i}', role,
+                                 f'+7000{next_id:07d}', f'{role}{next_id}@example.com', warehouse_id))
+                    ids.append(next_id)
+                    next_id += 1
+            staff[warehouse_id] = (cashiers, storekeepers)
+        counts['employees'] = self._copy(
+            cursor, 'employees',
+            ('id', 'login', 'password', 'full_name', 'role', 'phone', 'email', 'warehouse_id'), rows
+        )
+        return staff
+
+    def _copy_products(self, cursor, count, rng, counts):
+        """Возвращает цены товаров: prices[id - 1]"""
+        prices = []
+
+        def rows():
+            for product_id in range(1, count + 1):
+                category = rng.choice(CATEGORIES)
+                brand = rng.choice(BRANDS)
+                price = round(rng.uniform(1000, 200000), 2)
+                prices.append(price)
+                yield (product_id, f'{category} {brand} {product_id:06d}', category, brand,
+                       f'{price:.2f}', rng.randint(0, 10))
+
+        counts['products'] = self._copy(
+            cursor, 'products', ('id', 'name', 'category', 'brand', 'price', 'min_quantity'), rows()
+        )
+        return prices
+
+    def _copy_stock(self, cursor, warehouse_ids, products, rng, counts):
+        rows = (
+            (product_id, warehouse_id, rng.randint(0, 500))
+            for warehouse_id in warehouse_ids
+            for product_id in range(1, products + 1)
+        )
+        counts['product_warehouse'] = self._copy(
+            cursor, 'product_warehouse', ('product_id', 'warehouse_id', 'quantity'), rows
+        )
+
+    def _copy_customers(self, cursor, count, rng, counts):
+        rows = (
+            (customer_id, f'{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}',
+             # Номер выводится из id, поэтому телефоны уникальны
+             f'+79{customer_id:09d}', f'customer{customer_id}@example.com',
+             f'{rng.choice(STREETS)}, д. {rng.randint(1, 200)}, кв. {rng.randint(1, 300)}, '
+             f'г. {rng.choice(CITIES)}')
+            for customer_id in range(1, count + 1)
+        )
+        counts['customers'] = self._copy(
+            cursor, 'customers', ('id', 'full_name', 'phone', 'email', 'address'), rows
+        )
+
+    def _copy_sales(self, cursor, count, start, end, warehouse_ids, staff, prices, customers,
+                    step, pending_deliveries, rng):
+        """Загружает продажи, доставки каждой step-й продажи пишет в pending_deliveries.
+
+        Возвращает (число продаж, число доставок).
+        """
+        span = (end - start).total_seconds()
+        recent = end - timedelta(days=RECENT_DELIVERY_DAYS)
+        delivery_id = 0
+
+        def rows():
+            nonlocal delivery_id
+            for sale_id in range(1, count + 1):
+                sale_date = start + timedelta(seconds=span * sale_id / (count + 1))
+                warehouse_id = rng.choice(warehouse_ids)
+                cashiers, storekeepers = staff[warehouse_id]
+                product_id = rng.randint(1, len(prices))
+                quantity = rng.randint(1, 3)
+                status = 'cancelled' if rng.random() < CANCELLED_SALES else 'completed'
+                yield (sale_id, product_id, quantity, f'{prices[product_id - 1] * quantity:.2f}',
+                       sale_date, rng.choice(cashiers), warehouse_id, status)
+
+                if step and sale_id % step == 0 and customers and status == 'completed':
+                    delivery_id += 1
+                    storekeeper_id = rng.choice(storekeepers) if storekeepers else None
+                    if sale_date < recent:
+                        delivery = ('delivered', storekeeper_id,
+                                    sale_date + timedelta(hours=rng.randint(4, 72)))
+                    elif rng.random() < 0.5:
+                        delivery = ('pending', None, None)
+                    else:
+                        delivery = (rng.choice(('assigned', 'in_progress')), storekeeper_id, None)
+                    line = '\t'.join(map(copy_value, (
+                        delivery_id, sale_id, rng.randint(1, customers),
+                        f'{rng.choice(STREETS)}, д. {rng.randint(1, 200)}, г. {rng.choice(CITIES)}',
+                    ) + delivery + (sale_date,))) + '\n'
+                    pending_deliveries.write(line.encode('utf-8'))
+
+        sales = self._copy(
+            cursor, 'sales',
+            ('id', 'product_id', 'quantity', 'total_price', 'sale_date', 'cashier_id', 'warehouse_id', 'status'),
+            rows()
+        )
+        return sales, delivery_id
@@ -0,0 +1,130 @@
+"""Потоковая выгрузка записей Database в CSV и XLSX.
+
+Записи читаются из генератора (Database.iter_*) и сразу пишутся в файл,
+поэтому память не зависит от объема выгрузки. XLSX пишется в режиме
+write_only openpyxl; без openpyxl доступен только CSV.
+"""
+import csv
+import os
+
+try:
+    from openpyxl import Workbook
+except ImportError:
+    Workbook = None
+
+from edb.rows import format_value
+
+# Как часто сообщать о ходе выгрузки и проверять отмену, строк
+PROGRESS_EVERY = 1000
+
+
+class ExportCancelled(Exception):
+    """Выгрузка отменена пользователем"""
+
+
+def available_formats():
+    """Расширения файлов, в которые можно выгружать"""
+    return ['csv', 'xlsx'] if Workbook is not None else ['csv']
+
+
+class _CsvWriter:
+    def __init__(self, path):
+        # BOM и ';' - чтобы Excel с русской локалью открывал файл без мастера импорта
+        self.file = open(path, 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file, delimiter=';')
+
+    def header(self, titles):
+        self.writer.writerow(titles)
+
+    def row(self, record, columns):
+        self.writer.writerow([
+            formatter(record[field]) if formatter else format_value(record[field])
+            for _, field, formatter in columns
+        ])
+
+    def close(self):
+        self.file.close()
+
+    def discard(self):
+        self.file.close()
+
+
+class _XlsxWriter:
+    # Строк на листе Excel, включая заголовок; дальше выгрузка идет на новый лист
+    MAX_ROWS = 1048576
+
+    def __init__(self, path):
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = None
+        self.titles = None
+        self.rows = 0
+
+    def header(self, titles):
+        self.titles = titles
+        self.sheet = self.workbook.create_sheet()
+        self.sheet.append(titles)
+        self.rows = 1
+
+    def row(self, record, columns):
+        if self.rows >= self.MAX_ROWS:
+            self.header(self.titles)
+        # Даты и суммы пишутся значениями, чтобы в Excel по ним работали формулы
+        self.sheet.append([
+            formatter(record[field]) if formatter else record[field]
+            for _, field, formatter in columns
+        ])
+        self.rows += 1
+
+    def close(self):
+        self.workbook.save(self.path)
+
+    def discard(self):
+        # До save на диске ничего нет
+        pass
+
+
+def export_records(records, path, columns, progress=None, cancelled=None):
+    """Пишет записи records в файл path, формат - по расширению.
+
+    columns - (заголовок, поле) или (заголовок, поле, форматтер), как у
+    RowTableModel. progress(число строк) вызывается каждые PROGRESS_EVERY
+    строк; если cancelled() истинно, выгрузка прерывается ExportCancelled.
+    Файл пишется под временным именем и появляется только целиком.
+    Генератор records закрывается в любом случае. Возвращает число строк.
+    """
+    columns = [(c[0], c[1], c[2] if len(c) > 2 else None) for c in columns]
+    partial = path + '.part'
+    writer = None
+    try:
+        if path.lower().endswith('.xlsx'):
+            if Workbook is None:
+                raise RuntimeError("Для выгрузки в XLSX нужен пакет openpyxl")
+            writer = _XlsxWriter(partial)
+        else:
+            writer = _CsvWriter(partial)
+        writer.header([title for title, _, _ in columns])
+
+        count = 0
+        for record in records:
+            writer.row(record, columns)
+            count += 1
+            if count % PROGRESS_EVERY == 0:
+                if cancelled is not None and cancelled():
+                    raise ExportCancelled()
+                if progress is not None:
+                    progress(count)
+        writer.close()
+        writer = None
+        os.replace(partial, path)
+        return count
+    except BaseException:
+        if writer is not None:
+            writer.discard()
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        close = getattr(records, 'close', None)
+        if close is not None:
+            close()
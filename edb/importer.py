@@ -0,0 +1,130 @@
+"""Чтение файлов загрузки товаров и остатков (CSV и XLSX).
+
+Первая строка файла - заголовки; столбцы узнаются по названию, как
+в таблице товаров окон ("ID", "Название", "Цена", ...) или по имени
+поля (id, name, price, ...), порядок и лишние столбцы не важны.
+Строки отдаются генератором без проверки значений: проверяет
+и загружает их Database.import_products.
+"""
+import codecs
+import csv
+import datetime
+
+try:
+    from openpyxl import load_workbook
+except ImportError:
+    load_workbook = None
+
+# Поля строки загрузки в порядке Database.import_products
+FIELDS = ('product_id', 'name', 'category', 'brand', 'price', 'min_quantity', 'warehouse', 'quantity')
+
+# Заголовок в нижнем регистре -> поле
+HEADERS = {
+    'id': 'product_id',
+    'id товара': 'product_id',
+    'product_id': 'product_id',
+    'название': 'name',
+    'товар': 'name',
+    'name': 'name',
+    'категория': 'category',
+    'category': 'category',
+    'бренд': 'brand',
+    'brand': 'brand',
+    'цена': 'price',
+    'price': 'price',
+    'мин. количество': 'min_quantity',
+    'min_quantity': 'min_quantity',
+    'склад': 'warehouse',
+    'warehouse': 'warehouse',
+    'warehouse_id': 'warehouse',
+    'количество': 'quantity',
+    'quantity': 'quantity',
+}
+
+# Сколько байт начала CSV смотреть, определяя кодировку и разделитель
+SNIFF_BYTES = 64 * 1024
+
+
+def available_formats():
+    """Расширения файлов, из которых можно загружать"""
+    return ['csv', 'xlsx'] if load_workbook is not None else ['csv']
+
+
+def read_rows(path):
+    """Строки файла path: генератор (номер строки, значения FIELDS).
+
+    Номер строки - как в Excel, заголовок - строка 1. Пустые значения
+    и отсутствующие столбцы - None, пустые строки пропускаются.
+    Заголовок читается сразу: ValueError, если в нем нет ни одного
+    известного столбца или формат файла не поддерживается.
+    """
+    if path.lower().endswith('.xlsx'):
+        if load_workbook is None:
+            raise ValueError("Для загрузки из XLSX нужен пакет openpyxl")
+        rows = _xlsx_rows(path)
+    else:
+        rows = _csv_rows(path)
+
+    header = next(rows, None) or []
+    columns = {}
+    for index, title in enumerate(header):
+        field = HEADERS.get(' '.join(_text(title).lower().split()))
+        if field is not None and field not in columns:
+            columns[field] = index
+    if not columns:
+        rows.close()
+        raise ValueError("В первой строке файла нет известных заголовков столбцов")
+    if 'product_id' not in columns and 'name' not in columns:
+        rows.close()
+        raise ValueError("В файле нет столбца ID или названия товара")
+    return _records(rows, [columns.get(field) for field in FIELDS])
+
+
+def _records(rows, indexes):
+    for line, row in enumerate(rows, start=2):
+        values = tuple(
+            (_text(row[index]) or None) if index is not None and index < len(row) else None
+            for index in indexes
+        )
+        if any(value is not None for value in values):
+            yield line, values
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Целые числа XLSX хранит как float: 5.0 -> '5'
+        return str(int(value))
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=' ')
+    return str(value).strip()
+
+
+def _csv_rows(path):
+    with open(path, 'rb') as f:
+        sample = f.read(SNIFF_BYTES)
+    # Файлы из Excel с русской локалью бывают в cp1251
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=len(sample) < SNIFF_BYTES)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        encoding = 'cp1251'
+    text = sample.decode(encoding, 'ignore')
+    try:
+        dialect = csv.Sniffer().sniff(text.split('\n', 1)[0], delimiters=';,\t')
+        delimiter = dialect.delimiter
+    except csv.Error:
+        delimiter = ';'
+
+    with open(path, newline='', encoding=encoding) as f:
+        yield from csv.reader(f, delimiter=delimiter)
+
+
+def _xlsx_rows(path):
+    # read_only читает лист потоком, не загружая книгу целиком
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
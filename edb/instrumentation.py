@@ -0,0 +1,233 @@
+"""Учет запросов к базе: время, строки, ожидание соединения и журнал медленных.
+
+Пул открывает соединения InstrumentedConnection, курсоры которых
+замеряют каждый execute и сообщают о нем в QueryMetrics. Имя запроса -
+модуль и функция, из которой он выполнен (например database.checkout),
+поэтому в статистике видно, какой метод Database и, значит, какое
+действие в окне медленное.
+"""
+import bisect
+import contextlib
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+
+from psycopg2 import extensions
+
+from edb.prepared import PreparedConnection, prepared_text
+
+# Верхние границы корзин гистограмм, мс
+HISTOGRAM_BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+# Размер файла журнала медленных запросов и число старых файлов
+SLOW_LOG_MAX_BYTES = 5 * 1024 * 1024
+SLOW_LOG_BACKUPS = 5
+
+# Кадры этих файлов и функций, выдающих соединения, пропускаются
+# при определении имени запроса
+_SKIPPED_DIRS = (os.path.dirname(extensions.__file__),)
+_SKIPPED_FILES = {
+    os.path.abspath(__file__),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pool.py'),
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prepared.py'),
+    os.path.abspath(contextlib.__file__),
+}
+_SKIPPED_FUNCTIONS = {'_connection'}
+
+
+def statement_name():
+    """Модуль и функция вызывающего кода вне пула, psycopg2 и этого модуля"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if (filename not in _SKIPPED_FILES and not filename.startswith(_SKIPPED_DIRS)
+                and frame.f_code.co_name not in _SKIPPED_FUNCTIONS):
+            module = os.path.splitext(os.path.basename(filename))[0]
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return 'unknown'
+
+
+class _Stat:
+    __slots__ = ('calls', 'errors', 'rows', 'total', 'max', 'buckets',
+                 'waits', 'wait_total', 'wait_max')
+
+    def __init__(self):
+        self.calls = self.errors = self.rows = self.waits = 0
+        self.total = self.max = self.wait_total = self.wait_max = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+
+class QueryMetrics:
+    """Счетчики и гистограммы запросов процесса по именам.
+
+    slow_query_ms - порог, выше которого запрос пишется в журнал
+    slow_query_log (ротация по размеру); None или 0 - журнал выключен.
+    explain - снимать ли для медленных SELECT план EXPLAIN (ANALYZE,
+    BUFFERS): False, True или набор имен запросов. Атрибут можно менять
+    на ходу, когда нужно разобрать конкретный медленный запрос.
+    """
+
+    def __init__(self, slow_query_ms=None, slow_query_log=None, explain=False):
+        self.slow_query_ms = slow_query_ms
+        self.explain = explain
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slow_log = _slow_logger(slow_query_log) if slow_query_ms and slow_query_log else None
+
+    def _stat(self, name):
+        stat = self._stats.get(name)
+        if stat is None:
+            stat = self._stats[name] = _Stat()
+        return stat
+
+    def observe(self, name, seconds, rows=0, error=False):
+        """Учитывает выполненный запрос"""
+        with self._lock:
+            stat = self._stat(name)
+            stat.calls += 1
+            stat.errors += error
+            stat.rows += max(rows, 0)
+            stat.total += seconds
+            stat.max = max(stat.max, seconds)
+            stat.buckets[bisect.bisect_left(HISTOGRAM_BOUNDS, seconds * 1000)] += 1
+
+    def observe_wait(self, name, seconds):
+        """Учитывает ожидание соединения из пула"""
+        with self._lock:
+            stat = self._stat(name)
+            stat.waits += 1
+            stat.wait_total += seconds
+            stat.wait_max = max(stat.wait_max, seconds)
+
+    def is_slow(self, seconds):
+        return bool(self.slow_query_ms) and seconds * 1000 >= self.slow_query_ms
+
+    def wants_plan(self, name, query):
+        explain = self.explain
+        if not explain or (explain is not True and name not in explain):
+            return False
+        # ANALYZE выполняет запрос повторно - только для чтения
+        return query.lstrip().upper().startswith('SELECT')
+
+    def log_slow(self, name, seconds, rows, query, plan=None):
+        message = f"{name} {seconds * 1000:.1f} мс, строк: {rows}\n{query.strip()}"
+        if plan:
+            message += "\n" + "\n".join(plan)
+        if self._slow_log is not None:
+            self._slow_log.warning(message)
+
+    def snapshot(self):
+        """Статистика по именам запросов, от наибольшего суммарного времени"""
+        with self._lock:
+            result = {}
+            for name, stat in sorted(self._stats.items(), key=lambda item: item[1].total, reverse=True):
+                result[name] = {
+                    'calls': stat.calls,
+                    'errors': stat.errors,
+                    'rows': stat.rows,
+                    'total_ms': stat.total * 1000,
+                    'mean_ms': stat.total / stat.calls * 1000 if stat.calls else 0.0,
+                    'max_ms': stat.max * 1000,
+                    'histogram': list(stat.buckets),
+                    'waits': stat.waits,
+                    'wait_total_ms': stat.wait_total * 1000,
+                    'wait_max_ms': stat.wait_max * 1000,
+                }
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+def _slow_logger(path):
+    """Логгер журнала медленных запросов с ротацией; один обработчик на файл"""
+    path = os.path.abspath(path)
+    logger = logging.getLogger('edb.slow_queries')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not any(getattr(handler, 'baseFilename', None) == path for handler in logger.handlers):
+        try:
+            handler = logging.handlers.RotatingFileHandler(
+                path, maxBytes=SLOW_LOG_MAX_BYTES, backupCount=SLOW_LOG_BACKUPS, encoding='utf-8'
+            )
+        except OSError as e:
+            print(f"Ошибка открытия журнала медленных запросов: {e}")
+            return None
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+
+class InstrumentedCursor(extensions.cursor):
+    """Курсор, сообщающий о каждом запросе в metrics соединения"""
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, query, vars_list, plan=False)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed(super().copy_expert, sql, file, size, plan=False)
+
+    def _timed(self, method, query, *args, plan=True):
+        metrics = self.connection.metrics
+        name = statement_name()
+        started = time.perf_counter()
+        try:
+            result = method(query, *args)
+        except Exception:
+            metrics.observe(name, time.perf_counter() - started, error=True)
+            raise
+        elapsed = time.perf_counter() - started
+        metrics.observe(name, elapsed, self.rowcount)
+
+        if metrics.is_slow(elapsed):
+            if isinstance(query, bytes):
+                query = query.decode(extensions.encodings.get(self.connection.encoding, 'utf-8'), 'replace')
+            else:
+                query = str(query)
+            # В журнал идет текст запроса без параметров: среди них бывают пароли
+            text = prepared_text(query)
+            lines = None
+            # Серверный курсор выгрузки на время EXPLAIN ANALYZE не повторяем
+            if plan and self.name is None and metrics.wants_plan(name, text):
+                lines = self._plan(query, args[0] if args else None)
+            metrics.log_slow(name, elapsed, self.rowcount, text, lines)
+        return result
+
+    def _plan(self, query, vars):
+        """План запроса; выполняется отдельным курсором под точкой сохранения,
+        чтобы не трогать результат этого курсора и транзакцию вызывающего кода"""
+        conn = self.connection
+        savepoint = not conn.autocommit
+        cursor = extensions.cursor(conn)
+        try:
+            if savepoint:
+                cursor.execute("SAVEPOINT query_plan")
+            try:
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, vars)
+                lines = [row[0] for row in cursor.fetchall()]
+            finally:
+                if savepoint:
+                    cursor.execute("ROLLBACK TO SAVEPOINT query_plan")
+                    cursor.execute("RELEASE SAVEPOINT query_plan")
+            return lines
+        except Exception as e:
+            return [f"Ошибка получения плана: {e}"]
+        finally:
+            cursor.close()
+
+
+class InstrumentedConnection(PreparedConnection):
+    """Соединение, курсоры которого по умолчанию InstrumentedCursor"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = QueryMetrics()
+        self.cursor_factory = InstrumentedCursor
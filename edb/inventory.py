@@ -0,0 +1,255 @@
+"""Остатки на момент времени из журнала движения товаров (миграция 10).
+
+Движения пишет триггер на product_warehouse одной вставкой на оператор,
+так что продажа платит за журнал только этой вставкой. Раз в период
+(SNAPSHOT_PERIOD) остатки складываются в снимок из предыдущего снимка
+и движений периода; остаток на любой момент - ближайший более ранний
+снимок плюс движения после него, то есть чтение не больше одного
+периода журнала, а не всей истории.
+"""
+import json
+from datetime import timedelta
+
+from edb.migrations import INVENTORY_SNAPSHOT_LOCK_KEY
+from edb.prepared import execute_prepared
+
+# Причины движений; параметр edb.movement_reason транзакции
+MOVEMENT_REASONS = ('opening', 'sale', 'cancel', 'adjust', 'receive', 'transfer', 'import')
+
+
+# Условие запроса, ставящее параметры движения до конца транзакции;
+# параметры - movement_params. Подзапрос не ссылается на строки и
+# выполняется один раз до их чтения, поэтому условие встраивается в запрос,
+# который и так идет до изменения остатков (блокировка строк при продаже),
+# и отдельного обращения к серверу не нужно
+MOVEMENT_CONDITION = '''
+    (SELECT set_config('edb.movement_reason', %s, true)
+            || set_config('edb.movement_employee', %s, true)
+            || set_config('edb.movement_reference', %s, true)
+            || set_config('edb.movement_references', %s, true)) IS NOT NULL
+'''
+
+
+def movement_params(reason, employee_id=None, reference=None, references=None):
+    """Параметры MOVEMENT_CONDITION: причина, сотрудник и документ изменений.
+
+    reference - документ всех изменений транзакции, references -
+    {product_id: документ} для отдельных товаров (продажи корзины).
+    Их записывает в журнал триггер product_warehouse.
+    """
+    return (reason, '' if employee_id is None else str(employee_id), _reference(reference),
+            json.dumps({str(product_id): _reference(value) for product_id, value in references.items()})
+            if references else '')
+
+
+def _reference(value):
+    return '' if value is None else str(value)[:100]
+
+
+def set_movement(cursor, reason, employee_id=None, reference=None, references=None):
+    """Ставит параметры движения отдельным запросом; вызывается в транзакции
+    до изменения остатков"""
+    execute_prepared(cursor, f"SELECT {MOVEMENT_CONDITION}",
+                     movement_params(reason, employee_id, reference, references))
+
+
+class InventoryLedger:
+    """Журнал движения товаров, снимки и остатки на момент времени"""
+
+    # Единица date_trunc и шаг снимков
+    SNAPSHOT_PERIOD = 'week'
+    # Снимок на начало периода делается не раньше, чем через столько
+    # после него: к этому времени транзакции с движениями до границы
+    # уже зафиксированы
+    SNAPSHOT_LAG = timedelta(hours=1)
+
+    def __init__(self, db):
+        self.db = db
+
+    def take_snapshots(self, cursor=None):
+        """Делает недостающие снимки на начала периодов.
+
+        Снимок - предыдущий снимок плюс движения до его границы, поэтому
+        он согласован с журналом. Если снимки делает другой клиент, сразу
+        возвращает 0. Возвращает число новых снимков, None при ошибке.
+        Если передан cursor, работает внутри транзакции вызывающего кода.
+        """
+        if cursor is None:
+            with self.db._connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    taken = self.take_snapshots(cursor)
+                    conn.commit()
+                    return taken
+                except Exception as e:
+                    print(f"Ошибка снимка остатков: {e}")
+                    conn.rollback()
+                    return None
+
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (INVENTORY_SNAPSHOT_LOCK_KEY,))
+        if not cursor.fetchone()[0]:
+            return 0
+        step = f'1 {self.SNAPSHOT_PERIOD}'
+        # Первый снимок - на начало периода, следующего за первым движением
+        cursor.execute(f'''
+            SELECT generate_series(
+                COALESCE((SELECT MAX(taken_at) FROM inventory_snapshots) + interval '{step}',
+                         (SELECT date_trunc('{self.SNAPSHOT_PERIOD}', MIN(moved_at)) + interval '{step}'
+                          FROM inventory_movements)),
+                date_trunc('{self.SNAPSHOT_PERIOD}', LOCALTIMESTAMP - %s::interval),
+                interval '{step}'
+            )
+        ''', (self.SNAPSHOT_LAG,))
+        boundaries = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT MAX(taken_at) FROM inventory_snapshots")
+        previous = cursor.fetchone()[0]
+        for taken_at in boundaries:
+            cursor.execute("INSERT INTO inventory_snapshots (taken_at) VALUES (%s)", (taken_at,))
+            cursor.execute('''
+                INSERT INTO inventory_balances (taken_at, warehouse_id, product_id, quantity)
+                SELECT %(taken_at)s, warehouse_id, product_id, SUM(quantity)
+                FROM (
+                    SELECT warehouse_id, product_id, quantity
+                    FROM inventory_balances
+                    WHERE taken_at = %(previous)s
+                    UNION ALL
+                    SELECT warehouse_id, product_id, delta
+                    FROM inventory_movements
+                    WHERE moved_at >= COALESCE(%(previous)s::timestamp, '-infinity') AND moved_at < %(taken_at)s
+                ) AS changes
+                GROUP BY warehouse_id, product_id
+                HAVING SUM(quantity) <> 0
+            ''', {'taken_at': taken_at, 'previous': previous})
+            previous = taken_at
+        return len(boundaries)
+
+    def _balances_query(self, moment, warehouse_id, product_ids):
+        """Запрос остатков (склад, товар, количество) на момент moment
+        (None - по всему журналу) и его параметры"""
+        conditions = []
+        params = {'moment': moment, 'warehouse_id': warehouse_id, 'product_ids': product_ids}
+        if warehouse_id:
+            conditions.append("warehouse_id = %(warehouse_id)s")
+        if product_ids is not None:
+            conditions.append("product_id = ANY(%(product_ids)s)")
+        filters = "".join(f" AND {condition}" for condition in conditions)
+        snapshot = '''
+            (SELECT MAX(taken_at) FROM inventory_snapshots
+             WHERE %(moment)s::timestamp IS NULL OR taken_at <= %(moment)s)
+        '''
+        query = f'''
+            SELECT warehouse_id, product_id, SUM(quantity)::int AS quantity
+            FROM (
+                SELECT warehouse_id, product_id, quantity
+                FROM inventory_balances
+                WHERE taken_at = {snapshot}{filters}
+                UNION ALL
+                SELECT warehouse_id, product_id, delta
+                FROM inventory_movements
+                WHERE moved_at >= COALESCE({snapshot}, '-infinity')
+                  AND (%(moment)s::timestamp IS NULL OR moved_at <= %(moment)s){filters}
+            ) AS changes
+            GROUP BY warehouse_id, product_id
+        '''
+        return query, params
+
+    def stock_at(self, moment, warehouse_id=None, product_ids=None):
+        """Остатки на момент moment по журналу.
+
+        Строки: warehouse_id, product_id, quantity; нулевые остатки
+        не возвращаются.
+        """
+        query, params = self._balances_query(moment, warehouse_id, product_ids)
+        with self.db._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"SELECT * FROM ({query}) AS balances WHERE quantity <> 0 "
+                               "ORDER BY warehouse_id, product_id", params)
+                return [
+                    {'warehouse_id': row[0], 'product_id': row[1], 'quantity': row[2]}
+                    for row in cursor.fetchall()
+                ]
+            except Exception as e:
+                print(f"Ошибка получения остатков на дату: {e}")
+                return []
+
+    def movements(self, product_id=None, warehouse_id=None, date_from=None, date_to=None, limit=500):
+        """Движения от новых к старым за [date_from, date_to)"""
+        conditions = []
+        params = []
+        if product_id:
+            conditions.append("m.product_id = %s")
+            params.append(product_id)
+        if warehouse_id:
+            conditions.append("m.warehouse_id = %s")
+            params.append(warehouse_id)
+        if date_from:
+            conditions.append("m.moved_at >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("m.moved_at < %s")
+            params.append(date_to)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+        with self.db._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f'''
+                    SELECT m.id, m.moved_at, m.product_id, COALESCE(p.name, 'Удален'),
+                           m.warehouse_id, m.delta, m.reason, e.full_name, m.reference
+                    FROM inventory_movements m
+                    LEFT JOIN products p ON p.id = m.product_id
+                    LEFT JOIN employees e ON e.id = m.employee_id
+                    {where}
+                    ORDER BY m.moved_at DESC, m.id DESC
+                    LIMIT %s
+                ''', params + [limit])
+                result = []
+                for row in cursor.fetchall():
+                    result.append({
+                        'id': row[0],
+                        'moved_at': row[1],
+                        'product_id': row[2],
+                        'product_name': row[3],
+                        'warehouse_id': row[4],
+                        'delta': row[5],
+                        'reason': row[6],
+                        'employee_name': row[7],
+                        'reference': row[8]
+                    })
+                return result
+            except Exception as e:
+                print(f"Ошибка получения движения товаров: {e}")
+                return []
+
+    def discrepancies(self, warehouse_id=None):
+        """Остатки, расходящиеся с журналом: warehouse_id, product_id,
+        stock (product_warehouse) и ledger (по журналу).
+
+        Пустой список - каждое изменение остатков попало в журнал.
+        """
+        query, params = self._balances_query(None, warehouse_id, None)
+        stock_filter = " AND pw.warehouse_id = %(warehouse_id)s" if warehouse_id else ""
+        with self.db._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f'''
+                    SELECT COALESCE(pw.warehouse_id, l.warehouse_id), COALESCE(pw.product_id, l.product_id),
+                           COALESCE(pw.quantity, 0), COALESCE(l.quantity, 0)
+                    FROM (
+                        SELECT warehouse_id, product_id, quantity
+                        FROM product_warehouse pw
+                        WHERE pw.quantity <> 0{stock_filter}
+                    ) pw
+                    FULL JOIN ({query}) l
+                      ON l.warehouse_id = pw.warehouse_id AND l.product_id = pw.product_id
+                    WHERE COALESCE(pw.quantity, 0) <> COALESCE(l.quantity, 0)
+                    ORDER BY 1, 2
+                ''', params)
+                return [
+                    {'warehouse_id': row[0], 'product_id': row[1], 'stock': row[2], 'ledger': row[3]}
+                    for row in cursor.fetchall()
+                ]
+            except Exception as e:
+                print(f"Ошибка сверки остатков с журналом: {e}")
+                return []
@@ -0,0 +1,874 @@
+"""Версионированные миграции схемы базы данных.
+
+Каждая миграция - функция, получающая курсор. Примененные версии
+записываются в таблицу schema_version, поэтому при запуске выполняются
+только новые миграции. Новую миграцию добавляют в конец MIGRATIONS
+со следующим номером версии; уже выпущенные миграции не меняют.
+"""
+import psycopg2
+
+# Ключ advisory-блокировки: несколько клиентов не мигрируют схему одновременно
+MIGRATION_LOCK_KEY = 4242001
+# Ключ advisory-блокировки создания секций продаж
+SALES_PARTITION_LOCK_KEY = 4242002
+# Ключ advisory-блокировки загрузки товаров: параллельные загрузки
+# не создают один и тот же новый товар дважды
+PRODUCT_IMPORT_LOCK_KEY = 4242003
+# Ключ advisory-блокировки снимков остатков
+INVENTORY_SNAPSHOT_LOCK_KEY = 4242004
+
+
+def _v1_initial_schema(cursor):
+    """Начальная схема и сотрудники по умолчанию"""
+    # Таблица складов
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS warehouses (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(200) NOT NULL,
+            address VARCHAR(300) NOT NULL
+        )
+    ''')
+
+    # Таблица сотрудников 
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS employees (
+            id SERIAL PRIMARY KEY,
+            login VARCHAR(100) UNIQUE NOT NULL,
+            password VARCHAR(100) NOT NULL,
+            full_name VARCHAR(200) NOT NULL,
+            role VARCHAR(50) NOT NULL,
+            phone VARCHAR(20),
+            email VARCHAR(100),
+            warehouse_id INTEGER REFERENCES warehouses(id)
+        )
+    ''')
+
+    # Таблица товаров
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(200) NOT NULL,
+            category VARCHAR(100) NOT NULL,
+            brand VARCHAR(100),
+            price DECIMAL(10, 2) NOT NULL,
+            min_quantity INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # Таблица наличия товаров на складах
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS product_warehouse (
+            id SERIAL PRIMARY KEY,
+            product_id INTEGER REFERENCES products(id),
+            warehouse_id INTEGER REFERENCES warehouses(id),
+            quantity INTEGER NOT NULL DEFAULT 0,
+            UNIQUE(product_id, warehouse_id)
+        )
+    ''')
+
+    # Таблица продаж
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sales (
+            id SERIAL PRIMARY KEY,
+            product_id INTEGER REFERENCES products(id),
+            quantity INTEGER NOT NULL,
+            total_price DECIMAL(10, 2) NOT NULL,
+            sale_date TIMESTAMP NOT NULL,
+            cashier_id INTEGER REFERENCES employees(id),
+            warehouse_id INTEGER REFERENCES warehouses(id),
+            status VARCHAR(20) DEFAULT 'completed'
+        )
+    ''')
+
+    # НОВАЯ ТАБЛИЦА: Клиенты
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS customers (
+            id SERIAL PRIMARY KEY,
+            full_name VARCHAR(200) NOT NULL,
+            phone VARCHAR(20) NOT NULL,
+            email VARCHAR(100),
+            address TEXT NOT NULL,
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # НОВАЯ ТАБЛИЦА: Доставки
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS deliveries (
+            id SERIAL PRIMARY KEY,
+            sale_id INTEGER REFERENCES sales(id),
+            customer_id INTEGER REFERENCES customers(id),
+            delivery_address TEXT NOT NULL,
+            status VARCHAR(50) DEFAULT 'pending', -- pending, assigned, in_progress, delivered, cancelled
+            assigned_storekeeper_id INTEGER REFERENCES employees(id),
+            delivery_date TIMESTAMP,
+            notes TEXT,
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # НОВАЯ ТАБЛИЦА: Группы доставки (несколько заказов в одной машине)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS delivery_groups (
+            id SERIAL PRIMARY KEY,
+            storekeeper_id INTEGER REFERENCES employees(id),
+            vehicle_info VARCHAR(200),
+            status VARCHAR(50) DEFAULT 'preparing', -- preparing, in_progress, completed
+            created_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_date TIMESTAMP
+        )
+    ''')
+
+    # НОВАЯ ТАБЛИЦА: Связь доставок с группами
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS delivery_group_items (
+            id SERIAL PRIMARY KEY,
+            delivery_group_id INTEGER REFERENCES delivery_groups(id),
+            delivery_id INTEGER REFERENCES deliveries(id),
+            UNIQUE(delivery_id)
+        )
+    ''')
+
+    seed_defaults(cursor)
+
+
+def seed_defaults(cursor):
+    """Основной склад и сотрудники по умолчанию, если их нет"""
+    # Добавляем основной склад по умолчанию
+    cursor.execute("SELECT MIN(id) FROM warehouses")
+    main_warehouse_id = cursor.fetchone()[0]
+    if main_warehouse_id is None:
+        cursor.execute(
+            "INSERT INTO warehouses (name, address) VALUES (%s, %s) RETURNING id",
+            ('Основной склад', 'Главный адрес склада')
+        )
+        main_warehouse_id = cursor.fetchone()[0]
+
+    # Добавляем администратора по умолчанию
+    cursor.execute("SELECT COUNT(*) FROM employees WHERE role = 'admin'")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(
+            "INSERT INTO employees (login, password, full_name, role, warehouse_id) VALUES (%s, %s, %s, %s, %s)",
+            ('admin', 'admin123', 'Администратор', 'admin', main_warehouse_id)
+        )
+
+    # Добавляем кассира по умолчанию
+    cursor.execute("SELECT COUNT(*) FROM employees WHERE role = 'cashier'")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(
+            "INSERT INTO employees (login, password, full_name, role, warehouse_id) VALUES (%s, %s, %s, %s, %s)",
+            ('cashier', 'cashier123', 'Кассир', 'cashier', main_warehouse_id)
+        )
+
+    # Добавляем кладовщика по умолчанию
+    cursor.execute("SELECT COUNT(*) FROM employees WHERE role = 'storekeeper'")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(
+            "INSERT INTO employees (login, password, full_name, role, warehouse_id) VALUES (%s, %s, %s, %s, %s)",
+            ('storekeeper', 'storekeeper123', 'Работник склада', 'storekeeper', main_warehouse_id)
+        )
+
+
+# Вторичные индексы под фильтры и соединения из edb/database.py
+INDEXES = [
+    # Отчет о продажах по складу и общий, новые сверху
+    "CREATE INDEX IF NOT EXISTS idx_sales_warehouse_date ON sales (warehouse_id, sale_date DESC, id DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_sales_date ON sales (sale_date DESC, id DESC)",
+    # Внешние ключи продаж: проверка перед удалением сотрудника и товара
+    "CREATE INDEX IF NOT EXISTS idx_sales_cashier ON sales (cashier_id)",
+    "CREATE INDEX IF NOT EXISTS idx_sales_product ON sales (product_id)",
+    # Доставки: фильтр по статусу, ожидающие доставки, соединения
+    "CREATE INDEX IF NOT EXISTS idx_deliveries_status_created ON deliveries (status, created_date DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_deliveries_created ON deliveries (created_date DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_deliveries_pending ON deliveries (created_date, sale_id) WHERE status = 'pending'",
+    "CREATE INDEX IF NOT EXISTS idx_deliveries_sale ON deliveries (sale_id)",
+    "CREATE INDEX IF NOT EXISTS idx_deliveries_customer ON deliveries (customer_id)",
+    "CREATE INDEX IF NOT EXISTS idx_deliveries_storekeeper ON deliveries (assigned_storekeeper_id, status)",
+    # Группы доставки кладовщика и их состав
+    "CREATE INDEX IF NOT EXISTS idx_delivery_groups_storekeeper ON delivery_groups (storekeeper_id, created_date DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_delivery_group_items_group ON delivery_group_items (delivery_group_id)",
+    # Клиенты: поиск по телефону и список новых клиентов
+    "CREATE INDEX IF NOT EXISTS idx_customers_phone ON customers (phone)",
+    "CREATE INDEX IF NOT EXISTS idx_customers_created ON customers (created_date DESC)",
+    # Остатки и сотрудники склада
+    "CREATE INDEX IF NOT EXISTS idx_product_warehouse_warehouse ON product_warehouse (warehouse_id)",
+    "CREATE INDEX IF NOT EXISTS idx_employees_warehouse ON employees (warehouse_id)",
+]
+
+
+def _v2_secondary_indexes(cursor):
+    """Индексы для горячих фильтров и соединений"""
+    for statement in INDEXES:
+        cursor.execute(statement)
+
+
+def _v3_customer_search(cursor):
+    """Индексы для поиска клиентов по ФИО и телефону.
+
+    С расширением pg_trgm - GIN-индексы по триграммам для поиска подстроки,
+    без него - btree-индексы для поиска по префиксу.
+    """
+    cursor.execute("SAVEPOINT pg_trgm")
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute("RELEASE SAVEPOINT pg_trgm")
+    except psycopg2.Error as e:
+        # Расширение не установлено на сервере или не хватает прав
+        cursor.execute("ROLLBACK TO SAVEPOINT pg_trgm")
+        print(f"pg_trgm недоступно, поиск клиентов будет по префиксу: {e}")
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_customers_full_name_prefix
+            ON customers (lower(full_name) text_pattern_ops)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_customers_phone_prefix
+            ON customers (phone text_pattern_ops)
+        ''')
+        return
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_customers_full_name_trgm
+        ON customers USING gin (lower(full_name) gin_trgm_ops)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_customers_phone_trgm
+        ON customers USING gin (phone gin_trgm_ops)
+    ''')
+
+
+# Канал уведомлений об изменениях каталога и остатков (см. edb/catalog.py)
+CATALOG_CHANNEL = 'catalog_changed'
+
+
+def _v4_catalog_notify(cursor):
+    """Триггеры, сообщающие об измененных товарах и остатках через NOTIFY.
+
+    Полезная нагрузка - id товара для products и "id товара:id склада"
+    для product_warehouse. Уведомления уходят при фиксации транзакции.
+    """
+    cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION notify_product_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('{CATALOG_CHANNEL}', OLD.id::text);
+            ELSE
+                PERFORM pg_notify('{CATALOG_CHANNEL}', NEW.id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION notify_stock_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM pg_notify('{CATALOG_CHANNEL}', OLD.product_id || ':' || OLD.warehouse_id);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM pg_notify('{CATALOG_CHANNEL}', NEW.product_id || ':' || NEW.warehouse_id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS products_notify ON products")
+    cursor.execute('''
+        CREATE TRIGGER products_notify
+        AFTER INSERT OR UPDATE OR DELETE ON products
+        FOR EACH ROW EXECUTE FUNCTION notify_product_changed()
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS product_warehouse_notify ON product_warehouse")
+    cursor.execute('''
+        CREATE TRIGGER product_warehouse_notify
+        AFTER INSERT OR UPDATE OR DELETE ON product_warehouse
+        FOR EACH ROW EXECUTE FUNCTION notify_stock_changed()
+    ''')
+
+
+def _v5_deliveries_updated_at(cursor):
+    """Время последнего изменения доставки для инкрементального обновления.
+
+    Время ставит триггер, в том числе когда доставку добавляют в группу
+    или меняется группа: от группы зависит строка доставки в окнах.
+    """
+    cursor.execute('''
+        ALTER TABLE deliveries
+        ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT clock_timestamp()
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_updated ON deliveries (updated_at)")
+
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION set_delivery_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at := clock_timestamp();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS deliveries_updated_at ON deliveries")
+    cursor.execute('''
+        CREATE TRIGGER deliveries_updated_at
+        BEFORE UPDATE ON deliveries
+        FOR EACH ROW EXECUTE FUNCTION set_delivery_updated_at()
+    ''')
+
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION touch_group_item_delivery() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE deliveries SET updated_at = clock_timestamp() WHERE id = OLD.delivery_id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE deliveries SET updated_at = clock_timestamp() WHERE id = NEW.delivery_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS delivery_group_items_touch ON delivery_group_items")
+    cursor.execute('''
+        CREATE TRIGGER delivery_group_items_touch
+        AFTER INSERT OR UPDATE OR DELETE ON delivery_group_items
+        FOR EACH ROW EXECUTE FUNCTION touch_group_item_delivery()
+    ''')
+
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION touch_group_deliveries() RETURNS trigger AS $$
+        BEGIN
+            UPDATE deliveries SET updated_at = clock_timestamp()
+            WHERE id IN (SELECT delivery_id FROM delivery_group_items WHERE delivery_group_id = NEW.id);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS delivery_groups_touch ON delivery_groups")
+    cursor.execute('''
+        CREATE TRIGGER delivery_groups_touch
+        AFTER UPDATE OF vehicle_info, status ON delivery_groups
+        FOR EACH ROW EXECUTE FUNCTION touch_group_deliveries()
+    ''')
+
+
+# Каналы уведомлений об изменениях доставок и продаж (см. window/live_updates.py)
+DELIVERIES_CHANNEL = 'deliveries_changed'
+SALES_CHANNEL = 'sales_changed'
+
+
+def _v6_live_notify(cursor):
+    """Триггеры, сообщающие об измененных доставках и продажах через NOTIFY.
+
+    Полезная нагрузка - "id:id склада", склад доставки берется из ее
+    продажи. Остатки уже сообщаются в канал каталога миграцией 4.
+    """
+    cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION notify_delivery_changed() RETURNS trigger AS $$
+        DECLARE
+            delivery deliveries%ROWTYPE;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                delivery := OLD;
+            ELSE
+                delivery := NEW;
+            END IF;
+            PERFORM pg_notify('{DELIVERIES_CHANNEL}',
+                              delivery.id || ':' ||
+                              COALESCE((SELECT warehouse_id FROM sales WHERE id = delivery.sale_id), 0));
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION notify_sale_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('{SALES_CHANNEL}', OLD.id || ':' || OLD.warehouse_id);
+            ELSE
+                PERFORM pg_notify('{SALES_CHANNEL}', NEW.id || ':' || NEW.warehouse_id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS deliveries_notify ON deliveries")
+    cursor.execute('''
+        CREATE TRIGGER deliveries_notify
+        AFTER INSERT OR UPDATE OR DELETE ON deliveries
+        FOR EACH ROW EXECUTE FUNCTION notify_delivery_changed()
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS sales_notify ON sales")
+    cursor.execute('''
+        CREATE TRIGGER sales_notify
+        AFTER INSERT OR UPDATE OR DELETE ON sales
+        FOR EACH ROW EXECUTE FUNCTION notify_sale_changed()
+    ''')
+
+
+def _v7_sales_daily(cursor):
+    """Дневные итоги продаж для отчетов (см. edb/reports.py).
+
+    Строка - день, склад, кассир и товар; отмененные продажи не учитываются.
+    Триггер на sales поправляет итоги при каждом изменении продажи, недели
+    и месяцы складываются из дней. Неизвестные склад, кассир или товар
+    записываются как 0.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            day DATE NOT NULL,
+            warehouse_id INTEGER NOT NULL,
+            cashier_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            revenue DECIMAL(14, 2) NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0,
+            sales_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, warehouse_id, cashier_id, product_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sales_daily_warehouse
+        ON sales_daily (warehouse_id, day)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sales_daily_cashier
+        ON sales_daily (cashier_id, day)
+    ''')
+
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION sales_daily_add(sale sales, sign INTEGER) RETURNS void AS $$
+        BEGIN
+            IF sale.status = 'cancelled' THEN
+                RETURN;
+            END IF;
+            INSERT INTO sales_daily AS d
+                (day, warehouse_id, cashier_id, product_id, revenue, units, sales_count)
+            VALUES (sale.sale_date::date, COALESCE(sale.warehouse_id, 0),
+                    COALESCE(sale.cashier_id, 0), COALESCE(sale.product_id, 0),
+                    sign * sale.total_price, sign * sale.quantity, sign)
+            ON CONFLICT (day, warehouse_id, cashier_id, product_id) DO UPDATE
+            SET revenue = d.revenue + EXCLUDED.revenue,
+                units = d.units + EXCLUDED.units,
+                sales_count = d.sales_count + EXCLUDED.sales_count;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION sales_daily_sync() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM sales_daily_add(OLD, -1);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM sales_daily_add(NEW, 1);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    # Триггер создается до заполнения: блокировка таблицы задерживает
+    # чужие продажи до фиксации миграции, и ни одна не учтется дважды
+    cursor.execute("DROP TRIGGER IF EXISTS sales_daily_sync ON sales")
+    cursor.execute('''
+        CREATE TRIGGER sales_daily_sync
+        AFTER INSERT OR DELETE
+        OR UPDATE OF product_id, quantity, total_price, sale_date, cashier_id, warehouse_id, status
+        ON sales
+        FOR EACH ROW EXECUTE FUNCTION sales_daily_sync()
+    ''')
+
+    cursor.execute("DELETE FROM sales_daily")
+    cursor.execute('''
+        INSERT INTO sales_daily (day, warehouse_id, cashier_id, product_id, revenue, units, sales_count)
+        SELECT sale_date::date, COALESCE(warehouse_id, 0), COALESCE(cashier_id, 0),
+               COALESCE(product_id, 0), SUM(total_price), SUM(quantity), COUNT(*)
+        FROM sales
+        WHERE status IS DISTINCT FROM 'cancelled'
+        GROUP BY 1, 2, 3, 4
+    ''')
+
+
+# Схема, в которую переносятся отключенные старые секции продаж
+SALES_ARCHIVE_SCHEMA = 'sales_archive'
+
+
+def _v8_partition_sales(cursor):
+    """Секционирование продаж по месяцам sale_date.
+
+    Секция месяца - sales_ГГГГ_ММ, продажи вне созданных секций попадают
+    в sales_default. Функция create_sales_partition(месяц) создает секцию
+    и переносит в нее строки месяца из sales_default; ее вызывает
+    Database.ensure_sales_partitions. Старые секции Database отключает
+    в схему SALES_ARCHIVE_SCHEMA.
+
+    Первичный ключ секционированной таблицы обязан включать sale_date,
+    поэтому внешний ключ deliveries.sale_id -> sales(id) снимается,
+    связь держится приложением (индекс idx_deliveries_sale остается).
+    """
+    cursor.execute("ALTER TABLE deliveries DROP CONSTRAINT IF EXISTS deliveries_sale_id_fkey")
+    # Триггеры и функция с типом строки старой таблицы пересоздаются ниже
+    cursor.execute("DROP TRIGGER IF EXISTS sales_notify ON sales")
+    cursor.execute("DROP TRIGGER IF EXISTS sales_daily_sync ON sales")
+    cursor.execute("DROP FUNCTION IF EXISTS sales_daily_add(sales, INTEGER)")
+
+    cursor.execute("ALTER TABLE sales RENAME TO sales_old")
+    cursor.execute("ALTER INDEX sales_pkey RENAME TO sales_old_pkey")
+    for index_name in ('idx_sales_warehouse_date', 'idx_sales_date', 'idx_sales_cashier', 'idx_sales_product'):
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+    cursor.execute("ALTER SEQUENCE sales_id_seq OWNED BY NONE")
+
+    cursor.execute('''
+        CREATE TABLE sales (
+            id INTEGER NOT NULL DEFAULT nextval('sales_id_seq'),
+            product_id INTEGER REFERENCES products(id),
+            quantity INTEGER NOT NULL,
+            total_price DECIMAL(10, 2) NOT NULL,
+            sale_date TIMESTAMP NOT NULL,
+            cashier_id INTEGER REFERENCES employees(id),
+            warehouse_id INTEGER REFERENCES warehouses(id),
+            status VARCHAR(20) DEFAULT 'completed',
+            PRIMARY KEY (id, sale_date)
+        ) PARTITION BY RANGE (sale_date)
+    ''')
+    cursor.execute("CREATE TABLE sales_default PARTITION OF sales DEFAULT")
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {SALES_ARCHIVE_SCHEMA}")
+
+    # Строки месяца переносятся из sales_default без триггеров: продажи
+    # не меняются, и итоги sales_daily трогать не нужно
+    cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION create_sales_partition(month DATE) RETURNS boolean AS $$
+        DECLARE
+            start_date DATE := date_trunc('month', month)::date;
+            end_date DATE := (date_trunc('month', month) + interval '1 month')::date;
+            partition_name TEXT := 'sales_' || to_char(date_trunc('month', month), 'YYYY_MM');
+        BEGIN
+            PERFORM pg_advisory_xact_lock({SALES_PARTITION_LOCK_KEY});
+            IF to_regclass(partition_name) IS NOT NULL THEN
+                RETURN false;
+            END IF;
+            EXECUTE format('CREATE TABLE %I (LIKE sales INCLUDING DEFAULTS INCLUDING CONSTRAINTS)',
+                           partition_name);
+            ALTER TABLE sales_default DISABLE TRIGGER USER;
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM sales_default WHERE sale_date >= %L AND sale_date < %L RETURNING *) ' ||
+                'INSERT INTO %I SELECT * FROM moved',
+                start_date, end_date, partition_name);
+            ALTER TABLE sales_default ENABLE TRIGGER USER;
+            EXECUTE format('ALTER TABLE sales ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, start_date, end_date);
+            RETURN true;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    # Секции на все месяцы с продажами и на ближайшие, чтобы перенос шел
+    # в готовые секции, а не через sales_default
+    cursor.execute('''
+        SELECT create_sales_partition(month::date)
+        FROM generate_series(
+            date_trunc('month', LEAST((SELECT MIN(sale_date) FROM sales_old), now())),
+            date_trunc('month', now()) + interval '2 months',
+            interval '1 month'
+        ) AS month
+    ''')
+
+    cursor.execute('''
+        INSERT INTO sales (id, product_id, quantity, total_price, sale_date, cashier_id, warehouse_id, status)
+        SELECT id, product_id, quantity, total_price, sale_date, cashier_id, warehouse_id, status
+        FROM sales_old
+    ''')
+    cursor.execute("DROP TABLE sales_old")
+    cursor.execute("ALTER SEQUENCE sales_id_seq OWNED BY sales.id")
+
+    # Индексы секционированной таблицы создаются во всех секциях
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_warehouse_date ON sales (warehouse_id, sale_date DESC, id DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_date ON sales (sale_date DESC, id DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_cashier ON sales (cashier_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_product ON sales (product_id)")
+
+    # Триггеры миграций 6 и 7 на новой таблице
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION sales_daily_add(sale sales, sign INTEGER) RETURNS void AS $$
+        BEGIN
+            IF sale.status = 'cancelled' THEN
+                RETURN;
+            END IF;
+            INSERT INTO sales_daily AS d
+                (day, warehouse_id, cashier_id, product_id, revenue, units, sales_count)
+            VALUES (sale.sale_date::date, COALESCE(sale.warehouse_id, 0),
+                    COALESCE(sale.cashier_id, 0), COALESCE(sale.product_id, 0),
+                    sign * sale.total_price, sign * sale.quantity, sign)
+            ON CONFLICT (day, warehouse_id, cashier_id, product_id) DO UPDATE
+            SET revenue = d.revenue + EXCLUDED.revenue,
+                units = d.units + EXCLUDED.units,
+                sales_count = d.sales_count + EXCLUDED.sales_count;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER sales_notify
+        AFTER INSERT OR UPDATE OR DELETE ON sales
+        FOR EACH ROW EXECUTE FUNCTION notify_sale_changed()
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER sales_daily_sync
+        AFTER INSERT OR DELETE
+        OR UPDATE OF product_id, quantity, total_price, sale_date, cashier_id, warehouse_id, status
+        ON sales
+        FOR EACH ROW EXECUTE FUNCTION sales_daily_sync()
+    ''')
+
+
+def _v9_stock_receipts(cursor):
+    """Проведенные приемки товара.
+
+    Строка записывается в транзакции, меняющей остатки, с идентификатором
+    сессии приемки клиента, поэтому повторное проведение той же сессии
+    (после сбоя между фиксацией и удалением ее файла) ничего не меняет.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_receipts (
+            id UUID PRIMARY KEY,
+            warehouse_id INTEGER NOT NULL REFERENCES warehouses(id),
+            employee_id INTEGER REFERENCES employees(id) ON DELETE SET NULL,
+            lines INTEGER NOT NULL,
+            units INTEGER NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_stock_receipts_warehouse
+        ON stock_receipts (warehouse_id, applied_at)
+    ''')
+
+
+def _v10_inventory_ledger(cursor):
+    """Журнал движения товаров и снимки остатков (см. edb/inventory.py).
+
+    inventory_movements только дополняется: строку пишет триггер на
+    каждое изменение product_warehouse, кто бы его ни сделал. Триггеры
+    уровня оператора с таблицами переходов добавляют движения пакетной
+    вставкой на весь оператор, а не вызовом функции на каждую строку.
+    Причину (opening, sale, cancel, adjust, receive, transfer, import),
+    сотрудника и ссылку на документ триггер берет из параметров
+    edb.movement_* транзакции, которые ставит Database; без них
+    изменение записывается как adjust. Внешних ключей у журнала нет:
+    история переживает удаление товара, а продажа не платит за их проверку.
+
+    inventory_balances - остатки на начало периода taken_at,
+    сложенные из предыдущего снимка и движений периода. Текущие
+    остатки попадают в журнал движениями opening.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_movements (
+            id BIGSERIAL PRIMARY KEY,
+            moved_at TIMESTAMP NOT NULL DEFAULT clock_timestamp(),
+            product_id INTEGER NOT NULL,
+            warehouse_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            reason VARCHAR(20) NOT NULL,
+            employee_id INTEGER,
+            reference VARCHAR(100)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_inventory_movements_warehouse
+        ON inventory_movements (warehouse_id, moved_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_inventory_movements_product
+        ON inventory_movements (product_id, moved_at)
+    ''')
+    # Движения идут по времени - BRIN по moved_at почти ничего не весит
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_inventory_movements_moved
+        ON inventory_movements USING brin (moved_at)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_snapshots (
+            taken_at TIMESTAMP PRIMARY KEY,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_balances (
+            taken_at TIMESTAMP NOT NULL REFERENCES inventory_snapshots(taken_at) ON DELETE CASCADE,
+            warehouse_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (taken_at, warehouse_id, product_id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION forbid_movement_change() RETURNS trigger AS $$
+        BEGIN
+            RAISE EXCEPTION 'Журнал движения товаров нельзя изменять';
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    cursor.execute("DROP TRIGGER IF EXISTS inventory_movements_append_only ON inventory_movements")
+    cursor.execute('''
+        CREATE TRIGGER inventory_movements_append_only
+        BEFORE UPDATE OR DELETE ON inventory_movements
+        FOR EACH ROW EXECUTE FUNCTION forbid_movement_change()
+    ''')
+
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION record_stock_movements() RETURNS trigger AS $$
+        DECLARE
+            movement_reason TEXT := COALESCE(NULLIF(current_setting('edb.movement_reason', true), ''), 'adjust');
+            movement_employee INTEGER := NULLIF(current_setting('edb.movement_employee', true), '')::INTEGER;
+            movement_reference TEXT := NULLIF(current_setting('edb.movement_reference', true), '');
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO inventory_movements (product_id, warehouse_id, delta, reason, employee_id, reference)
+                SELECT n.product_id, n.warehouse_id, n.quantity, movement_reason, movement_employee, movement_reference
+                FROM new_rows n
+                WHERE n.quantity <> 0 AND n.product_id IS NOT NULL AND n.warehouse_id IS NOT NULL;
+            ELSIF TG_OP = 'UPDATE' THEN
+                -- Товар и склад строки приложение не меняет, только количество
+                INSERT INTO inventory_movements (product_id, warehouse_id, delta, reason, employee_id, reference)
+                SELECT n.product_id, n.warehouse_id, n.quantity - o.quantity,
+                       movement_reason, movement_employee, movement_reference
+                FROM new_rows n
+                JOIN old_rows o ON o.id = n.id
+                WHERE n.quantity <> o.quantity AND n.product_id IS NOT NULL AND n.warehouse_id IS NOT NULL;
+            ELSE
+                INSERT INTO inventory_movements (product_id, warehouse_id, delta, reason, employee_id, reference)
+                SELECT o.product_id, o.warehouse_id, -o.quantity, movement_reason, movement_employee, movement_reference
+                FROM old_rows o
+                WHERE o.quantity <> 0 AND o.product_id IS NOT NULL AND o.warehouse_id IS NOT NULL;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    for operation, transition in (('insert', 'NEW TABLE AS new_rows'),
+                                  ('update', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+                                  ('delete', 'OLD TABLE AS old_rows')):
+        cursor.execute(f"DROP TRIGGER IF EXISTS product_warehouse_movements_{operation} ON product_warehouse")
+        cursor.execute(f'''
+            CREATE TRIGGER product_warehouse_movements_{operation}
+            AFTER {operation.upper()} ON product_warehouse
+            REFERENCING {transition}
+            FOR EACH STATEMENT EXECUTE FUNCTION record_stock_movements()
+        ''')
+
+    cursor.execute('''
+        INSERT INTO inventory_movements (product_id, warehouse_id, delta, reason)
+        SELECT product_id, warehouse_id, quantity, 'opening'
+        FROM product_warehouse
+        WHERE quantity <> 0 AND product_id IS NOT NULL AND warehouse_id IS NOT NULL
+    ''')
+
+
+
+def _v11_movement_references(cursor):
+    """Документы движений по отдельным товарам.
+
+    Корзина продается одной транзакцией, а у каждой позиции своя строка
+    продажи. Параметр edb.movement_references - JSON {id товара: документ};
+    движение товара берет документ из него, остальные - edb.movement_reference.
+    """
+    cursor.execute('''
+        CREATE OR REPLACE FUNCTION record_stock_movements() RETURNS trigger AS $$
+        DECLARE
+            movement_reason TEXT := COALESCE(NULLIF(current_setting('edb.movement_reason', true), ''), 'adjust');
+            movement_employee INTEGER := NULLIF(current_setting('edb.movement_employee', true), '')::INTEGER;
+            movement_reference TEXT := NULLIF(current_setting('edb.movement_reference', true), '');
+            movement_references JSONB := NULLIF(current_setting('edb.movement_references', true), '')::JSONB;
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO inventory_movements (product_id, warehouse_id, delta, reason, employee_id, reference)
+                SELECT n.product_id, n.warehouse_id, n.quantity, movement_reason, movement_employee,
+                       COALESCE(movement_references ->> n.product_id::text, movement_reference)
+                FROM new_rows n
+                WHERE n.quantity <> 0 AND n.product_id IS NOT NULL AND n.warehouse_id IS NOT NULL;
+            ELSIF TG_OP = 'UPDATE' THEN
+                -- Товар и склад строки приложение не меняет, только количество
+                INSERT INTO inventory_movements (product_id, warehouse_id, delta, reason, employee_id, reference)
+                SELECT n.product_id, n.warehouse_id, n.quantity - o.quantity, movement_reason, movement_employee,
+                       COALESCE(movement_references ->> n.product_id::text, movement_reference)
+                FROM new_rows n
+                JOIN old_rows o ON o.id = n.id
+                WHERE n.quantity <> o.quantity AND n.product_id IS NOT NULL AND n.warehouse_id IS NOT NULL;
+            ELSE
+                INSERT INTO inventory_movements (product_id, warehouse_id, delta, reason, employee_id, reference)
+                SELECT o.product_id, o.warehouse_id, -o.quantity, movement_reason, movement_employee,
+                       COALESCE(movement_references ->> o.product_id::text, movement_reference)
+                FROM old_rows o
+                WHERE o.quantity <> 0 AND o.product_id IS NOT NULL AND o.warehouse_id IS NOT NULL;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+
+
+# (версия, описание, функция миграции) в порядке применения
+MIGRATIONS = [
+    (1, 'Начальная схема', _v1_initial_schema),
+    (2, 'Вторичные индексы', _v2_secondary_indexes),
+    (3, 'Поиск клиентов', _v3_customer_search),
+    (4, 'Уведомления об изменениях каталога', _v4_catalog_notify),
+    (5, 'Время изменения доставок', _v5_deliveries_updated_at),
+    (6, 'Уведомления об изменениях доставок и продаж', _v6_live_notify),
+    (7, 'Дневные итоги продаж', _v7_sales_daily),
+    (8, 'Секционирование продаж по месяцам', _v8_partition_sales),
+    (9, 'Приемки товара', _v9_stock_receipts),
+    (10, 'Журнал движения товаров', _v10_inventory_ledger),
+    (11, 'Документы движений по товарам', _v11_movement_references),
+]
+
+
+def get_schema_version(conn):
+    """Текущая версия схемы; 0, если миграции еще не применялись"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+        return cursor.fetchone()[0] or 0
+    except psycopg2.errors.UndefinedTable:
+        return 0
+    finally:
+        conn.rollback()
+
+
+def migrate(conn):
+    """Применяет недостающие миграции, возвращает список примененных версий.
+    
+    Быстрый путь - один запрос версии, если схема уже актуальна.
+    """
+    latest = MIGRATIONS[-1][0]
+    if get_schema_version(conn) >= latest:
+        return []
+    
+    cursor = conn.cursor()
+    cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+    try:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description VARCHAR(200) NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.commit()
+        
+        # Пока ждали блокировку, схему мог обновить другой клиент
+        current = get_schema_version(conn)
+        applied = []
+        for version, description, apply in MIGRATIONS:
+            if version <= current:
+                continue
+            try:
+                apply(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(version)
+        return applied
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+        conn.commit()
@@ -0,0 +1,108 @@
+import select
+import threading
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class NotificationListener:
+    """Одно соединение процесса, слушающее каналы NOTIFY.
+
+    Фоновый поток запускается методом start и раздает уведомления
+    подписчикам канала пачками: callback(множество полезных нагрузок).
+    Обработчики вызываются в потоке слушателя в порядке подписки.
+
+    Уведомления, пришедшие пока соединения нет, теряются, поэтому
+    подписчики состояния узнают о подключении и разрыве: state_callback(True)
+    после LISTEN и state_callback(False) при обрыве.
+    """
+
+    def __init__(self, connection_params, channels, poll_interval=5, reconnect_delay=5):
+        self.connection_params = connection_params
+        self.channels = tuple(channels)
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+
+        self._lock = threading.Lock()
+        self._subscribers = {channel: [] for channel in self.channels}
+        self._state_subscribers = []
+        self.listening = False
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, channel, callback, state_callback=None):
+        """Подписывает callback на канал и state_callback на состояние соединения"""
+        with self._lock:
+            self._subscribers[channel].append(callback)
+            if state_callback is not None:
+                self._state_subscribers.append(state_callback)
+            listening = self.listening
+        if state_callback is not None and listening:
+            # О разрыве подписчик узнает сам: изначально считается, что соединения нет
+            self._call(state_callback, listening)
+
+    def start(self):
+        """Запускает поток слушателя; повторный вызов ничего не делает"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen_loop,
+                                                name='notification-listener', daemon=True)
+                self._thread.start()
+
+    def close(self):
+        self._stop.set()
+
+    def _set_listening(self, listening):
+        with self._lock:
+            if self.listening == listening:
+                return
+            self.listening = listening
+            state_subscribers = list(self._state_subscribers)
+        for callback in state_subscribers:
+            self._call(callback, listening)
+
+    def _dispatch(self, notifies):
+        payloads = {}
+        for notify in notifies:
+            payloads.setdefault(notify.channel, set()).add(notify.payload)
+        for channel, channel_payloads in payloads.items():
+            with self._lock:
+                subscribers = list(self._subscribers.get(channel, ()))
+            for callback in subscribers:
+                self._call(callback, channel_payloads)
+
+    def _call(self, callback, argument):
+        # Ошибка одного подписчика не должна останавливать прослушивание
+        try:
+            callback(argument)
+        except Exception as e:
+            print(f"Ошибка обработки уведомления: {e}")
+
+    def _listen_loop(self):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.connection_params)
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                cursor = conn.cursor()
+                for channel in self.channels:
+                    cursor.execute(f"LISTEN {channel}")
+                self._set_listening(True)
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                        # Тишина в канале - проверяем, что соединение не оборвалось
+                        conn.cursor().execute("SELECT 1")
+                        continue
+                    conn.poll()
+                    notifies = conn.notifies[:]
+                    del conn.notifies[:]
+                    self._dispatch(notifies)
+            except Exception as e:
+                print(f"Ошибка прослушивания уведомлений: {e}")
+            finally:
+                self._set_listening(False)
+                if conn is not None:
+                    conn.close()
+            self._stop.wait(self.reconnect_delay)
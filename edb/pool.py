@@ -0,0 +1,220 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from edb.instrumentation import InstrumentedConnection, statement_name
+from edb.prepared import PreparedConnection
+
+
+class PoolError(Exception):
+    """Пул соединений исчерпан или закрыт"""
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений с PostgreSQL.
+
+    Держит не меньше min_size открытых соединений и не больше max_size,
+    проверяет соединение перед выдачей, если оно долго простаивало,
+    и закрывает лишние простаивающие соединения сверх min_size.
+    Если передан metrics (QueryMetrics), соединения замеряют свои запросы,
+    а пул - ожидание соединения. prepare_statements=False отключает
+    подготовку запросов на сервере (edb/prepared.py).
+    """
+
+    def __init__(self, connection_params, min_size=1, max_size=10, idle_timeout=300,
+                 health_check_interval=30, checkout_timeout=30, metrics=None,
+                 prepare_statements=True):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Некорректный размер пула: min={min_size}, max={max_size}")
+
+        self.connection_params = connection_params
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+        self.metrics = metrics
+        self.prepare_statements = prepare_statements
+
+        self._idle = []  # [(соединение, время возврата в пул)]
+        self._size = 0   # открытые соединения: простаивающие + выданные
+        self._closed = False
+        self._cond = threading.Condition()
+
+        for _ in range(min_size):
+            conn = self._connect()
+            self._size += 1
+            self._idle.append((conn, time.monotonic()))
+
+        # Фоновое закрытие простаивающих соединений
+        self._stop_reaper = threading.Event()
+        self._reaper = None
+        if idle_timeout:
+            self._reaper = threading.Thread(target=self._reap_loop, name='db-pool-reaper', daemon=True)
+            self._reaper.start()
+
+    def _connect(self):
+        try:
+            # Соединения помнят подготовленные на них запросы (edb/prepared.py)
+            factory = PreparedConnection if self.metrics is None else InstrumentedConnection
+            conn = psycopg2.connect(**self.connection_params, connection_factory=factory)
+            if self.metrics is not None:
+                conn.metrics = self.metrics
+            if not self.prepare_statements:
+                conn.prepared = None
+            return conn
+        except Exception as e:
+            print(f"Ошибка подключения к БД: {e}")
+            raise
+
+    def _is_alive(self, conn):
+        """Проверяет, что соединение живо"""
+        if conn.closed:
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def getconn(self):
+        """Выдает соединение из пула, при необходимости открывая новое"""
+        deadline = time.monotonic() + self.checkout_timeout
+
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError("Пул соединений закрыт")
+                    if self._idle:
+                        # LIFO: самое свежее соединение вероятнее всего живо
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        conn, last_used = None, None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolError(f"Нет свободных соединений (max_size={self.max_size})")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            stale = time.monotonic() - last_used > self.health_check_interval
+            if not conn.closed and (not stale or self._is_alive(conn)):
+                return conn
+
+            # Соединение разорвано сервером - выбрасываем и пробуем снова
+            self._discard(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+
+    def putconn(self, conn, discard=False):
+        """Возвращает соединение в пул"""
+        if not discard and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                discard = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                # Незавершенная транзакция не должна достаться следующему вызову
+                try:
+                    conn.rollback()
+                except Exception:
+                    discard = True
+
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._size -= 1
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Выдает соединение на время блока with и возвращает его в пул"""
+        if self.metrics is None:
+            conn = self.getconn()
+        else:
+            started = time.perf_counter()
+            conn = self.getconn()
+            self.metrics.observe_wait(statement_name(), time.perf_counter() - started)
+        try:
+            yield conn
+        except Exception:
+            if not conn.closed:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            raise
+        finally:
+            self.putconn(conn)
+
+    def reap_idle(self):
+        """Закрывает соединения, простаивающие дольше idle_timeout, сверх min_size"""
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            keep = []
+            # Старые соединения лежат в начале списка
+            for conn, last_used in self._idle:
+                if (self._size - len(expired) > self.min_size
+                        and now - last_used > self.idle_timeout):
+                    expired.append(conn)
+                else:
+                    keep.append((conn, last_used))
+            self._idle = keep
+            self._size -= len(expired)
+        for conn in expired:
+            self._discard(conn)
+        return len(expired)
+
+    def _reap_loop(self):
+        interval = max(self.idle_timeout / 2, 1)
+        while not self._stop_reaper.wait(interval):
+            self.reap_idle()
+
+    def stats(self):
+        """Текущее состояние пула"""
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size
+            }
+
+    def closeall(self):
+        """Закрывает все соединения пула"""
+        self._stop_reaper.set()
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._discard(conn)
@@ -0,0 +1,82 @@
+"""Подготовленные на сервере запросы.
+
+execute_prepared выполняет запрос через PREPARE/EXECUTE: на каждом
+соединении запрос подготавливается при первом использовании и дальше
+выполняется без разбора, а после нескольких выполнений с постоянным
+общим планом - и без планирования. Подготовленный запрос живет до
+закрытия соединения и не отменяется откатом транзакции; соединение,
+открытое пулом заново (например, после обрыва), начинает с пустого
+списка и подготавливает запросы снова.
+"""
+import hashlib
+import re
+import threading
+
+from psycopg2 import extensions
+
+_PLACEHOLDER = re.compile(r'%%|%s')
+_EXECUTE = re.compile(r'\s*EXECUTE (edb_[0-9a-f]+)')
+
+_lock = threading.Lock()
+# Текст запроса -> (имя, текст с $n, число параметров)
+_statements = {}
+# Имя -> исходный текст, для журнала медленных запросов
+_texts = {}
+
+
+class PreparedConnection(extensions.connection):
+    """Соединение, помнящее имена подготовленных на нем запросов"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+def _statement(query):
+    statement = _statements.get(query)
+    if statement is None:
+        count = 0
+
+        def placeholder(match):
+            nonlocal count
+            if match.group() == '%%':
+                return '%'
+            count += 1
+            return f'${count}'
+
+        text = _PLACEHOLDER.sub(placeholder, query)
+        name = 'edb_' + hashlib.md5(query.encode('utf-8')).hexdigest()[:16]
+        statement = (name, text, count)
+        with _lock:
+            _statements[query] = statement
+            _texts[name] = query
+    return statement
+
+
+def execute_prepared(cursor, query, params=()):
+    """Выполняет query с параметрами %s как подготовленный запрос.
+
+    На соединениях без списка подготовленных запросов (не из пула или
+    из пула с prepare_statements=False) выполняет запрос обычным образом.
+    """
+    prepared = getattr(cursor.connection, 'prepared', None)
+    if prepared is None:
+        cursor.execute(query, params)
+        return
+
+    name, text, count = _statement(query)
+    if name not in prepared:
+        cursor.execute(f"PREPARE {name} AS {text}")
+        prepared.add(name)
+    if count:
+        cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * count)})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+
+def prepared_text(query):
+    """Исходный текст для EXECUTE подготовленного запроса, иначе сам query"""
+    match = _EXECUTE.match(query)
+    if match:
+        return _texts.get(match.group(1), query)
+    return query
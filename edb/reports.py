@@ -0,0 +1,158 @@
+"""Отчеты по продажам из дневных итогов sales_daily (миграция 7).
+
+Итоги поддерживает триггер на sales, поэтому отчет за любой период
+читает не больше строки на день, склад, кассира и товар вместо всех
+продаж.
+"""
+
+# Период отчета -> единица date_trunc
+PERIODS = {'day': 'day', 'week': 'week', 'month': 'month'}
+
+# Разрез отчета -> (столбец id, выражение названия, соединение)
+GROUPINGS = {
+    None: (None, None, ''),
+    'warehouse': ('d.warehouse_id', "COALESCE(w.name, 'Неизвестно')",
+                  'LEFT JOIN warehouses w ON w.id = d.warehouse_id'),
+    'cashier': ('d.cashier_id', "COALESCE(e.full_name, 'Неизвестно')",
+                'LEFT JOIN employees e ON e.id = d.cashier_id'),
+}
+
+
+class SalesReports:
+    """Выручка, количество и популярные товары по периодам.
+
+    Фильтры: warehouse_id, cashier_id и даты [date_from, date_to).
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def rebuild(self, cursor=None):
+        """Пересчитывает sales_daily по таблице sales.
+
+        Нужен после загрузки продаж с отключенными триггерами; итоги
+        архивных секций при этом пропадают. Если передан cursor,
+        работает внутри транзакции вызывающего кода.
+        """
+        if cursor is None:
+            with self.db._connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    self.rebuild(cursor)
+                    conn.commit()
+                    return True
+                except Exception as e:
+                    print(f"Ошибка пересчета итогов продаж: {e}")
+                    conn.rollback()
+                    return False
+
+        cursor.execute("DELETE FROM sales_daily")
+        cursor.execute('''
+            INSERT INTO sales_daily (day, warehouse_id, cashier_id, product_id, revenue, units, sales_count)
+            SELECT sale_date::date, COALESCE(warehouse_id, 0), COALESCE(cashier_id, 0),
+                   COALESCE(product_id, 0), SUM(total_price), SUM(quantity), COUNT(*)
+            FROM sales
+            WHERE status IS DISTINCT FROM 'cancelled'
+            GROUP BY 1, 2, 3, 4
+        ''')
+        return True
+
+    def _filters(self, warehouse_id, cashier_id, date_from, date_to):
+        conditions = []
+        params = []
+        if warehouse_id:
+            conditions.append("d.warehouse_id = %s")
+            params.append(warehouse_id)
+        if cashier_id:
+            conditions.append("d.cashier_id = %s")
+            params.append(cashier_id)
+        if date_from:
+            conditions.append("d.day >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("d.day < %s")
+            params.append(date_to)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return where, params
+
+    def revenue(self, period='day', group_by=None, warehouse_id=None, cashier_id=None,
+                date_from=None, date_to=None):
+        """Итоги по периодам от новых к старым.
+
+        period - 'day', 'week' или 'month'; group_by - None (итог),
+        'warehouse' или 'cashier'. Строки: period_start, group_id,
+        group_name (None без разреза), revenue, units, sales_count.
+        """
+        unit = PERIODS[period]
+        group_column, group_name, join = GROUPINGS[group_by]
+        where, params = self._filters(warehouse_id, cashier_id, date_from, date_to)
+
+        columns = f"date_trunc('{unit}', d.day)::date AS period_start"
+        group = "1"
+        if group_column:
+            columns += f", {group_column}, {group_name}"
+            group += ", 2, 3"
+        query = f'''
+            SELECT {columns}, SUM(d.revenue), SUM(d.units), SUM(d.sales_count)
+            FROM sales_daily d
+            {join}
+            {where}
+            GROUP BY {group}
+            HAVING SUM(d.sales_count) <> 0
+            ORDER BY 1 DESC{", 3" if group_column else ""}
+        '''
+
+        with self.db._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, params)
+                result = []
+                for row in cursor.fetchall():
+                    if not group_column:
+                        row = (row[0], None, None) + tuple(row[1:])
+                    result.append({
+                        'period_start': row[0].strftime("%Y-%m-%d"),
+                        'group_id': row[1],
+                        'group_name': row[2],
+                        'revenue': float(row[3]),
+                        'units': row[4],
+                        'sales_count': row[5]
+                    })
+                return result
+            except Exception as e:
+                print(f"Ошибка получения отчета по выручке: {e}")
+                return []
+
+    def top_products(self, limit=10, warehouse_id=None, cashier_id=None,
+                     date_from=None, date_to=None):
+        """Товары с наибольшей выручкой за период"""
+        where, params = self._filters(warehouse_id, cashier_id, date_from, date_to)
+        query = f'''
+            SELECT d.product_id, COALESCE(p.name, 'Неизвестно'),
+                   SUM(d.revenue), SUM(d.units), SUM(d.sales_count)
+            FROM sales_daily d
+            LEFT JOIN products p ON p.id = d.product_id
+            {where}
+            GROUP BY d.product_id, p.name
+            HAVING SUM(d.sales_count) <> 0
+            ORDER BY 3 DESC
+            LIMIT %s
+        '''
+
+        with self.db._connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, params + [limit])
+                result = []
+                for row in cursor.fetchall():
+                    result.append({
+                        'product_id': row[0],
+                        'product_name': row[1],
+                        'revenue': float(row[2]),
+                        'units': row[3],
+                        'sales_count': row[4]
+                    })
+                return result
+            except Exception as e:
+                print(f"Ошибка получения популярных товаров: {e}")
+                return []
@@ -0,0 +1,114 @@
+"""Компактные строки результатов Database.
+
+Методы чтения возвращают не словари, а кортежи record_type: строка
+запроса превращается в запись без копирования полей в dict, а даты
+и суммы остаются datetime и Decimal до отрисовки ячейки
+(format_value). Доступ по ключу record['name'] и record.get()
+работают как у словаря, поэтому код окон не зависит от представления.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def format_value(value):
+    """Текст значения поля записи для отображения"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    return str(value)
+
+
+def record_type(name, fields, aliases=None):
+    """Класс записи с полями fields.
+
+    aliases - {другое имя: поле} для ключей, под которыми поле
+    отдавалось раньше. Запись создается из строки курсора: Record._make(row).
+    """
+    base = namedtuple(name, fields)
+    aliases = aliases or {}
+    namespace = {
+        '__slots__': (),
+        '_names': frozenset(base._fields) | frozenset(aliases),
+        '__getitem__': _getitem,
+        '__contains__': _contains,
+        'get': _get,
+        'keys': _keys,
+    }
+    for alias, field in aliases.items():
+        namespace[alias] = property(_field_getter(field))
+    return type(name, (base,), namespace)
+
+
+def make_records(record, rows, shared=()):
+    """Записи record из строк курсора rows.
+
+    shared - поля, значения которых повторяются от строки к строке
+    (названия товаров, имена, статусы): одинаковые значения хранятся
+    одним объектом на всю выборку, а не отдельной строкой в каждой записи.
+    """
+    if not shared:
+        return list(map(record._make, rows))
+    indexes = [record._fields.index(field) for field in shared]
+    values = [{} for _ in indexes]
+    make = record._make
+    result = []
+    for row in rows:
+        row = list(row)
+        for index, seen in zip(indexes, values):
+            value = row[index]
+            row[index] = seen.setdefault(value, value)
+        result.append(make(row))
+    return result
+
+
+def _getitem(self, key):
+    if type(key) is str:
+        if key in self._names:
+            return getattr(self, key)
+        raise KeyError(key)
+    return tuple.__getitem__(self, key)
+
+
+def _contains(self, key):
+    return key in self._names
+
+
+def _get(self, key, default=None):
+    return getattr(self, key) if key in self._names else default
+
+
+def _keys(self):
+    return self._fields
+
+
+def _field_getter(field):
+    return lambda self: getattr(self, field)
+
+
+# Записи методов чтения Database; порядок полей - порядок столбцов запроса
+Customer = record_type('Customer', ['id', 'full_name', 'phone', 'email', 'address', 'created_date'])
+Product = record_type('Product', ['id', 'name', 'category', 'brand', 'price', 'min_quantity', 'quantity'])
+Sale = record_type('Sale', ['id', 'product_name', 'quantity', 'total_price', 'sale_date',
+                            'cashier_name', 'status', 'warehouse_name'],
+                   aliases={'sale_datetime': 'sale_date'})
+# Поля продаж, общие для многих строк отчета; суммы повторяются у продаж
+# одного товара в одном количестве
+SALE_SHARED = ('product_name', 'total_price', 'cashier_name', 'status', 'warehouse_name')
+PendingDelivery = record_type('PendingDelivery', [
+    'id', 'delivery_address', 'status', 'created_date', 'customer_name', 'customer_phone',
+    'customer_email', 'product_name', 'quantity', 'cashier_name', 'warehouse_name'
+])
+Delivery = record_type('Delivery', [
+    'id', 'delivery_address', 'status', 'created_date', 'delivery_date', 'customer_name',
+    'customer_phone', 'customer_email', 'product_name', 'quantity', 'cashier_name',
+    'storekeeper_name', 'warehouse_name', 'vehicle_info', 'storekeeper_id'
+])
+GroupDelivery = record_type('GroupDelivery', [
+    'id', 'delivery_address', 'status', 'customer_name', 'customer_phone', 'product_name', 'quantity'
+])
+DeliveryGroup = record_type('DeliveryGroup', [
+    'id', 'vehicle_info', 'status', 'created_date', 'completed_date', 'storekeeper_name', 'delivery_count'
+])
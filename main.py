@@ -84,7 +84,8 @@ def main():
         if all([db_params['host'], db_params['user'], db_params['database']]):
             if test_database_connection(config):
                 # Подключаемся к нашей базе данных
-                db = Database(**db_params)
+                db = Database(**db_params, **config.get_pool_params(), **config.get_query_log_params())
+                db.start()
                 start = 1
                 # Показываем окно авторизации
                 from window.login_window import LoginWindow
@@ -1,11 +1,102 @@
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-                             QLabel, QLineEdit, QPushButton, QTableWidget,
-                             QTableWidgetItem, QMessageBox, QHeaderView,
+                             QLabel, QLineEdit, QPushButton, QMessageBox,
                              QTabWidget, QDialog, QDialogButtonBox, QFormLayout,
-                             QComboBox, QSpinBox, QTextEdit, QGroupBox)
-from PyQt6.QtCore import Qt
+                             QComboBox, QSpinBox, QTextEdit, QGroupBox, QDateEdit)
+from PyQt6.QtCore import Qt, QModelIndex, QTimer, QDate
 from PyQt6.QtGui import QFont
 from window.customer_dialog import CustomerDialog
+from window.export import start_export
+from window.product_import import start_product_import
+from window.live_updates import LiveUpdates
+from window.query_runner import QueryRunner, busy_indicator
+from window.table_models import RowTableModel, table_view, selected_row
+
+class SalesTableModel(RowTableModel):
+    """Модель истории продаж, подгружающая страницы по мере прокрутки"""
+    
+    COLUMNS = [
+        ('ID', 'id'),
+        ('Товар', 'product_name'),
+        ('Количество', 'quantity'),
+        ('Сумма', 'total_price'),
+        ('Дата', 'sale_date'),
+        ('Кассир', 'cashier_name'),
+        ('Склад', 'warehouse_name'),
+        ('Статус', 'status')
+    ]
+    
+    def __init__(self, db, queries, page_size=200, parent=None):
+        # sale_datetime не показывается, но нужно для ключа следующей страницы
+        super().__init__(self.COLUMNS, fields=[key for _, key in self.COLUMNS] + ['sale_datetime'],
+                         parent=parent)
+        self.db = db
+        self.queries = queries
+        self.page_size = page_size
+        self.warehouse_id = None
+        self.has_more = False
+        self.loading = False
+        # Изменения, пришедшие до первой страницы: применяются после нее
+        self.held_changes = []
+    
+    def reset(self, warehouse_id):
+        """Начинает просмотр заново с самых новых продаж"""
+        self.beginResetModel()
+        self.warehouse_id = warehouse_id
+        self.rows = []
+        self.has_more = True
+        self.held_changes = []
+        # Страница прежнего просмотра, если она еще грузится, будет отброшена
+        self.loading = False
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+    
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.has_more and not self.loading
+    
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or not self.has_more or self.loading:
+            return
+        after = None
+        if self.rows:
+            last = len(self.rows) - 1
+            after = (self.value(last, 'sale_datetime'), self.value(last, 'id'))
+        
+        self.loading = True
+        self.queries.run('sales_page', self.append_page, self.db.get_sales_report,
+                         self.warehouse_id, after=after, limit=self.page_size)
+    
+    def append_page(self, page):
+        self.loading = False
+        self.has_more = len(page) == self.page_size
+        self.append_rows(page)
+        if self.held_changes:
+            held, self.held_changes = self.held_changes, []
+            self.apply_changes(held)
+    
+    def apply_changes(self, sales):
+        """Применяет измененные продажи: новые встают в начало, показанные обновляются"""
+        if self.loading and not self.rows:
+            # Без первой страницы неясно, какие продажи новее нее: иначе
+            # они встали бы в начало, а потом пришли бы еще раз со страницей
+            self.held_changes.extend(sales)
+            return
+        loaded = {row[0] for row in self.rows}
+        top = (self.value(0, 'sale_datetime'), self.value(0, 'id')) if self.rows else None
+        # Продажи старше первой строки, которых нет в списке, еще не подгружены
+        # и придут своей страницей
+        self.upsert_rows(
+            [sale for sale in sales
+             if sale['id'] in loaded or top is None or (sale['sale_datetime'], sale['id']) > top],
+            new_at_top=True
+        )
+    
+    def sale(self, row):
+        return self.record(row)
+    
+    def set_status(self, row, status):
+        """Обновляет статус одной строки без перезагрузки списка"""
+        self.set_value(row, 'status', status)
+
 
 class AdminWindow(QMainWindow):
     def __init__(self, db, user, login_window):
@@ -13,13 +104,39 @@ class AdminWindow(QMainWindow):
         self.db = db
         self.user = user
         self.login_window = login_window
+        # Загрузчики выполняют запросы в фоне, чтобы окно не зависало
+        self.queries = QueryRunner(self)
+        # Опрос изменений доставок идет отдельно, без индикатора загрузки
+        self.poller = QueryRunner(self, max_threads=1)
+        # Время сервера, с которого запрашиваются изменения доставок,
+        # и фильтр (склад, статусы), под который загружена таблица
+        self.deliveries_cursor = None
+        self.deliveries_filter = None
+        # Склад, остатки которого показаны, и товары и продажи, ждущие перечитывания
+        self.products_warehouse_id = None
+        self.stock_pending = set()
+        self.sales_pending = set()
         self.init_ui()
         # Применяем тему сразу после инициализации
         self.apply_theme()
     
+    # Интервал опроса изменений доставок, пока уведомления не доходят, мс
+    DELIVERIES_POLL_INTERVAL = 5000
+    
+    def closeEvent(self, event):
+        self.live.deliveries_changed.disconnect(self.on_deliveries_changed)
+        self.live.sales_changed.disconnect(self.on_sales_changed)
+        self.live.stock_changed.disconnect(self.on_stock_changed)
+        self.live.listening_changed.disconnect(self.on_listening_changed)
+        self.deliveries_timer.stop()
+        self.poller.cancel_all()
+        self.queries.cancel_all()
+        super().closeEvent(event)
+    
     def init_ui(self):
         self.setWindowTitle(f'Админ панель - Магазин бытовой техники ({self.user["full_name"]})')
         self.setMinimumSize(1400, 900)
+        self.statusBar().addPermanentWidget(busy_indicator(self.queries))
         
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -73,12 +190,17 @@ class AdminWindow(QMainWindow):
         self.deliveries_tab = QWidget()
         self.init_deliveries_tab()
         
+        # Вкладка аналитики
+        self.analytics_tab = QWidget()
+        self.init_analytics_tab()
+        
         self.tabs.addTab(self.registration_tab, "Регистрация сотрудников")
         self.tabs.addTab(self.warehouses_tab, "Управление складами")
         self.tabs.addTab(self.store_tab, "Учет склада")
         self.tabs.addTab(self.sales_tab, "Продажи")
         self.tabs.addTab(self.customers_tab, "Клиенты")
         self.tabs.addTab(self.deliveries_tab, "Доставки")
+        self.tabs.addTab(self.analytics_tab, "Аналитика")
         
         layout.addLayout(top_panel)
         layout.addWidget(self.tabs)
@@ -87,6 +209,20 @@ class AdminWindow(QMainWindow):
         
         self.load_customers()
         self.load_all_deliveries()
+        
+        # Изменения приходят уведомлениями; опрос нужен, только пока их нет
+        self.deliveries_timer = QTimer(self)
+        self.deliveries_timer.setInterval(self.DELIVERIES_POLL_INTERVAL)
+        self.deliveries_timer.timeout.connect(self.refresh_deliveries)
+        self.live = LiveUpdates.instance(self.db)
+        self.live.deliveries_changed.connect(self.on_deliveries_changed)
+        self.live.sales_changed.connect(self.on_sales_changed)
+        self.live.stock_changed.connect(self.on_stock_changed)
+        self.live.listening_changed.connect(self.on_listening_changed)
+        # Было ли окно без уведомлений после того, как они уже приходили
+        self.listening_lost = False
+        if not self.live.listening:
+            self.deliveries_timer.start()
     
     def init_customers_tab(self):
         layout = QVBoxLayout()
@@ -99,7 +235,12 @@ class AdminWindow(QMainWindow):
         
         self.customer_search_input = QLineEdit()
         self.customer_search_input.setPlaceholderText('Поиск по ФИО или телефону...')
-        self.customer_search_input.textChanged.connect(self.search_customers)
+        # Поиск запускается, когда пользователь перестал печатать
+        self.customer_search_timer = QTimer(self)
+        self.customer_search_timer.setSingleShot(True)
+        self.customer_search_timer.setInterval(300)
+        self.customer_search_timer.timeout.connect(self.load_customers)
+        self.customer_search_input.textChanged.connect(lambda: self.customer_search_timer.start())
         
         create_customer_btn = QPushButton('Создать клиента')
         create_customer_btn.clicked.connect(self.create_customer)
@@ -107,18 +248,24 @@ class AdminWindow(QMainWindow):
         refresh_btn = QPushButton('Обновить')
         refresh_btn.clicked.connect(self.load_customers)
         
+        export_btn = QPushButton('Экспорт...')
+        export_btn.clicked.connect(self.export_customers)
+        
         control_panel.addWidget(QLabel('Поиск:'))
         control_panel.addWidget(self.customer_search_input)
         control_panel.addWidget(create_customer_btn)
         control_panel.addWidget(refresh_btn)
+        control_panel.addWidget(export_btn)
         control_panel.addStretch()
         
-        self.customers_table = QTableWidget()
-        self.customers_table.setColumnCount(6)
-        self.customers_table.setHorizontalHeaderLabels([
-            'ID', 'ФИО', 'Телефон', 'Email', 'Адрес', 'Действия'
-        ])
-        self.customers_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.customers_model = RowTableModel(
+            [('ID', 'id'), ('ФИО', 'full_name'), ('Телефон', 'phone'),
+             ('Email', 'email'), ('Адрес', 'address')],
+            actions=[('Редактировать', lambda c: self.edit_customer(c['id'])),
+                     ('Удалить', lambda c: self.delete_customer(c['id']))],
+            parent=self
+        )
+        self.customers_table = table_view(self.customers_model)
         
         layout.addWidget(title)
         layout.addLayout(control_panel)
@@ -153,19 +300,27 @@ class AdminWindow(QMainWindow):
         refresh_btn = QPushButton('Обновить')
         refresh_btn.clicked.connect(self.load_all_deliveries)
         
+        export_btn = QPushButton('Экспорт...')
+        export_btn.clicked.connect(self.export_deliveries)
+        
         filter_layout.addWidget(QLabel('Статус:'))
         filter_layout.addWidget(self.status_filter_combo)
         filter_layout.addWidget(QLabel('Склад:'))
         filter_layout.addWidget(self.warehouse_filter_combo)
         filter_layout.addWidget(refresh_btn)
+        filter_layout.addWidget(export_btn)
         filter_layout.addStretch()
         
-        self.deliveries_table = QTableWidget()
-        self.deliveries_table.setColumnCount(10)
-        self.deliveries_table.setHorizontalHeaderLabels([
-            'ID', 'Клиент', 'Телефон', 'Адрес', 'Товар', 'Количество', 'Статус', 'Кладовщик', 'Транспорт', 'Действия'
-        ])
-        self.deliveries_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.deliveries_model = RowTableModel(
+            [('ID', 'id'), ('Клиент', 'customer_name'), ('Телефон', 'customer_phone'),
+             ('Адрес', 'delivery_address'), ('Товар', 'product_name'), ('Количество', 'quantity'),
+             ('Статус', 'status', self.get_status_text), ('Кладовщик', 'storekeeper_name'),
+             ('Транспорт', 'vehicle_info')],
+            actions=[('Отменить', lambda d: self.cancel_delivery(d['id']),
+                      lambda d: d['status'] in ['pending', 'assigned'])],
+            parent=self
+        )
+        self.deliveries_table = table_view(self.deliveries_model)
         
         layout.addWidget(title)
         layout.addLayout(filter_layout)
@@ -174,68 +329,19 @@ class AdminWindow(QMainWindow):
         self.deliveries_tab.setLayout(layout)
     
     def load_customers(self):
-        customers = self.db.get_all_customers()
-        self.customers_table.setRowCount(len(customers))
-        
-        for row, customer in enumerate(customers):
-            self.customers_table.setItem(row, 0, QTableWidgetItem(str(customer['id'])))
-            self.customers_table.setItem(row, 1, QTableWidgetItem(customer['full_name']))
-            self.customers_table.setItem(row, 2, QTableWidgetItem(customer['phone']))
-            self.customers_table.setItem(row, 3, QTableWidgetItem(customer['email'] or ''))
-            self.customers_table.setItem(row, 4, QTableWidgetItem(customer['address']))
-            
-            action_widget = QWidget()
-            action_layout = QHBoxLayout()
-            action_layout.setContentsMargins(0, 0, 0, 0)
-            
-            edit_btn = QPushButton('Редактировать')
-            edit_btn.clicked.connect(lambda checked, c_id=customer['id']: self.edit_customer(c_id))
-            
-            delete_btn = QPushButton('Удалить')
-            delete_btn.clicked.connect(lambda checked, c_id=customer['id']: self.delete_customer(c_id))
-            
-            action_layout.addWidget(edit_btn)
-            action_layout.addWidget(delete_btn)
-            action_widget.setLayout(action_layout)
-            
-            self.customers_table.setCellWidget(row, 5, action_widget)
+        # Фильтрация на сервере; без запроса - последние добавленные клиенты
+        self.queries.run('customers', self.show_customers,
+                         self.db.search_customers, self.customer_search_input.text())
     
-    def search_customers(self):
-        search_text = self.customer_search_input.text().lower()
-        if not search_text:
-            self.load_customers()
-            return
-        
-        customers = self.db.get_all_customers()
-        filtered_customers = [
-            c for c in customers 
-            if search_text in c['full_name'].lower() or search_text in c['phone'].lower()
-        ]
-        
-        self.customers_table.setRowCount(len(filtered_customers))
-        
-        for row, customer in enumerate(filtered_customers):
-            self.customers_table.setItem(row, 0, QTableWidgetItem(str(customer['id'])))
-            self.customers_table.setItem(row, 1, QTableWidgetItem(customer['full_name']))
-            self.customers_table.setItem(row, 2, QTableWidgetItem(customer['phone']))
-            self.customers_table.setItem(row, 3, QTableWidgetItem(customer['email'] or ''))
-            self.customers_table.setItem(row, 4, QTableWidgetItem(customer['address']))
-            
-            action_widget = QWidget()
-            action_layout = QHBoxLayout()
-            action_layout.setContentsMargins(0, 0, 0, 0)
-            
-            edit_btn = QPushButton('Редактировать')
-            edit_btn.clicked.connect(lambda checked, c_id=customer['id']: self.edit_customer(c_id))
-            
-            delete_btn = QPushButton('Удалить')
-            delete_btn.clicked.connect(lambda checked, c_id=customer['id']: self.delete_customer(c_id))
-            
-            action_layout.addWidget(edit_btn)
-            action_layout.addWidget(delete_btn)
-            action_widget.setLayout(action_layout)
-            
-            self.customers_table.setCellWidget(row, 5, action_widget)
+    def show_customers(self, customers):
+        self.customers_model.set_rows(customers)
+    
+    def export_customers(self):
+        # Выгружаются все клиенты, а не только найденные
+        start_export(self, 'Экспорт клиентов', 'customers',
+                     [('ID', 'id'), ('ФИО', 'full_name'), ('Телефон', 'phone'),
+                      ('Email', 'email'), ('Адрес', 'address'), ('Дата регистрации', 'created_date')],
+                     self.db.iter_customers)
     
     def create_customer(self):
         dialog = CustomerDialog(self.db, None, self)
@@ -267,39 +373,83 @@ class AdminWindow(QMainWindow):
         warehouse_filter = self.warehouse_filter_combo.currentData()
         
         if warehouse_filter == 'all':
-            deliveries = self.db.get_all_deliveries()
+            warehouse_filter = None
+        statuses = None if status_filter == 'all' else [status_filter]
+        
+        # Смена фильтра - полная перезагрузка, старый курсор к ней не относится
+        self.deliveries_cursor = None
+        self.poller.cancel('delivery_changes')
+        self.queries.run('deliveries', self.show_all_deliveries,
+                         self._fetch_all_deliveries, warehouse_filter, statuses)
+    
+    def export_deliveries(self):
+        # Выгрузка по тем же фильтрам, что и таблица
+        status_filter = self.status_filter_combo.currentData()
+        warehouse_filter = self.warehouse_filter_combo.currentData()
+        
+        if warehouse_filter == 'all':
+            warehouse_filter = None
+        statuses = None if status_filter == 'all' else [status_filter]
+        
+        start_export(self, 'Экспорт доставок', 'deliveries',
+                     [('ID', 'id'), ('Клиент', 'customer_name'), ('Телефон', 'customer_phone'),
+                      ('Адрес', 'delivery_address'), ('Товар', 'product_name'), ('Количество', 'quantity'),
+                      ('Статус', 'status', self.get_status_text), ('Кладовщик', 'storekeeper_name'),
+                      ('Транспорт', 'vehicle_info'), ('Склад', 'warehouse_name'),
+                      ('Создана', 'created_date'), ('Доставлена', 'delivery_date')],
+                     self.db.iter_deliveries, warehouse_filter, statuses)
+    
+    def _fetch_all_deliveries(self, warehouse_id, statuses):
+        # Выполняется в фоновом потоке. Курсор берется до чтения списка:
+        # изменения, сделанные во время загрузки, придут при следующем опросе
+        changes = self.db.get_deliveries_changed_since(None, warehouse_id)
+        deliveries = self.db.get_all_deliveries(warehouse_id, statuses=statuses)
+        return changes[1] if changes else None, (warehouse_id, statuses), deliveries
+    
+    def show_all_deliveries(self, result):
+        self.deliveries_cursor, self.deliveries_filter, deliveries = result
+        self.deliveries_model.set_rows(deliveries)
+    
+    def refresh_deliveries(self):
+        """Применяет к таблице доставок изменения с последнего обновления"""
+        if self.deliveries_cursor is None:
+            # Идет полная загрузка или она не удалась - повторит кнопка "Обновить"
+            return
+        warehouse_id, _ = self.deliveries_filter
+        self.poller.run('delivery_changes', self.apply_delivery_changes,
+                        self.db.get_deliveries_changed_since, self.deliveries_cursor, warehouse_id)
+    
+    def on_deliveries_changed(self, deliveries):
+        if self.deliveries_filter is None:
+            return
+        warehouse_id, _ = self.deliveries_filter
+        if warehouse_id is None or any(w == warehouse_id for _, w in deliveries):
+            self.refresh_deliveries()
+    
+    def on_listening_changed(self, listening):
+        if listening:
+            self.deliveries_timer.stop()
+            # Изменения, сделанные пока соединения не было, уведомлений не дали.
+            # Доставки догоняются по курсору изменений
+            self.refresh_deliveries()
+            if self.listening_lost:
+                # Для товаров и продаж курсора нет - после разрыва перечитываем
+                # их целиком. Первое подключение пропускаем: окно только что
+                # загрузило их из базы
+                self.load_products()
+                self.load_sales()
         else:
-            deliveries = self.db.get_all_deliveries(warehouse_filter)
-        
-        # Применяем фильтр по статусу
-        if status_filter != 'all':
-            deliveries = [d for d in deliveries if d['status'] == status_filter]
-        
-        self.deliveries_table.setRowCount(len(deliveries))
-        
-        for row, delivery in enumerate(deliveries):
-            self.deliveries_table.setItem(row, 0, QTableWidgetItem(str(delivery['id'])))
-            self.deliveries_table.setItem(row, 1, QTableWidgetItem(delivery['customer_name']))
-            self.deliveries_table.setItem(row, 2, QTableWidgetItem(delivery['customer_phone']))
-            self.deliveries_table.setItem(row, 3, QTableWidgetItem(delivery['delivery_address']))
-            self.deliveries_table.setItem(row, 4, QTableWidgetItem(delivery['product_name']))
-            self.deliveries_table.setItem(row, 5, QTableWidgetItem(str(delivery['quantity'])))
-            self.deliveries_table.setItem(row, 6, QTableWidgetItem(self.get_status_text(delivery['status'])))
-            self.deliveries_table.setItem(row, 7, QTableWidgetItem(delivery['storekeeper_name']))
-            self.deliveries_table.setItem(row, 8, QTableWidgetItem(delivery['vehicle_info']))
-            
-            action_widget = QWidget()
-            action_layout = QHBoxLayout()
-            action_layout.setContentsMargins(0, 0, 0, 0)
-            
-            if delivery['status'] in ['pending', 'assigned']:
-                cancel_btn = QPushButton('Отменить')
-                cancel_btn.clicked.connect(lambda checked, d_id=delivery['id']: self.cancel_delivery(d_id))
-                action_layout.addWidget(cancel_btn)
-            
-            action_widget.setLayout(action_layout)
-            
-            self.deliveries_table.setCellWidget(row, 9, action_widget)
+            self.listening_lost = True
+            self.deliveries_timer.start()
+    
+    def apply_delivery_changes(self, changes):
+        if changes is None or self.deliveries_cursor is None:
+            return
+        deliveries, self.deliveries_cursor = changes
+        _, statuses = self.deliveries_filter
+        self.deliveries_model.upsert_rows(
+            deliveries, new_at_top=True,
+            keep=lambda d: statuses is None or d['status'] in statuses)
     
     def get_status_text(self, status):
         status_map = {
@@ -319,22 +469,11 @@ class AdminWindow(QMainWindow):
         )
         
         if reply == QMessageBox.StandardButton.Yes:
-            # Для отмены доставки обновляем статус
-            conn = self.db._get_connection()
-            cursor = conn.cursor()
-            try:
-                cursor.execute('''
-                    UPDATE deliveries 
-                    SET status = 'cancelled'
-                    WHERE id = %s
-                ''', (delivery_id,))
-                conn.commit()
+            if self.db.cancel_delivery(delivery_id):
                 QMessageBox.information(self, 'Успех', 'Доставка отменена')
-                self.load_all_deliveries()
-            except Exception as e:
-                QMessageBox.warning(self, 'Ошибка', f'Ошибка при отмене доставки: {e}')
-            finally:
-                conn.close()
+                self.refresh_deliveries()
+            else:
+                QMessageBox.warning(self, 'Ошибка', 'Ошибка при отмене доставки')
     
     def logout(self):
         self.login_window.show()
@@ -409,7 +548,7 @@ class AdminWindow(QMainWindow):
             selection-background-color: {color};
             selection-color: white;
         }}
-        QTableWidget {{
+        QTableView {{
             background-color: white;
             color: #333333;
             gridline-color: #cccccc;
@@ -550,7 +689,7 @@ class AdminWindow(QMainWindow):
             selection-background-color: {color};
             selection-color: white;
         }}
-        QTableWidget {{
+        QTableView {{
             background-color: #404040;
             color: #ffffff;
             gridline-color: #555555;
@@ -701,10 +840,12 @@ class AdminWindow(QMainWindow):
         employees_buttons_layout.addWidget(delete_employee_btn)
         employees_buttons_layout.addStretch()
         
-        self.employees_table = QTableWidget()
-        self.employees_table.setColumnCount(7)
-        self.employees_table.setHorizontalHeaderLabels(['ID', 'Логин', 'ФИО', 'Роль', 'Телефон', 'Email', 'Склад'])
-        self.employees_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.employees_model = RowTableModel(
+            [('ID', 'id'), ('Логин', 'login'), ('ФИО', 'full_name'), ('Роль', 'role'),
+             ('Телефон', 'phone'), ('Email', 'email'), ('Склад', 'warehouse_name')],
+            parent=self
+        )
+        self.employees_table = table_view(self.employees_model)
         self.employees_table.doubleClicked.connect(self.edit_employee)
         
         layout.addWidget(form_group)
@@ -756,10 +897,11 @@ class AdminWindow(QMainWindow):
         warehouses_buttons_layout.addWidget(delete_warehouse_btn)
         warehouses_buttons_layout.addStretch()
         
-        self.warehouses_table = QTableWidget()
-        self.warehouses_table.setColumnCount(3)
-        self.warehouses_table.setHorizontalHeaderLabels(['ID', 'Название', 'Адрес'])
-        self.warehouses_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.warehouses_model = RowTableModel(
+            [('ID', 'id'), ('Название', 'name'), ('Адрес', 'address')],
+            parent=self
+        )
+        self.warehouses_table = table_view(self.warehouses_model)
         self.warehouses_table.doubleClicked.connect(self.edit_warehouse)
         
         layout.addWidget(form_group)
@@ -781,8 +923,12 @@ class AdminWindow(QMainWindow):
         self.view_combo.addItems(['Текущий склад', 'Все склады'])
         self.view_combo.currentTextChanged.connect(self.load_products)
         
+        import_btn = QPushButton('Загрузить из файла...')
+        import_btn.clicked.connect(self.import_products)
+        
         filter_layout.addWidget(self.view_combo)
         filter_layout.addStretch()
+        filter_layout.addWidget(import_btn)
         
         # Форма добавления товара
         form_group = QGroupBox("Добавление товара")
@@ -850,10 +996,12 @@ class AdminWindow(QMainWindow):
         
         # Таблица товаров
         products_label = QLabel('Товары:')
-        self.products_table = QTableWidget()
-        self.products_table.setColumnCount(7)
-        self.products_table.setHorizontalHeaderLabels(['ID', 'Название', 'Категория', 'Бренд', 'Цена', 'Количество', 'Мин. количество'])
-        self.products_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.products_model = RowTableModel(
+            [('ID', 'id'), ('Название', 'name'), ('Категория', 'category'), ('Бренд', 'brand'),
+             ('Цена', 'price'), ('Количество', 'quantity'), ('Мин. количество', 'min_quantity')],
+            parent=self
+        )
+        self.products_table = table_view(self.products_model)
         
         layout.addLayout(filter_layout)
         layout.addWidget(form_group)
@@ -878,16 +1026,31 @@ class AdminWindow(QMainWindow):
         filter_layout.addWidget(self.sales_view_combo)
         filter_layout.addStretch()
         
+        # Выгрузка за период по выбранному отображению
+        self.sales_export_from = QDateEdit(QDate.currentDate().addDays(-365))
+        self.sales_export_from.setCalendarPopup(True)
+        self.sales_export_to = QDateEdit(QDate.currentDate())
+        self.sales_export_to.setCalendarPopup(True)
+        
+        export_btn = QPushButton('Экспорт...')
+        export_btn.clicked.connect(self.export_sales)
+        
+        filter_layout.addWidget(QLabel('Экспорт с:'))
+        filter_layout.addWidget(self.sales_export_from)
+        filter_layout.addWidget(QLabel('по:'))
+        filter_layout.addWidget(self.sales_export_to)
+        filter_layout.addWidget(export_btn)
+        
         # Кнопка обновления
         refresh_btn = QPushButton('Обновить список продаж')
         refresh_btn.clicked.connect(self.load_sales)
         
         # Таблица продаж
         sales_label = QLabel('История продаж:')
-        self.sales_table = QTableWidget()
-        self.sales_table.setColumnCount(8)
-        self.sales_table.setHorizontalHeaderLabels(['ID', 'Товар', 'Количество', 'Сумма', 'Дата', 'Кассир', 'Склад', 'Статус'])
-        self.sales_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        # Продажи подгружаются страницами при прокрутке, а не все сразу
+        self.sales_model = SalesTableModel(self.db, self.queries, parent=self)
+        self.sales_table = table_view(self.sales_model)
+        self.sales_table.verticalHeader().setVisible(False)
         
         # Кнопка отмены продажи
         cancel_sale_btn = QPushButton('Отменить выбранную продажу')
@@ -902,78 +1065,192 @@ class AdminWindow(QMainWindow):
         self.sales_tab.setLayout(layout)
         self.load_sales()
     
+    def init_analytics_tab(self):
+        layout = QVBoxLayout()
+        
+        title = QLabel('Аналитика продаж')
+        title.setFont(QFont('Arial', 12, QFont.Weight.Bold))
+        
+        # Фильтры
+        filter_layout = QHBoxLayout()
+        
+        self.analytics_period_combo = QComboBox()
+        self.analytics_period_combo.addItem('По дням', 'day')
+        self.analytics_period_combo.addItem('По неделям', 'week')
+        self.analytics_period_combo.addItem('По месяцам', 'month')
+        
+        self.analytics_group_combo = QComboBox()
+        self.analytics_group_combo.addItem('Итого', None)
+        self.analytics_group_combo.addItem('По складам', 'warehouse')
+        self.analytics_group_combo.addItem('По кассирам', 'cashier')
+        
+        self.analytics_warehouse_combo = QComboBox()
+        self.analytics_warehouse_combo.addItem('Все склады', None)
+        for warehouse in self.db.get_all_warehouses():
+            self.analytics_warehouse_combo.addItem(warehouse['name'], warehouse['id'])
+        
+        self.analytics_from_date = QDateEdit(QDate.currentDate().addDays(-30))
+        self.analytics_from_date.setCalendarPopup(True)
+        self.analytics_to_date = QDateEdit(QDate.currentDate())
+        self.analytics_to_date.setCalendarPopup(True)
+        
+        show_btn = QPushButton('Показать')
+        show_btn.clicked.connect(self.load_analytics)
+        
+        filter_layout.addWidget(QLabel('Период:'))
+        filter_layout.addWidget(self.analytics_period_combo)
+        filter_layout.addWidget(QLabel('Разрез:'))
+        filter_layout.addWidget(self.analytics_group_combo)
+        filter_layout.addWidget(QLabel('Склад:'))
+        filter_layout.addWidget(self.analytics_warehouse_combo)
+        filter_layout.addWidget(QLabel('С:'))
+        filter_layout.addWidget(self.analytics_from_date)
+        filter_layout.addWidget(QLabel('По:'))
+        filter_layout.addWidget(self.analytics_to_date)
+        filter_layout.addWidget(show_btn)
+        filter_layout.addStretch()
+        
+        money = lambda value: f'{value:.2f}'
+        self.revenue_model = RowTableModel(
+            [('Начало периода', 'period_start'), ('Склад / кассир', 'group_name'),
+             ('Выручка', 'revenue', money), ('Продано единиц', 'units'), ('Продаж', 'sales_count')],
+            parent=self
+        )
+        self.revenue_table = table_view(self.revenue_model)
+        
+        self.top_products_model = RowTableModel(
+            [('Товар', 'product_name'), ('Выручка', 'revenue', money),
+             ('Продано единиц', 'units'), ('Продаж', 'sales_count')],
+            parent=self
+        )
+        self.top_products_table = table_view(self.top_products_model)
+        
+        layout.addWidget(title)
+        layout.addLayout(filter_layout)
+        layout.addWidget(QLabel('Выручка:'))
+        layout.addWidget(self.revenue_table)
+        layout.addWidget(QLabel('Популярные товары:'))
+        layout.addWidget(self.top_products_table)
+        
+        self.analytics_tab.setLayout(layout)
+        self.load_analytics()
+    
+    def load_analytics(self):
+        warehouse_id = self.analytics_warehouse_combo.currentData()
+        date_from = self.analytics_from_date.date().toPyDate()
+        # Конечная дата включается в отчет
+        date_to = self.analytics_to_date.date().addDays(1).toPyDate()
+        
+        self.queries.run('analytics_revenue', self.revenue_model.set_rows,
+                         self.db.reports.revenue, self.analytics_period_combo.currentData(),
+                         group_by=self.analytics_group_combo.currentData(),
+                         warehouse_id=warehouse_id, date_from=date_from, date_to=date_to)
+        self.queries.run('analytics_top_products', self.top_products_model.set_rows,
+                         self.db.reports.top_products, 20,
+                         warehouse_id=warehouse_id, date_from=date_from, date_to=date_to)
+    
     def load_warehouses_combo(self):
-        warehouses = self.db.get_all_warehouses()
-        self.emp_warehouse_combo.clear()
-        for warehouse in warehouses:
-            self.emp_warehouse_combo.addItem(warehouse['name'], warehouse['id'])
+        self.queries.run('warehouses_combo',
+                         lambda warehouses: self.fill_warehouses_combo(self.emp_warehouse_combo, warehouses),
+                         self.db.get_all_warehouses)
     
     def load_warehouses_combo_quantity(self):
-        warehouses = self.db.get_all_warehouses()
-        self.quantity_warehouse_combo.clear()
+        self.queries.run('warehouses_combo_quantity',
+                         lambda warehouses: self.fill_warehouses_combo(self.quantity_warehouse_combo, warehouses),
+                         self.db.get_all_warehouses)
+    
+    def fill_warehouses_combo(self, combo, warehouses):
+        combo.clear()
         for warehouse in warehouses:
-            self.quantity_warehouse_combo.addItem(warehouse['name'], warehouse['id'])
+            combo.addItem(warehouse['name'], warehouse['id'])
     
     def load_employees(self):
-        employees = self.db.get_all_employees()
-        self.employees_table.setRowCount(len(employees))
-        
-        for row, emp in enumerate(employees):
-            self.employees_table.setItem(row, 0, QTableWidgetItem(str(emp['id'])))
-            self.employees_table.setItem(row, 1, QTableWidgetItem(emp['login']))
-            self.employees_table.setItem(row, 2, QTableWidgetItem(emp['full_name']))
-            self.employees_table.setItem(row, 3, QTableWidgetItem(emp['role']))
-            self.employees_table.setItem(row, 4, QTableWidgetItem(emp['phone']))
-            self.employees_table.setItem(row, 5, QTableWidgetItem(emp['email']))
-            self.employees_table.setItem(row, 6, QTableWidgetItem(emp['warehouse_name']))
+        self.queries.run('employees', self.show_employees, self.db.get_all_employees)
+    
+    def show_employees(self, employees):
+        self.employees_model.set_rows(employees)
     
     def load_warehouses(self):
-        warehouses = self.db.get_all_warehouses()
-        self.warehouses_table.setRowCount(len(warehouses))
-        
-        for row, warehouse in enumerate(warehouses):
-            self.warehouses_table.setItem(row, 0, QTableWidgetItem(str(warehouse['id'])))
-            self.warehouses_table.setItem(row, 1, QTableWidgetItem(warehouse['name']))
-            self.warehouses_table.setItem(row, 2, QTableWidgetItem(warehouse['address']))
+        self.queries.run('warehouses', self.show_warehouses, self.db.get_all_warehouses)
+    
+    def show_warehouses(self, warehouses):
+        self.warehouses_model.set_rows(warehouses)
     
     def load_products(self):
         view_type = self.view_combo.currentText()
         
         if view_type == 'Текущий склад':
-            products = self.db.get_products_with_quantity(self.user['warehouse_id'])
+            warehouse_id = self.user['warehouse_id']
         else:
-            products = self.db.get_products_with_quantity(None)
+            warehouse_id = None
         
-        self.products_table.setRowCount(len(products))
-        
-        for row, product in enumerate(products):
-            self.products_table.setItem(row, 0, QTableWidgetItem(str(product['id'])))
-            self.products_table.setItem(row, 1, QTableWidgetItem(product['name']))
-            self.products_table.setItem(row, 2, QTableWidgetItem(product['category']))
-            self.products_table.setItem(row, 3, QTableWidgetItem(product['brand']))
-            self.products_table.setItem(row, 4, QTableWidgetItem(str(product['price'])))
-            self.products_table.setItem(row, 5, QTableWidgetItem(str(product['quantity'])))
-            self.products_table.setItem(row, 6, QTableWidgetItem(str(product['min_quantity'])))
+        self.products_warehouse_id = warehouse_id
+        self.stock_pending.clear()
+        self.poller.cancel('stock_changes')
+        self.queries.run('products', self.show_products,
+                         self.db.get_products_with_quantity, warehouse_id)
+    
+    def show_products(self, products):
+        self.products_model.set_rows(products)
+    
+    def on_stock_changed(self, stock):
+        """Перечитывает товары, остатки которых изменились на показанном складе"""
+        warehouse_id = self.products_warehouse_id
+        self.stock_pending.update(product_id for product_id, stock_warehouse_id in stock
+                                  if warehouse_id is None or stock_warehouse_id == warehouse_id)
+        if not self.stock_pending:
+            return
+        product_ids = sorted(self.stock_pending)
+        # Вытесненный запрос не теряет товаров: они остаются в stock_pending
+        self.poller.run('stock_changes',
+                        lambda products: self.apply_stock_changes(product_ids, products),
+                        self.db.get_products_with_quantity, warehouse_id, product_ids=product_ids)
+    
+    def apply_stock_changes(self, product_ids, products):
+        self.stock_pending.difference_update(product_ids)
+        self.products_model.upsert_rows(products)
+        # Товаров, которых нет в ответе, удалили
+        found = {product['id'] for product in products}
+        self.products_model.remove_rows(set(product_ids) - found)
     
     def load_sales(self):
         view_type = self.sales_view_combo.currentText()
         
+        self.sales_pending.clear()
+        self.poller.cancel('sales_changes')
         if view_type == 'Текущий склад':
-            sales = self.db.get_sales_report(self.user['warehouse_id'])
+            self.sales_model.reset(self.user['warehouse_id'])
         else:
-            sales = self.db.get_sales_report(None)
-        
-        self.sales_table.setRowCount(len(sales))
-        
-        for row, sale in enumerate(sales):
-            self.sales_table.setItem(row, 0, QTableWidgetItem(str(sale['id'])))
-            self.sales_table.setItem(row, 1, QTableWidgetItem(sale['product_name']))
-            self.sales_table.setItem(row, 2, QTableWidgetItem(str(sale['quantity'])))
-            self.sales_table.setItem(row, 3, QTableWidgetItem(str(sale['total_price'])))
-            self.sales_table.setItem(row, 4, QTableWidgetItem(sale['sale_date']))
-            self.sales_table.setItem(row, 5, QTableWidgetItem(sale['cashier_name']))
-            self.sales_table.setItem(row, 6, QTableWidgetItem(sale['warehouse_name']))
-            self.sales_table.setItem(row, 7, QTableWidgetItem(sale['status']))
+            self.sales_model.reset(None)
+    
+    def export_sales(self):
+        if self.sales_view_combo.currentText() == 'Текущий склад':
+            warehouse_id = self.user['warehouse_id']
+        else:
+            warehouse_id = None
+        date_from = self.sales_export_from.date()
+        date_to = self.sales_export_to.date()
+        start_export(self, 'Экспорт продаж',
+                     f"sales_{date_from.toString('yyyyMMdd')}_{date_to.toString('yyyyMMdd')}",
+                     SalesTableModel.COLUMNS,
+                     self.db.iter_sales, warehouse_id,
+                     date_from.toPyDate(), date_to.addDays(1).toPyDate())
+    
+    def on_sales_changed(self, sales):
+        """Перечитывает новые и измененные продажи показанного склада"""
+        warehouse_id = self.sales_model.warehouse_id
+        self.sales_pending.update(sale_id for sale_id, sale_warehouse_id in sales
+                                  if warehouse_id is None or sale_warehouse_id == warehouse_id)
+        if not self.sales_pending:
+            return
+        sale_ids = sorted(self.sales_pending)
+        self.poller.run('sales_changes',
+                        lambda changed: self.apply_sales_changes(sale_ids, changed),
+                        self.db.get_sales_report, warehouse_id, sale_ids=sale_ids)
+    
+    def apply_sales_changes(self, sale_ids, sales):
+        self.sales_pending.difference_update(sale_ids)
+        self.sales_model.apply_changes(sales)
     
     def register_employee(self):
         login = self.emp_login_input.text()
@@ -1000,13 +1277,13 @@ class AdminWindow(QMainWindow):
             QMessageBox.warning(self, 'Ошибка', 'Логин уже существует')
     
     def edit_employee(self):
-        selected = self.employees_table.selectedItems()
-        if not selected:
+        row = selected_row(self.employees_table)
+        if row is None:
             QMessageBox.warning(self, 'Ошибка', 'Выберите сотрудника для редактирования')
             return
         
-        employee_id = int(self.employees_table.item(selected[0].row(), 0).text())
-        employee_login = self.employees_table.item(selected[0].row(), 1).text()
+        employee_id = self.employees_model.value(row, 'id')
+        employee_login = self.employees_model.value(row, 'login')
         
         # Нельзя редактировать главного администратора
         if employee_login == 'admin':
@@ -1020,14 +1297,14 @@ class AdminWindow(QMainWindow):
             QMessageBox.information(self, 'Успех', 'Данные сотрудника обновлены')
     
     def delete_employee(self):
-        selected = self.employees_table.selectedItems()
-        if not selected:
+        row = selected_row(self.employees_table)
+        if row is None:
             QMessageBox.warning(self, 'Ошибка', 'Выберите сотрудника для удаления')
             return
         
-        employee_id = int(self.employees_table.item(selected[0].row(), 0).text())
-        employee_login = self.employees_table.item(selected[0].row(), 1).text()
-        employee_name = self.employees_table.item(selected[0].row(), 2).text()
+        employee_id = self.employees_model.value(row, 'id')
+        employee_login = self.employees_model.value(row, 'login')
+        employee_name = self.employees_model.value(row, 'full_name')
         
         # Нельзя удалить самого себя
         if employee_id == self.user['id']:
@@ -1070,13 +1347,13 @@ class AdminWindow(QMainWindow):
             QMessageBox.warning(self, 'Ошибка', 'Ошибка при добавлении склада')
     
     def edit_warehouse(self):
-        selected = self.warehouses_table.selectedItems()
-        if not selected:
+        row = selected_row(self.warehouses_table)
+        if row is None:
             QMessageBox.warning(self, 'Ошибка', 'Выберите склад для редактирования')
             return
         
-        warehouse_id = int(self.warehouses_table.item(selected[0].row(), 0).text())
-        warehouse_name = self.warehouses_table.item(selected[0].row(), 1).text()
+        warehouse_id = self.warehouses_model.value(row, 'id')
+        warehouse_name = self.warehouses_model.value(row, 'name')
         
         # Открываем диалог редактирования
         dialog = EditWarehouseDialog(self.db, warehouse_id, self)
@@ -1087,13 +1364,13 @@ class AdminWindow(QMainWindow):
             QMessageBox.information(self, 'Успех', 'Данные склада обновлены')
     
     def delete_warehouse(self):
-        selected = self.warehouses_table.selectedItems()
-        if not selected:
+        row = selected_row(self.warehouses_table)
+        if row is None:
             QMessageBox.warning(self, 'Ошибка', 'Выберите склад для удаления')
             return
         
-        warehouse_id = int(self.warehouses_table.item(selected[0].row(), 0).text())
-        warehouse_name = self.warehouses_table.item(selected[0].row(), 1).text()
+        warehouse_id = self.warehouses_model.value(row, 'id')
+        warehouse_name = self.warehouses_model.value(row, 'name')
         
         # Проверяем, есть ли сотрудники на этом складе
         employees_on_warehouse = self.db.get_employees_by_warehouse(warehouse_id)
@@ -1144,13 +1421,13 @@ class AdminWindow(QMainWindow):
             QMessageBox.warning(self, 'Ошибка', 'Ошибка при добавлении товара')
     
     def delete_product(self):
-        selected = self.products_table.selectedItems()
-        if not selected:
+        row = selected_row(self.products_table)
+        if row is None:
             QMessageBox.warning(self, 'Ошибка', 'Выберите товар для удаления')
             return
         
-        product_id = int(self.products_table.item(selected[0].row(), 0).text())
-        product_name = self.products_table.item(selected[0].row(), 1).text()
+        product_id = self.products_model.value(row, 'id')
+        product_name = self.products_model.value(row, 'name')
         
         reply = QMessageBox.question(self, 'Подтверждение удаления', 
                                    f'Вы уверены, что хотите удалить товар "{product_name}"?',
@@ -1163,6 +1440,10 @@ class AdminWindow(QMainWindow):
             else:
                 QMessageBox.warning(self, 'Ошибка', 'Ошибка при удалении товара')
     
+    def import_products(self):
+        # Остатки без склада в файле ложатся на склад администратора
+        start_product_import(self, self.user['warehouse_id'], on_done=self.load_products)
+    
     def update_quantity(self):
         product_id = self.quantity_product_id.value()
         warehouse_id = self.quantity_warehouse_combo.currentData()
@@ -1187,14 +1468,16 @@ class AdminWindow(QMainWindow):
             QMessageBox.warning(self, 'Ошибка', 'Ошибка при обновлении количества')
     
     def cancel_sale(self):
-        selected = self.sales_table.selectedItems()
+        selected = self.sales_table.selectionModel().selectedRows()
         if not selected:
             QMessageBox.warning(self, 'Ошибка', 'Выберите продажу для отмены')
             return
         
-        sale_id = int(self.sales_table.item(selected[0].row(), 0).text())
-        product_name = self.sales_table.item(selected[0].row(), 1).text()
-        status = self.sales_table.item(selected[0].row(), 7).text()
+        row = selected[0].row()
+        sale = self.sales_model.sale(row)
+        sale_id = sale['id']
+        product_name = sale['product_name']
+        status = sale['status']
         
         if status == 'cancelled':
             QMessageBox.warning(self, 'Ошибка', 'Эта продажа уже отменена')
@@ -1207,7 +1490,7 @@ class AdminWindow(QMainWindow):
         if reply == QMessageBox.StandardButton.Yes:
             if self.db.cancel_sale(sale_id):
                 QMessageBox.information(self, 'Успех', 'Продажа отменена')
-                self.load_sales()
+                self.sales_model.set_status(row, 'cancelled')
             else:
                 QMessageBox.warning(self, 'Ошибка', 'Ошибка при отмене продажи')
     
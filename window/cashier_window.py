@@ -1,10 +1,11 @@
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-                             QLabel, QLineEdit, QPushButton, QTableWidget,
-                             QTableWidgetItem, QSpinBox, QMessageBox, QHeaderView,
+                             QLabel, QLineEdit, QPushButton, QSpinBox, QMessageBox,
                              QDialog, QDialogButtonBox, QFormLayout, QCheckBox,
                              QGroupBox, QTextEdit)
 from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QFont
+from window.query_runner import QueryRunner, busy_indicator
+from window.table_models import RowTableModel, table_view
 
 class CashierWindow(QMainWindow):
     def __init__(self, db, user, login_window):
@@ -14,11 +15,18 @@ class CashierWindow(QMainWindow):
         self.login_window = login_window
         self.cart = []
         self.delivery_customer = None
+        # Загрузчики выполняют запросы в фоне, чтобы окно не зависало
+        self.queries = QueryRunner(self)
         self.init_ui()
     
+    def closeEvent(self, event):
+        self.queries.cancel_all()
+        super().closeEvent(event)
+    
     def init_ui(self):
         self.setWindowTitle(f'Касса - Магазин бытовой техники ({self.user["full_name"]})')
         self.setMinimumSize(1100, 900)
+        self.statusBar().addPermanentWidget(busy_indicator(self.queries))
         
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -50,12 +58,12 @@ class CashierWindow(QMainWindow):
         title.setAlignment(Qt.AlignmentFlag.AlignCenter)
         
         # Таблица товаров
-        self.products_table = QTableWidget()
-        self.products_table.setColumnCount(6)
-        self.products_table.setHorizontalHeaderLabels([
-            'ID', 'Название', 'Категория', 'Бренд', 'Цена', 'В наличии'
-        ])
-        self.products_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.products_model = RowTableModel(
+            [('ID', 'id'), ('Название', 'name'), ('Категория', 'category'), ('Бренд', 'brand'),
+             ('Цена', 'price', '{:.2f}'.format), ('В наличии', 'quantity')],
+            parent=self
+        )
+        self.products_table = table_view(self.products_model)
         
         # Поля для добавления в корзину
         sale_layout = QHBoxLayout()
@@ -77,10 +85,14 @@ class CashierWindow(QMainWindow):
         
         # Корзина
         cart_label = QLabel('Корзина:')
-        self.cart_table = QTableWidget()
-        self.cart_table.setColumnCount(6)
-        self.cart_table.setHorizontalHeaderLabels(['ID', 'Название', 'Количество', 'Цена за шт.', 'Сумма', 'Действие'])
-        self.cart_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.cart_model = RowTableModel(
+            [('ID', 'id'), ('Название', 'name'), ('Количество', 'quantity'),
+             ('Цена за шт.', 'price', '{:.2f}'.format), ('Сумма', 'total', '{:.2f}'.format)],
+            actions=[('Удалить', lambda item: self.remove_from_cart(item['id']))],
+            actions_header='Действие',
+            parent=self
+        )
+        self.cart_table = table_view(self.cart_model)
         
         # Кнопки корзины
         cart_buttons_layout = QHBoxLayout()
@@ -187,30 +199,26 @@ class CashierWindow(QMainWindow):
                 self.find_customer()
     
     def load_products(self):
-        products = self.db.get_products_with_quantity(self.user['warehouse_id'])
-        self.products_table.setRowCount(len(products))
-        
-        for row, product in enumerate(products):
-            self.products_table.setItem(row, 0, QTableWidgetItem(str(product['id'])))
-            self.products_table.setItem(row, 1, QTableWidgetItem(product['name']))
-            self.products_table.setItem(row, 2, QTableWidgetItem(product['category']))
-            self.products_table.setItem(row, 3, QTableWidgetItem(product['brand']))
-            self.products_table.setItem(row, 4, QTableWidgetItem(f"{product['price']:.2f}"))
-            self.products_table.setItem(row, 5, QTableWidgetItem(str(product['quantity'])))
+        self.queries.run('products', self.show_products,
+                         self.db.get_products_with_quantity, self.user['warehouse_id'])
+    
+    def show_products(self, products):
+        self.products_model.set_rows(products)
     
     def add_to_cart(self):
         product_id = self.product_id_input.value()
         quantity = self.quantity_input.value()
         
-        products = self.db.get_products_with_quantity(self.user['warehouse_id'])
-        product = next((p for p in products if p['id'] == product_id), None)
+        product = self.db.get_product_with_quantity(product_id, self.user['warehouse_id'])
         
         if not product:
             QMessageBox.warning(self, 'Ошибка', 'Товар не найден')
             return
         
-        if product['quantity'] < quantity:
-            QMessageBox.warning(self, 'Ошибка', f'Недостаточно товара в наличии. Доступно: {product["quantity"]}')
+        # Учитываем то, что уже лежит в корзине
+        in_cart = sum(item['quantity'] for item in self.cart if item['id'] == product_id)
+        if product['quantity'] < in_cart + quantity:
+            QMessageBox.warning(self, 'Ошибка', f'Недостаточно товара в наличии. Доступно: {product["quantity"] - in_cart}')
             return
         
         # Проверяем, есть ли товар уже в корзине
@@ -229,27 +237,15 @@ class CashierWindow(QMainWindow):
         self.update_cart_display()
     
     def update_cart_display(self):
-        self.cart_table.setRowCount(len(self.cart))
-        total = 0
-        
-        for row, item in enumerate(self.cart):
-            item_total = item['quantity'] * item['price']
-            total += item_total
-            
-            self.cart_table.setItem(row, 0, QTableWidgetItem(str(item['id'])))
-            self.cart_table.setItem(row, 1, QTableWidgetItem(item['name']))
-            self.cart_table.setItem(row, 2, QTableWidgetItem(str(item['quantity'])))
-            self.cart_table.setItem(row, 3, QTableWidgetItem(f"{item['price']:.2f}"))
-            self.cart_table.setItem(row, 4, QTableWidgetItem(f"{item_total:.2f}"))
-            
-            remove_btn = QPushButton('Удалить')
-            remove_btn.clicked.connect(lambda checked, r=row: self.remove_from_cart(r))
-            self.cart_table.setCellWidget(row, 5, remove_btn)
+        lines = [dict(item, total=item['quantity'] * item['price']) for item in self.cart]
+        self.cart_model.set_rows(lines)
         
+        total = sum(line['total'] for line in lines)
         self.total_label.setText(f'Общая сумма: {total:.2f} руб.')
     
-    def remove_from_cart(self, row):
-        self.cart.pop(row)
+    def remove_from_cart(self, product_id):
+        # Товар лежит в корзине одной строкой, см. add_to_cart
+        self.cart = [item for item in self.cart if item['id'] != product_id]
         self.update_cart_display()
     
     def clear_cart(self):
@@ -261,29 +257,9 @@ class CashierWindow(QMainWindow):
             QMessageBox.warning(self, 'Ошибка', 'Корзина пуста')
             return
         
-        # Проверяем наличие товара
-        for item in self.cart:
-            products = self.db.get_products_with_quantity(self.user['warehouse_id'])
-            product = next((p for p in products if p['id'] == item['id']), None)
-            if not product or product['quantity'] < item['quantity']:
-                QMessageBox.warning(self, 'Ошибка', f'Недостаточно товара "{item["name"]}" в наличии')
-                return
-        
-        # Оформляем продажу
-        for item in self.cart:
-            success = self.db.add_sale(
-                item['id'],
-                item['quantity'],
-                item['quantity'] * item['price'],
-                self.user['id'],
-                self.user['warehouse_id']
-            )
-            
-            if not success:
-                QMessageBox.critical(self, 'Ошибка', f'Ошибка при оформлении продажи товара "{item["name"]}"')
-                return
-        
-        # Если выбрана доставка
+        # Данные доставки собираем до оформления, чтобы продажа и доставка
+        # записались одной транзакцией
+        delivery = None
         if self.delivery_checkbox.isChecked():
             if not self.delivery_customer and not self.customer_phone_input.text():
                 QMessageBox.warning(self, 'Ошибка', 'Для доставки необходимо указать клиента')
@@ -317,22 +293,33 @@ class CashierWindow(QMainWindow):
                 # Получаем созданного клиента
                 self.delivery_customer = self.db.get_customer_by_phone(phone)
             
-            # Получаем последнюю продажу (предполагаем, что это продажа только что добавленного товара)
-            # В реальном приложении нужно получить ID конкретной продажи
-            sales = self.db.get_sales_report(self.user['warehouse_id'])
-            if sales:
-                last_sale_id = sales[0]['id']
-                
-                # Создаем доставку
-                success = self.db.create_delivery(
-                    last_sale_id,
-                    self.delivery_customer['id'],
-                    self.delivery_address_input.toPlainText(),
-                    self.delivery_notes_input.text()
-                )
-                
-                if not success:
-                    QMessageBox.warning(self, 'Ошибка', 'Ошибка при создании доставки')
+            delivery = {
+                'customer_id': self.delivery_customer['id'],
+                'address': self.delivery_address_input.toPlainText(),
+                'notes': self.delivery_notes_input.text()
+            }
+        
+        # Оформляем продажу всей корзины одной транзакцией
+        result = self.db.checkout(
+            self.cart,
+            self.user['id'],
+            self.user['warehouse_id'],
+            delivery
+        )
+        
+        if not result:
+            QMessageBox.critical(self, 'Ошибка', 'Ошибка при оформлении продажи')
+            return
+        
+        # Наличие проверяется в той же транзакции, что и продажа
+        if result['shortages']:
+            message = 'Недостаточно товара в наличии:\n\n'
+            for item in self.cart:
+                if item['id'] in result['shortages']:
+                    message += f"{item['name']}: доступно {result['shortages'][item['id']]}\n"
+            QMessageBox.warning(self, 'Ошибка', message)
+            self.load_products()
+            return
         
         QMessageBox.information(self, 'Успех', 'Продажа успешно оформлена!')
         self.clear_cart()
@@ -417,7 +404,7 @@ class CashierWindow(QMainWindow):
             selection-background-color: {color};
             selection-color: white;
         }}
-        QTableWidget {{
+        QTableView {{
             background-color: white;
             color: #333333;
             gridline-color: #cccccc;
@@ -558,7 +545,7 @@ class CashierWindow(QMainWindow):
             selection-background-color: {color};
             selection-color: white;
         }}
-        QTableWidget {{
+        QTableView {{
             background-color: #404040;
             color: #ffffff;
             gridline-color: #555555;
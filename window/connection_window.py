@@ -92,7 +92,8 @@ class ConnectionWindow(QMainWindow):
     def connect_to_db(self):
         try:
             db_params = self.get_connection_params()
-            self.db = Database(**db_params)
+            self.db = Database(**db_params, **self.config.get_pool_params(),
+                               **self.config.get_query_log_params())
             
             # Сохраняем настройки
             self.config.update_config(db_params)
@@ -103,6 +104,7 @@ class ConnectionWindow(QMainWindow):
             self.login_window = LoginWindow(self.db)
             from main import start
             if(start == 0):
+                self.db.start()
                 self.login_window.show()
             
         except Exception as e:
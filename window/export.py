@@ -0,0 +1,98 @@
+import os
+import threading
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, Qt, pyqtSignal
+from PyQt6.QtWidgets import QFileDialog, QMessageBox, QProgressDialog
+
+from edb.export import ExportCancelled, available_formats, export_records
+
+_FORMAT_FILTERS = {
+    'csv': 'CSV (*.csv)',
+    'xlsx': 'Excel (*.xlsx)',
+}
+
+# Выполняющиеся выгрузки: держим ссылки до завершения
+_running = set()
+
+
+class _ExportSignals(QObject):
+    # Число выгруженных строк
+    progress = pyqtSignal(int)
+    # (число строк, исключение)
+    finished = pyqtSignal(object, object)
+
+
+class ExportTask(QRunnable):
+    """Выгружает записи генератора fn(*args, **kwargs) в файл в потоке пула"""
+
+    def __init__(self, path, columns, fn, args, kwargs):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.path = path
+        self.columns = columns
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.cancel_event = threading.Event()
+        self.signals = _ExportSignals()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def run(self):
+        count, error = None, None
+        try:
+            count = export_records(self.fn(*self.args, **self.kwargs), self.path, self.columns,
+                                   self.signals.progress.emit, self.cancel_event.is_set)
+        except BaseException as e:
+            error = e
+        self.signals.finished.emit(count, error)
+
+
+def start_export(parent, title, default_name, columns, fn, *args, **kwargs):
+    """Спрашивает файл и выгружает в него записи fn(*args, **kwargs) в фоне.
+
+    columns - столбцы файла, как у RowTableModel. Пока идет выгрузка,
+    показывается окно с числом строк и кнопкой отмены; окно остается
+    рабочим. Возвращает задачу или None, если пользователь не выбрал файл.
+    """
+    formats = available_formats()
+    filters = ';;'.join(_FORMAT_FILTERS[fmt] for fmt in formats)
+    path, selected = QFileDialog.getSaveFileName(
+        parent, title, os.path.join(os.path.expanduser('~'), f"{default_name}.{formats[-1]}"), filters
+    )
+    if not path:
+        return None
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension not in formats:
+        fmt = next((fmt for fmt in formats if _FORMAT_FILTERS[fmt] == selected), formats[0])
+        path += '.' + fmt
+
+    task = ExportTask(path, columns, fn, args, kwargs)
+
+    dialog = QProgressDialog('Выгрузка...', 'Отмена', 0, 0, parent)
+    dialog.setWindowTitle(title)
+    dialog.setWindowModality(Qt.WindowModality.WindowModal)
+    dialog.setMinimumDuration(0)
+    dialog.canceled.connect(task.cancel)
+    dialog.canceled.connect(lambda: dialog.setLabelText('Отмена выгрузки...'))
+    task.signals.progress.connect(
+        lambda count: task.cancel_event.is_set() or dialog.setLabelText(f'Выгружено строк: {count}'))
+
+    def on_finished(count, error):
+        _running.discard(task)
+        # Без этого закрытие окна прогресса считается отменой
+        dialog.canceled.disconnect()
+        dialog.close()
+        if error is None:
+            QMessageBox.information(parent, title, f'Выгружено строк: {count}\n{path}')
+        elif isinstance(error, ExportCancelled):
+            QMessageBox.information(parent, title, 'Выгрузка отменена')
+        else:
+            QMessageBox.warning(parent, title, f'Ошибка выгрузки: {error}')
+
+    task.signals.finished.connect(on_finished)
+    _running.add(task)
+    dialog.show()
+    QThreadPool.globalInstance().start(task)
+    return task
@@ -0,0 +1,53 @@
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from edb.catalog import parse_catalog_payloads
+from edb.migrations import CATALOG_CHANNEL, DELIVERIES_CHANNEL, SALES_CHANNEL
+
+
+class LiveUpdates(QObject):
+    """Уведомления об изменениях в базе в виде сигналов Qt.
+
+    Подписывается на слушатель уведомлений Database. Обработчики слушателя
+    вызываются в его потоке, а сигналы доходят до окон в потоке GUI.
+    Списки в сигналах - пары (id, id склада).
+    """
+
+    deliveries_changed = pyqtSignal(list)
+    sales_changed = pyqtSignal(list)
+    # (id товара, id склада)
+    stock_changed = pyqtSignal(list)
+    # False, пока соединение слушателя оборвано и уведомления теряются
+    listening_changed = pyqtSignal(bool)
+
+    _instances = {}
+
+    @classmethod
+    def instance(cls, db):
+        """Общий объект процесса для базы db"""
+        if db not in cls._instances:
+            cls._instances[db] = cls(db)
+        return cls._instances[db]
+
+    def __init__(self, db):
+        super().__init__()
+        self.listening = False
+        listener = db.notifications
+        listener.subscribe(DELIVERIES_CHANNEL,
+                           lambda payloads: self.deliveries_changed.emit(self._parse(payloads)),
+                           self._set_listening)
+        listener.subscribe(SALES_CHANNEL,
+                           lambda payloads: self.sales_changed.emit(self._parse(payloads)))
+        listener.subscribe(CATALOG_CHANNEL, self._catalog_changed)
+
+    def _set_listening(self, listening):
+        self.listening = listening
+        self.listening_changed.emit(listening)
+
+    def _catalog_changed(self, payloads):
+        _, stock = parse_catalog_payloads(payloads)
+        if stock:
+            self.stock_changed.emit(stock)
+
+    @staticmethod
+    def _parse(payloads):
+        return [tuple(int(part) for part in payload.split(':')) for payload in payloads]
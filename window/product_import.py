@@ -0,0 +1,72 @@
+import os
+
+from PyQt6.QtWidgets import QFileDialog, QMessageBox
+
+from edb.importer import available_formats, read_rows
+
+
+def start_product_import(window, warehouse_id=None, own_warehouse_only=False, on_done=None):
+    """Загружает товары и остатки из выбранного пользователем файла.
+
+    Сначала файл проверяется без изменений в базе (import_products с
+    check_only) и пользователь видит, что будет загружено и какие строки
+    с ошибками; загрузка идет только после подтверждения. Оба прохода
+    выполняются в фоне через window.queries. on_done вызывается после
+    успешной загрузки.
+    """
+    patterns = ' '.join(f'*.{fmt}' for fmt in available_formats())
+    path, _ = QFileDialog.getOpenFileName(window, 'Загрузка товаров', os.path.expanduser('~'),
+                                          f'Таблицы ({patterns})')
+    if not path:
+        return
+
+    def run(check_only):
+        return window.db.import_products(read_rows(path), warehouse_id, own_warehouse_only,
+                                         check_only=check_only)
+
+    def on_error(error):
+        QMessageBox.warning(window, 'Ошибка', f'Не удалось прочитать файл: {error}')
+
+    def on_checked(result):
+        if result is None:
+            QMessageBox.warning(window, 'Ошибка', 'Ошибка при проверке файла')
+            return
+        errors = result['errors']
+        if result['rows'] == len(errors):
+            _report(window, QMessageBox.Icon.Warning, 'Загрузка товаров',
+                    f"Нет строк для загрузки. Строк с ошибками: {len(errors)}", errors).exec()
+            return
+        box = _report(window, QMessageBox.Icon.Question, 'Загрузка товаров',
+                      f"{_summary(result, 'Будет')}\n\nЗагрузить?", errors)
+        box.setStandardButtons(QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+        if box.exec() == QMessageBox.StandardButton.Yes:
+            window.queries.run('product_import', on_imported, run, False, on_error=on_error)
+
+    def on_imported(result):
+        if result is None:
+            QMessageBox.warning(window, 'Ошибка', 'Ошибка при загрузке товаров')
+            return
+        _report(window, QMessageBox.Icon.Information, 'Загрузка товаров',
+                _summary(result, 'Было'), result['errors']).exec()
+        if on_done is not None:
+            on_done()
+
+    window.queries.run('product_import', on_checked, run, True, on_error=on_error)
+
+
+def _summary(result, verb):
+    text = (f"Строк в файле: {result['rows']}\n"
+            f"{verb} создано товаров: {result['created']}\n"
+            f"{verb} изменено товаров: {result['updated']}\n"
+            f"{verb} изменено остатков: {result['stock']}")
+    if result['errors']:
+        text += f"\nСтрок с ошибками (пропускаются): {len(result['errors'])}"
+    return text
+
+
+def _report(parent, icon, title, text, errors):
+    """Сообщение со списком ошибок по строкам в подробностях"""
+    box = QMessageBox(icon, title, text, parent=parent)
+    if errors:
+        box.setDetailedText('\n'.join(f'Строка {line}: {error}' for line, error in errors))
+    return box
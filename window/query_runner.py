@@ -0,0 +1,122 @@
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt6.QtWidgets import QProgressBar
+
+
+class _TaskSignals(QObject):
+    # (ключ, поколение, результат, исключение)
+    done = pyqtSignal(str, int, object, object)
+
+
+class _QueryTask(QRunnable):
+    """Выполняет вызов Database в потоке пула"""
+
+    def __init__(self, key, generation, fn, args, kwargs):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.key = key
+        self.generation = generation
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = _TaskSignals()
+
+    def run(self):
+        result, error = None, None
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            error = e
+        self.signals.done.emit(self.key, self.generation, result, error)
+
+
+class QueryRunner(QObject):
+    """Выполняет запросы окна в фоновых потоках.
+
+    Каждый запрос идет под ключом (обычно имя загрузчика). Новый запрос
+    с тем же ключом вытесняет предыдущий: еще не начатый снимается
+    с очереди, а результат уже выполняющегося отбрасывается. Обработчики
+    результата вызываются в потоке GUI.
+    """
+
+    # True, пока есть хотя бы один невыполненный запрос
+    busy_changed = pyqtSignal(bool)
+
+    def __init__(self, parent=None, max_threads=4):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self._generation = 0
+        self._pending = {}  # ключ -> (задача, обработчик результата, обработчик ошибки)
+        # Задачи в пуле, включая вытесненные: держим ссылки до завершения
+        self._running = {}  # поколение -> задача
+
+    def run(self, key, on_result, fn, *args, on_error=None, **kwargs):
+        """Ставит вызов fn(*args, **kwargs) в очередь под ключом key"""
+        was_busy = self.is_busy()
+        self._drop(key)
+
+        self._generation += 1
+        task = _QueryTask(key, self._generation, fn, args, kwargs)
+        task.signals.done.connect(self._on_done)
+        self._pending[key] = (task, on_result, on_error)
+        self._running[task.generation] = task
+        self.pool.start(task)
+
+        if not was_busy:
+            self.busy_changed.emit(True)
+
+    def _drop(self, key):
+        entry = self._pending.pop(key, None)
+        if entry is not None and self.pool.tryTake(entry[0]):
+            # Задача еще не начиналась - сигнала о завершении не будет
+            del self._running[entry[0].generation]
+
+    def cancel(self, key):
+        """Отменяет запрос с ключом key, если он есть"""
+        was_busy = self.is_busy()
+        self._drop(key)
+        if was_busy and not self.is_busy():
+            self.busy_changed.emit(False)
+
+    def cancel_all(self):
+        """Отменяет все запросы, например при закрытии окна"""
+        was_busy = self.is_busy()
+        for key in list(self._pending):
+            self._drop(key)
+        if was_busy:
+            self.busy_changed.emit(False)
+
+    def is_busy(self):
+        return bool(self._pending)
+
+    def _on_done(self, key, generation, result, error):
+        self._running.pop(generation, None)
+
+        entry = self._pending.get(key)
+        if entry is None or entry[0].generation != generation:
+            # Запрос вытеснен более новым или отменен
+            return
+        del self._pending[key]
+        _, on_result, on_error = entry
+
+        try:
+            if error is None:
+                on_result(result)
+            elif on_error is not None:
+                on_error(error)
+            else:
+                print(f"Ошибка фонового запроса '{key}': {error}")
+        finally:
+            if not self.is_busy():
+                self.busy_changed.emit(False)
+
+
+def busy_indicator(runner, parent=None):
+    """Бесконечный индикатор загрузки, видимый пока runner занят"""
+    bar = QProgressBar(parent)
+    bar.setRange(0, 0)
+    bar.setMaximumWidth(120)
+    bar.setTextVisible(False)
+    bar.setVisible(runner.is_busy())
+    runner.busy_changed.connect(bar.setVisible)
+    return bar
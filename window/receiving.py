@@ -0,0 +1,107 @@
+import json
+import os
+import uuid
+from datetime import datetime
+
+
+def receiving_session_path(employee_id, warehouse_id):
+    """Файл незавершенной приемки сотрудника на складе"""
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(current_dir, f'receiving_{employee_id}_{warehouse_id}.json')
+
+
+class ReceivingSession:
+    """Приемка товара: строки копятся локально и проводятся разом.
+
+    Строка - товар и количество; повторный ввод того же товара
+    прибавляется к его строке, отрицательное количество исправляет
+    ошибку ввода. После каждого изменения сессия записывается в файл,
+    поэтому после сбоя окно продолжает ту же приемку. Идентификатор
+    сессии передается в Database.receive_stock, чтобы проведенную
+    приемку нельзя было провести второй раз.
+    """
+
+    def __init__(self, path, warehouse_id):
+        self.path = path
+        self.warehouse_id = warehouse_id
+        self._reset()
+
+    def _reset(self):
+        self.id = str(uuid.uuid4())
+        self.started = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # [{'id', 'name', 'quantity'}] в порядке ввода
+        self.lines = []
+
+    @classmethod
+    def open(cls, path, warehouse_id):
+        """Незавершенная сессия из файла path или новая"""
+        session = cls(path, warehouse_id)
+        if not os.path.exists(path):
+            return session
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data['warehouse_id'] == warehouse_id:
+                session.id = data['id']
+                session.started = data['started']
+                session.lines = [
+                    {'id': line['id'], 'name': line['name'], 'quantity': line['quantity']}
+                    for line in data['lines']
+                ]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ошибка чтения сессии приемки: {e}")
+        return session
+
+    def add(self, product_id, name, quantity):
+        """Прибавляет quantity к строке товара; строка с нулем удаляется"""
+        for line in self.lines:
+            if line['id'] == product_id:
+                line['quantity'] += quantity
+                if line['quantity'] == 0:
+                    self.lines.remove(line)
+                break
+        else:
+            if quantity:
+                self.lines.append({'id': product_id, 'name': name, 'quantity': quantity})
+        return self.save()
+
+    def remove(self, product_id):
+        self.lines = [line for line in self.lines if line['id'] != product_id]
+        return self.save()
+
+    def deltas(self):
+        """Пары (product_id, количество) для Database.receive_stock"""
+        return [(line['id'], line['quantity']) for line in self.lines]
+
+    def units(self):
+        return sum(line['quantity'] for line in self.lines)
+
+    def save(self):
+        """Записывает сессию в файл; False при ошибке записи"""
+        data = {
+            'id': self.id,
+            'warehouse_id': self.warehouse_id,
+            'started': self.started,
+            'lines': self.lines,
+        }
+        partial = self.path + '.part'
+        try:
+            # Файл заменяется целиком: при сбое во время записи остается прежний
+            with open(partial, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(partial, self.path)
+            return True
+        except OSError as e:
+            print(f"Ошибка сохранения сессии приемки: {e}")
+            return False
+
+    def finish(self):
+        """Удаляет файл сессии (после проведения или отказа) и начинает новую"""
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        except OSError as e:
+            print(f"Ошибка удаления сессии приемки: {e}")
+        self._reset()
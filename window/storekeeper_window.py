@@ -1,10 +1,14 @@
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-                             QLabel, QLineEdit, QPushButton, QTableWidget,
-                             QTableWidgetItem, QMessageBox, QHeaderView,
+                             QLabel, QLineEdit, QPushButton, QMessageBox,
                              QTabWidget, QDialog, QDialogButtonBox, QFormLayout,
                              QComboBox, QGroupBox, QSpinBox)
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer
 from PyQt6.QtGui import QFont
+from window.live_updates import LiveUpdates
+from window.product_import import start_product_import
+from window.receiving import ReceivingSession, receiving_session_path
+from window.query_runner import QueryRunner, busy_indicator
+from window.table_models import RowTableModel, table_view, selected_row
 
 class StorekeeperWindow(QMainWindow):
     def __init__(self, db, user, login_window):
@@ -12,13 +16,38 @@ class StorekeeperWindow(QMainWindow):
         self.db = db
         self.user = user
         self.login_window = login_window
+        # Загрузчики выполняют запросы в фоне, чтобы окно не зависало
+        self.queries = QueryRunner(self)
+        # Опрос изменений доставок идет отдельно, без индикатора загрузки
+        self.poller = QueryRunner(self, max_threads=1)
+        # Время сервера, с которого запрашиваются изменения доставок
+        self.deliveries_cursor = None
+        # Склад, остатки которого показаны, и товары, ждущие перечитывания
+        self.products_warehouse_id = None
+        self.stock_pending = set()
+        # Номер последнего скана приемки и сколько сканов ждут поиска товара
+        self.receiving_scans = 0
+        self.receiving_lookups = 0
         self.init_ui()
         # Применяем тему сразу после инициализации
         self.apply_theme()
     
+    # Интервал опроса изменений доставок, пока уведомления не доходят, мс
+    DELIVERIES_POLL_INTERVAL = 5000
+    
+    def closeEvent(self, event):
+        self.live.deliveries_changed.disconnect(self.on_deliveries_changed)
+        self.live.stock_changed.disconnect(self.on_stock_changed)
+        self.live.listening_changed.disconnect(self.on_listening_changed)
+        self.deliveries_timer.stop()
+        self.poller.cancel_all()
+        self.queries.cancel_all()
+        super().closeEvent(event)
+    
     def init_ui(self):
         self.setWindowTitle(f'Склад - Магазин бытовой техники ({self.user["full_name"]})')
         self.setMinimumSize(1200, 800)
+        self.statusBar().addPermanentWidget(busy_indicator(self.queries))
         
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -50,19 +79,24 @@ class StorekeeperWindow(QMainWindow):
         self.products_tab = QWidget()
         self.init_products_tab()
         
-        # Вкладка 2: Ожидающие доставки
+        # Вкладка 2: Приемка товара
+        self.receiving_tab = QWidget()
+        self.init_receiving_tab()
+        
+        # Вкладка 3: Ожидающие доставки
         self.deliveries_tab = QWidget()
         self.init_deliveries_tab()
         
-        # Вкладка 3: Мои доставки
+        # Вкладка 4: Мои доставки
         self.my_deliveries_tab = QWidget()
         self.init_my_deliveries_tab()
         
-        # Вкладка 4: Группы доставки
+        # Вкладка 5: Группы доставки
         self.delivery_groups_tab = QWidget()
         self.init_delivery_groups_tab()
         
         self.tabs.addTab(self.products_tab, "Учет товаров")
+        self.tabs.addTab(self.receiving_tab, "Приемка товара")
         self.tabs.addTab(self.deliveries_tab, "Ожидающие доставки")
         self.tabs.addTab(self.my_deliveries_tab, "Мои доставки")
         self.tabs.addTab(self.delivery_groups_tab, "Группы доставки")
@@ -73,9 +107,21 @@ class StorekeeperWindow(QMainWindow):
         central_widget.setLayout(layout)
         
         self.load_products()
-        self.load_pending_deliveries()
-        self.load_my_deliveries()
+        self.load_deliveries()
         self.load_delivery_groups()
+        
+        # Изменения приходят уведомлениями; опрос нужен, только пока их нет
+        self.deliveries_timer = QTimer(self)
+        self.deliveries_timer.setInterval(self.DELIVERIES_POLL_INTERVAL)
+        self.deliveries_timer.timeout.connect(self.refresh_deliveries)
+        self.live = LiveUpdates.instance(self.db)
+        self.live.deliveries_changed.connect(self.on_deliveries_changed)
+        self.live.stock_changed.connect(self.on_stock_changed)
+        self.live.listening_changed.connect(self.on_listening_changed)
+        # Было ли окно без уведомлений после того, как они уже приходили
+        self.listening_lost = False
+        if not self.live.listening:
+            self.deliveries_timer.start()
     
     def init_products_tab(self):
         """Вкладка для управления товарами на складе"""
@@ -94,16 +140,20 @@ class StorekeeperWindow(QMainWindow):
         self.view_combo.addItems(['Текущий склад', 'Все склады'])
         self.view_combo.currentTextChanged.connect(self.load_products)
         
+        import_btn = QPushButton('Загрузить из файла...')
+        import_btn.clicked.connect(self.import_products)
+        
         filter_layout.addWidget(self.view_combo)
         filter_layout.addStretch()
+        filter_layout.addWidget(import_btn)
         
         # Таблица товаров
-        self.products_table = QTableWidget()
-        self.products_table.setColumnCount(7)
-        self.products_table.setHorizontalHeaderLabels([
-            'ID', 'Название', 'Категория', 'Бренд', 'Цена', 'Количество', 'Мин. количество'
-        ])
-        self.products_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.products_model = RowTableModel(
+            [('ID', 'id'), ('Название', 'name'), ('Категория', 'category'), ('Бренд', 'brand'),
+             ('Цена', 'price'), ('Количество', 'quantity'), ('Мин. количество', 'min_quantity')],
+            parent=self
+        )
+        self.products_table = table_view(self.products_model)
         
         # Форма добавления товара
         form_group = QGroupBox("Добавление товара")
@@ -174,18 +224,85 @@ class StorekeeperWindow(QMainWindow):
         
         self.products_tab.setLayout(layout)
     
+    def init_receiving_tab(self):
+        """Вкладка приемки: строки копятся и проводятся одной транзакцией"""
+        layout = QVBoxLayout()
+        
+        title = QLabel('Приемка товара')
+        title.setFont(QFont('Arial', 14, QFont.Weight.Bold))
+        title.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        
+        # Незавершенная приемка восстанавливается из файла
+        self.receiving = ReceivingSession.open(
+            receiving_session_path(self.user['id'], self.user['warehouse_id']), self.user['warehouse_id']
+        )
+        
+        # Ввод строки: сканер штрихкода вводит ID товара и Enter
+        input_group = QGroupBox("Добавление товара")
+        input_layout = QHBoxLayout()
+        
+        self.receiving_product_input = QLineEdit()
+        self.receiving_product_input.setPlaceholderText('ID товара')
+        self.receiving_product_input.returnPressed.connect(self.add_receiving_line)
+        
+        self.receiving_quantity_input = QSpinBox()
+        # Отрицательное количество исправляет ошибочно введенную строку
+        self.receiving_quantity_input.setRange(-10000, 10000)
+        self.receiving_quantity_input.setValue(1)
+        
+        add_btn = QPushButton('Добавить')
+        add_btn.clicked.connect(self.add_receiving_line)
+        
+        input_layout.addWidget(QLabel('ID товара:'))
+        input_layout.addWidget(self.receiving_product_input)
+        input_layout.addWidget(QLabel('Количество:'))
+        input_layout.addWidget(self.receiving_quantity_input)
+        input_layout.addWidget(add_btn)
+        
+        input_group.setLayout(input_layout)
+        
+        self.receiving_model = RowTableModel(
+            [('ID', 'id'), ('Товар', 'name'), ('Количество', 'quantity')],
+            actions=[('Удалить', lambda line: self.remove_receiving_line(line['id']))],
+            parent=self
+        )
+        self.receiving_table = table_view(self.receiving_model)
+        
+        self.receiving_summary = QLabel()
+        
+        buttons_layout = QHBoxLayout()
+        self.apply_receiving_btn = QPushButton('Провести приемку')
+        self.apply_receiving_btn.clicked.connect(self.apply_receiving)
+        clear_btn = QPushButton('Очистить')
+        clear_btn.clicked.connect(self.clear_receiving)
+        buttons_layout.addWidget(self.apply_receiving_btn)
+        buttons_layout.addWidget(clear_btn)
+        buttons_layout.addStretch()
+        
+        layout.addWidget(title)
+        layout.addWidget(input_group)
+        layout.addWidget(self.receiving_table)
+        layout.addWidget(self.receiving_summary)
+        layout.addLayout(buttons_layout)
+        
+        self.receiving_tab.setLayout(layout)
+        self.show_receiving()
+    
     def init_deliveries_tab(self):
         layout = QVBoxLayout()
         
         title = QLabel('Ожидающие доставки')
         title.setFont(QFont('Arial', 12, QFont.Weight.Bold))
         
-        self.pending_deliveries_table = QTableWidget()
-        self.pending_deliveries_table.setColumnCount(8)
-        self.pending_deliveries_table.setHorizontalHeaderLabels([
-            'ID', 'Клиент', 'Телефон', 'Адрес доставки', 'Товар', 'Количество', 'Кассир', 'Действие'
-        ])
-        self.pending_deliveries_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.pending_deliveries_model = RowTableModel(
+            [('ID', 'id'), ('Клиент', 'customer_name'), ('Телефон', 'customer_phone'),
+             ('Адрес доставки', 'delivery_address'), ('Товар', 'product_name'),
+             ('Количество', 'quantity'), ('Кассир', 'cashier_name')],
+            actions=[('Взять в работу', lambda d: self.take_delivery(d['id']))],
+            actions_header='Действие',
+            parent=self
+        )
+        self.pending_deliveries_table = table_view(self.pending_deliveries_model)
         
         layout.addWidget(title)
         layout.addWidget(self.pending_deliveries_table)
@@ -198,12 +315,17 @@ class StorekeeperWindow(QMainWindow):
         title = QLabel('Мои доставки')
         title.setFont(QFont('Arial', 12, QFont.Weight.Bold))
         
-        self.my_deliveries_table = QTableWidget()
-        self.my_deliveries_table.setColumnCount(8)
-        self.my_deliveries_table.setHorizontalHeaderLabels([
-            'ID', 'Клиент', 'Телефон', 'Адрес доставки', 'Товар', 'Количество', 'Статус', 'Действие'
-        ])
-        self.my_deliveries_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.my_deliveries_model = RowTableModel(
+            [('ID', 'id'), ('Клиент', 'customer_name'), ('Телефон', 'customer_phone'),
+             ('Адрес доставки', 'delivery_address'), ('Товар', 'product_name'),
+             ('Количество', 'quantity'), ('Статус', 'status', self.get_status_text)],
+            actions=[('Добавить в группу', lambda d: self.add_to_delivery_group(d['id']),
+                      lambda d: d['status'] == 'assigned'),
+                     ('Завершить', lambda d: self.complete_delivery(d['id']))],
+            actions_header='Действие',
+            parent=self
+        )
+        self.my_deliveries_table = table_view(self.my_deliveries_model)
         
         layout.addWidget(title)
         layout.addWidget(self.my_deliveries_table)
@@ -229,13 +351,18 @@ class StorekeeperWindow(QMainWindow):
         create_group_layout.addWidget(self.vehicle_info_input)
         create_group_layout.addWidget(create_group_btn)
         
-        self.delivery_groups_table = QTableWidget()
-        self.delivery_groups_table.setColumnCount(6)
-        self.delivery_groups_table.setHorizontalHeaderLabels([
-            'ID', 'Транспорт', 'Статус', 'Дата создания', 'Кол-во доставок', 'Действие'
-        ])
-        self.delivery_groups_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
-        self.delivery_groups_table.doubleClicked.connect(self.show_group_details)
+        self.delivery_groups_model = RowTableModel(
+            [('ID', 'id'), ('Транспорт', 'vehicle_info'), ('Статус', 'status', self.get_status_text),
+             ('Дата создания', 'created_date'), ('Кол-во доставок', 'delivery_count')],
+            actions=[('Завершить группу', lambda g: self.complete_delivery_group(g['id']),
+                      lambda g: g['status'] == 'preparing'),
+                     ('Детали', lambda g: self.show_group_details(g['id']))],
+            actions_header='Действие',
+            parent=self
+        )
+        self.delivery_groups_table = table_view(self.delivery_groups_model)
+        # doubleClicked передает индекс ячейки, а не ID группы
+        self.delivery_groups_table.doubleClicked.connect(lambda index: self.show_group_details())
         
         layout.addWidget(title)
         layout.addLayout(create_group_layout)
@@ -257,20 +384,38 @@ class StorekeeperWindow(QMainWindow):
         view_type = self.view_combo.currentText()
         
         if view_type == 'Текущий склад':
-            products = self.db.get_products_with_quantity(self.user['warehouse_id'])
+            warehouse_id = self.user['warehouse_id']
         else:
-            products = self.db.get_products_with_quantity(None)
-        
-        self.products_table.setRowCount(len(products))
+            warehouse_id = None
         
-        for row, product in enumerate(products):
-            self.products_table.setItem(row, 0, QTableWidgetItem(str(product['id'])))
-            self.products_table.setItem(row, 1, QTableWidgetItem(product['name']))
-            self.products_table.setItem(row, 2, QTableWidgetItem(product['category']))
-            self.products_table.setItem(row, 3, QTableWidgetItem(product['brand']))
-            self.products_table.setItem(row, 4, QTableWidgetItem(str(product['price'])))
-            self.products_table.setItem(row, 5, QTableWidgetItem(str(product['quantity'])))
-            self.products_table.setItem(row, 6, QTableWidgetItem(str(product['min_quantity'])))
+        self.products_warehouse_id = warehouse_id
+        self.stock_pending.clear()
+        self.poller.cancel('stock_changes')
+        self.queries.run('products', self.show_products,
+                         self.db.get_products_with_quantity, warehouse_id)
+    
+    def show_products(self, products):
+        self.products_model.set_rows(products)
+    
+    def on_stock_changed(self, stock):
+        """Перечитывает товары, остатки которых изменились на показанном складе"""
+        warehouse_id = self.products_warehouse_id
+        self.stock_pending.update(product_id for product_id, stock_warehouse_id in stock
+                                  if warehouse_id is None or stock_warehouse_id == warehouse_id)
+        if not self.stock_pending:
+            return
+        product_ids = sorted(self.stock_pending)
+        # Вытесненный запрос не теряет товаров: они остаются в stock_pending
+        self.poller.run('stock_changes',
+                        lambda products: self.apply_stock_changes(product_ids, products),
+                        self.db.get_products_with_quantity, warehouse_id, product_ids=product_ids)
+    
+    def apply_stock_changes(self, product_ids, products):
+        self.stock_pending.difference_update(product_ids)
+        self.products_model.upsert_rows(products)
+        # Товаров, которых нет в ответе, удалили
+        found = {product['id'] for product in products}
+        self.products_model.remove_rows(set(product_ids) - found)
     
     def add_product(self):
         name = self.name_input.text()
@@ -299,6 +444,11 @@ class StorekeeperWindow(QMainWindow):
         else:
             QMessageBox.warning(self, 'Ошибка', 'Ошибка при добавлении товара')
     
+    def import_products(self):
+        # Кладовщик загружает остатки только своего склада
+        start_product_import(self, self.user['warehouse_id'], own_warehouse_only=True,
+                             on_done=self.load_products)
+    
     def update_quantity(self):
         product_id = self.quantity_product_id.value()
         warehouse_id = self.user['warehouse_id']
@@ -318,9 +468,122 @@ class StorekeeperWindow(QMainWindow):
         else:
             QMessageBox.warning(self, 'Ошибка', 'Ошибка при обновлении количества')
     
+    # Методы приемки товара
+    def show_receiving(self):
+        self.receiving_model.set_rows(self.receiving.lines)
+        if self.receiving.lines:
+            self.receiving_summary.setText(
+                f'Приемка с {self.receiving.started}: позиций {len(self.receiving.lines)}, '
+                f'единиц {self.receiving.units()}'
+            )
+        else:
+            self.receiving_summary.setText('Строк нет')
+    
+    def add_receiving_line(self):
+        text = self.receiving_product_input.text().strip()
+        quantity = self.receiving_quantity_input.value()
+        
+        if not text.isdigit():
+            QMessageBox.warning(self, 'Ошибка', 'Введите корректный ID товара')
+            return
+        if quantity == 0:
+            QMessageBox.warning(self, 'Ошибка', 'Количество не может быть нулевым')
+            return
+        
+        # Товар ищется в фоне: без кэша каталога это запрос к базе. У каждого
+        # скана свой ключ, чтобы быстрые сканы подряд не вытесняли друг друга
+        product_id = int(text)
+        self.receiving_scans += 1
+        self.receiving_lookups += 1
+        self.queries.run(f'receiving_line_{self.receiving_scans}',
+                         lambda product: self.on_receiving_product(product_id, quantity, product),
+                         self.db.get_product_with_quantity, product_id, self.user['warehouse_id'],
+                         on_error=lambda error: self.on_receiving_lookup_failed(product_id, error))
+        # Следующий скан - в пустое поле, количество снова 1
+        self.receiving_product_input.clear()
+        self.receiving_quantity_input.setValue(1)
+        self.receiving_product_input.setFocus()
+    
+    def on_receiving_lookup_failed(self, product_id, error):
+        self.receiving_lookups -= 1
+        QMessageBox.warning(self, 'Ошибка', f'Не удалось найти товар с ID {product_id}: {error}')
+    
+    def on_receiving_product(self, product_id, quantity, product):
+        self.receiving_lookups -= 1
+        if product is None:
+            QMessageBox.warning(self, 'Ошибка', f'Товар с ID {product_id} не найден')
+            return
+        
+        if not self.receiving.add(product['id'], product['name'], quantity):
+            QMessageBox.warning(self, 'Ошибка', 'Не удалось сохранить приемку на диск')
+        self.show_receiving()
+    
+    def remove_receiving_line(self, product_id):
+        if not self.receiving.remove(product_id):
+            QMessageBox.warning(self, 'Ошибка', 'Не удалось сохранить приемку на диск')
+        self.show_receiving()
+    
+    def clear_receiving(self):
+        if not self.receiving.lines:
+            return
+        reply = QMessageBox.question(
+            self, 'Подтверждение',
+            'Удалить все строки приемки без проведения?',
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+        )
+        if reply == QMessageBox.StandardButton.Yes:
+            self.receiving.finish()
+            self.show_receiving()
+    
+    def apply_receiving(self):
+        if self.receiving_lookups:
+            QMessageBox.warning(self, 'Ошибка', 'Дождитесь добавления отсканированных товаров')
+            return
+        if not self.receiving.lines:
+            QMessageBox.warning(self, 'Ошибка', 'Добавьте товары в приемку')
+            return
+        # Пока приемка проводится, строки не меняются
+        self.receiving_tab.setEnabled(False)
+        self.queries.run('receiving', self.on_receiving_applied,
+                         self.db.receive_stock, self.receiving.id, self.user['warehouse_id'],
+                         self.user['id'], self.receiving.deltas(),
+                         on_error=self.on_receiving_failed)
+    
+    def on_receiving_failed(self, error):
+        self.receiving_tab.setEnabled(True)
+        QMessageBox.warning(self, 'Ошибка', f'Ошибка при проведении приемки: {error}')
+    
+    def on_receiving_applied(self, result):
+        self.receiving_tab.setEnabled(True)
+        if result is None:
+            # Сессия сохранена - повторное проведение безопасно
+            QMessageBox.warning(self, 'Ошибка', 'Ошибка при проведении приемки, попробуйте еще раз')
+            return
+        
+        if result['shortages']:
+            names = {line['id']: line['name'] for line in self.receiving.lines}
+            message = "Остаток ушел бы в минус, приемка не проведена:\n\n"
+            for product_id, available in result['shortages'].items():
+                message += f"{names.get(product_id, product_id)}: на складе {available}\n"
+            QMessageBox.warning(self, 'Ошибка', message)
+            return
+        
+        if result['repeated']:
+            message = 'Эта приемка уже была проведена ранее'
+        else:
+            message = (f'Приемка проведена: позиций {len(self.receiving.lines)}, '
+                       f'единиц {self.receiving.units()}')
+        self.receiving.finish()
+        self.show_receiving()
+        QMessageBox.information(self, 'Успех', message)
+        self.load_products()
+    
     def check_minimum_quantities(self):
         """Проверка товаров с количеством ниже минимального"""
-        products = self.db.get_products_with_quantity(self.user['warehouse_id'])
+        self.queries.run('minimum_quantities', self.show_minimum_quantities,
+                         self.db.get_products_with_quantity, self.user['warehouse_id'])
+    
+    def show_minimum_quantities(self, products):
         low_quantity_products = [p for p in products if p['quantity'] < p['min_quantity']]
         
         if not low_quantity_products:
@@ -341,90 +604,74 @@ class StorekeeperWindow(QMainWindow):
         self.min_quantity_input.setValue(0)
     
     # Методы для работы с доставками (остаются без изменений)
-    def load_pending_deliveries(self):
-        deliveries = self.db.get_pending_deliveries(self.user['warehouse_id'])
-        self.pending_deliveries_table.setRowCount(len(deliveries))
-        
-        for row, delivery in enumerate(deliveries):
-            self.pending_deliveries_table.setItem(row, 0, QTableWidgetItem(str(delivery['id'])))
-            self.pending_deliveries_table.setItem(row, 1, QTableWidgetItem(delivery['customer_name']))
-            self.pending_deliveries_table.setItem(row, 2, QTableWidgetItem(delivery['customer_phone']))
-            self.pending_deliveries_table.setItem(row, 3, QTableWidgetItem(delivery['delivery_address']))
-            self.pending_deliveries_table.setItem(row, 4, QTableWidgetItem(delivery['product_name']))
-            self.pending_deliveries_table.setItem(row, 5, QTableWidgetItem(str(delivery['quantity'])))
-            self.pending_deliveries_table.setItem(row, 6, QTableWidgetItem(delivery['cashier_name']))
-            
-            action_widget = QWidget()
-            action_layout = QHBoxLayout()
-            action_layout.setContentsMargins(0, 0, 0, 0)
-            
-            take_delivery_btn = QPushButton('Взять в работу')
-            take_delivery_btn.clicked.connect(lambda checked, d_id=delivery['id']: self.take_delivery(d_id))
-            
-            action_layout.addWidget(take_delivery_btn)
-            action_widget.setLayout(action_layout)
-            
-            self.pending_deliveries_table.setCellWidget(row, 7, action_widget)
-    
-    def load_my_deliveries(self):
-        all_deliveries = self.db.get_all_deliveries(self.user['warehouse_id'])
-        my_deliveries = [d for d in all_deliveries if d['status'] in ['assigned', 'in_progress']]
-        
-        self.my_deliveries_table.setRowCount(len(my_deliveries))
-        
-        for row, delivery in enumerate(my_deliveries):
-            self.my_deliveries_table.setItem(row, 0, QTableWidgetItem(str(delivery['id'])))
-            self.my_deliveries_table.setItem(row, 1, QTableWidgetItem(delivery['customer_name']))
-            self.my_deliveries_table.setItem(row, 2, QTableWidgetItem(delivery['customer_phone']))
-            self.my_deliveries_table.setItem(row, 3, QTableWidgetItem(delivery['delivery_address']))
-            self.my_deliveries_table.setItem(row, 4, QTableWidgetItem(delivery['product_name']))
-            self.my_deliveries_table.setItem(row, 5, QTableWidgetItem(str(delivery['quantity'])))
-            self.my_deliveries_table.setItem(row, 6, QTableWidgetItem(self.get_status_text(delivery['status'])))
-            
-            action_widget = QWidget()
-            action_layout = QHBoxLayout()
-            action_layout.setContentsMargins(0, 0, 0, 0)
-            
-            if delivery['status'] == 'assigned':
-                add_to_group_btn = QPushButton('Добавить в группу')
-                add_to_group_btn.clicked.connect(lambda checked, d_id=delivery['id']: self.add_to_delivery_group(d_id))
-                action_layout.addWidget(add_to_group_btn)
-            
-            complete_btn = QPushButton('Завершить')
-            complete_btn.clicked.connect(lambda checked, d_id=delivery['id']: self.complete_delivery(d_id))
-            action_layout.addWidget(complete_btn)
-            
-            action_widget.setLayout(action_layout)
-            
-            self.my_deliveries_table.setCellWidget(row, 7, action_widget)
+    def load_deliveries(self):
+        """Полностью загружает ожидающие и мои доставки"""
+        self.poller.cancel('delivery_changes')
+        self.queries.run('deliveries', self.show_deliveries, self._fetch_deliveries)
+    
+    def _fetch_deliveries(self):
+        # Выполняется в фоновом потоке. Курсор берется до чтения списков:
+        # изменения, сделанные во время загрузки, придут при следующем опросе
+        changes = self.db.get_deliveries_changed_since(None, self.user['warehouse_id'])
+        pending = self.db.get_pending_deliveries(self.user['warehouse_id'])
+        mine = self.db.get_all_deliveries(self.user['warehouse_id'],
+                                          statuses=['assigned', 'in_progress'],
+                                          storekeeper_id=self.user['id'])
+        return changes[1] if changes else None, pending, mine
+    
+    def show_deliveries(self, result):
+        self.deliveries_cursor, pending, mine = result
+        self.pending_deliveries_model.set_rows(pending)
+        self.my_deliveries_model.set_rows(mine)
+    
+    def refresh_deliveries(self):
+        """Применяет к таблицам доставок изменения с последнего обновления"""
+        if self.deliveries_cursor is None:
+            # Полной загрузки еще не было или она не удалась
+            if not self.queries.is_busy():
+                self.load_deliveries()
+            return
+        self.poller.run('delivery_changes', self.apply_delivery_changes,
+                        self.db.get_deliveries_changed_since,
+                        self.deliveries_cursor, self.user['warehouse_id'])
+    
+    def on_deliveries_changed(self, deliveries):
+        if any(warehouse_id == self.user['warehouse_id'] for _, warehouse_id in deliveries):
+            self.refresh_deliveries()
+    
+    def on_listening_changed(self, listening):
+        if listening:
+            self.deliveries_timer.stop()
+            # Изменения, сделанные пока соединения не было, уведомлений не дали.
+            # Доставки догоняются по курсору изменений
+            self.refresh_deliveries()
+            if self.listening_lost:
+                # Для остатков курсора нет - после разрыва перечитываем товары
+                # целиком. Первое подключение пропускаем: окно только что
+                # загрузило их из базы
+                self.load_products()
+        else:
+            self.listening_lost = True
+            self.deliveries_timer.start()
+    
+    def apply_delivery_changes(self, changes):
+        if changes is None:
+            return
+        deliveries, self.deliveries_cursor = changes
+        # Изменения приходят от новых к старым, а ожидающие идут от старых к новым
+        self.pending_deliveries_model.upsert_rows(
+            deliveries[::-1], keep=lambda d: d['status'] == 'pending')
+        self.my_deliveries_model.upsert_rows(
+            deliveries, new_at_top=True,
+            keep=lambda d: (d['status'] in ('assigned', 'in_progress')
+                            and d['storekeeper_id'] == self.user['id']))
     
     def load_delivery_groups(self):
-        groups = self.db.get_delivery_groups(self.user['id'])
-        self.delivery_groups_table.setRowCount(len(groups))
-        
-        for row, group in enumerate(groups):
-            self.delivery_groups_table.setItem(row, 0, QTableWidgetItem(str(group['id'])))
-            self.delivery_groups_table.setItem(row, 1, QTableWidgetItem(group['vehicle_info']))
-            self.delivery_groups_table.setItem(row, 2, QTableWidgetItem(self.get_status_text(group['status'])))
-            self.delivery_groups_table.setItem(row, 3, QTableWidgetItem(group['created_date']))
-            self.delivery_groups_table.setItem(row, 4, QTableWidgetItem(str(group['delivery_count'])))
-            
-            action_widget = QWidget()
-            action_layout = QHBoxLayout()
-            action_layout.setContentsMargins(0, 0, 0, 0)
-            
-            if group['status'] == 'preparing':
-                complete_group_btn = QPushButton('Завершить группу')
-                complete_group_btn.clicked.connect(lambda checked, g_id=group['id']: self.complete_delivery_group(g_id))
-                action_layout.addWidget(complete_group_btn)
-            
-            details_btn = QPushButton('Детали')
-            details_btn.clicked.connect(lambda checked, g_id=group['id']: self.show_group_details(g_id))
-            action_layout.addWidget(details_btn)
-            
-            action_widget.setLayout(action_layout)
-            
-            self.delivery_groups_table.setCellWidget(row, 5, action_widget)
+        self.queries.run('delivery_groups', self.show_delivery_groups,
+                         self.db.get_delivery_groups, self.user['id'])
+    
+    def show_delivery_groups(self, groups):
+        self.delivery_groups_model.set_rows(groups)
     
     def get_status_text(self, status):
         status_map = {
@@ -442,8 +689,7 @@ class StorekeeperWindow(QMainWindow):
         success = self.db.assign_delivery_to_storekeeper(delivery_id, self.user['id'])
         if success:
             QMessageBox.information(self, 'Успех', 'Доставка назначена вам')
-            self.load_pending_deliveries()
-            self.load_my_deliveries()
+            self.refresh_deliveries()
         else:
             QMessageBox.warning(self, 'Ошибка', 'Ошибка при назначении доставки')
     
@@ -480,7 +726,7 @@ class StorekeeperWindow(QMainWindow):
             success = self.db.add_delivery_to_group(group_id, delivery_id)
             if success:
                 QMessageBox.information(self, 'Успех', 'Доставка добавлена в группу')
-                self.load_my_deliveries()
+                self.refresh_deliveries()
                 self.load_delivery_groups()
             else:
                 QMessageBox.warning(self, 'Ошибка', 'Ошибка при добавлении доставки в группу')
@@ -503,7 +749,7 @@ class StorekeeperWindow(QMainWindow):
         success = self.db.complete_delivery(delivery_id)
         if success:
             QMessageBox.information(self, 'Успех', 'Доставка завершена')
-            self.load_my_deliveries()
+            self.refresh_deliveries()
         else:
             QMessageBox.warning(self, 'Ошибка', 'Ошибка при завершении доставки')
     
@@ -517,9 +763,9 @@ class StorekeeperWindow(QMainWindow):
     
     def show_group_details(self, group_id=None):
         if not group_id:
-            current_row = self.delivery_groups_table.currentRow()
-            if current_row >= 0:
-                group_id = int(self.delivery_groups_table.item(current_row, 0).text())
+            row = selected_row(self.delivery_groups_table)
+            if row is not None:
+                group_id = self.delivery_groups_model.value(row, 'id')
             else:
                 return
         
@@ -531,19 +777,14 @@ class StorekeeperWindow(QMainWindow):
         
         layout = QVBoxLayout()
         
-        table = QTableWidget()
-        table.setColumnCount(6)
-        table.setHorizontalHeaderLabels(['ID', 'Клиент', 'Телефон', 'Адрес', 'Товар', 'Статус'])
-        table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
-        
-        table.setRowCount(len(deliveries))
-        for row, delivery in enumerate(deliveries):
-            table.setItem(row, 0, QTableWidgetItem(str(delivery['id'])))
-            table.setItem(row, 1, QTableWidgetItem(delivery['customer_name']))
-            table.setItem(row, 2, QTableWidgetItem(delivery['customer_phone']))
-            table.setItem(row, 3, QTableWidgetItem(delivery['delivery_address']))
-            table.setItem(row, 4, QTableWidgetItem(delivery['product_name']))
-            table.setItem(row, 5, QTableWidgetItem(self.get_status_text(delivery['status'])))
+        model = RowTableModel(
+            [('ID', 'id'), ('Клиент', 'customer_name'), ('Телефон', 'customer_phone'),
+             ('Адрес', 'delivery_address'), ('Товар', 'product_name'),
+             ('Статус', 'status', self.get_status_text)],
+            parent=dialog
+        )
+        model.set_rows(deliveries)
+        table = table_view(model)
         
         buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
         buttons.rejected.connect(dialog.reject)
@@ -626,7 +867,7 @@ class StorekeeperWindow(QMainWindow):
             selection-background-color: {color};
             selection-color: white;
         }}
-        QTableWidget {{
+        QTableView {{
             background-color: white;
             color: #333333;
             gridline-color: #cccccc;
@@ -767,7 +1008,7 @@ class StorekeeperWindow(QMainWindow):
             selection-background-color: {color};
             selection-color: white;
         }}
-        QTableWidget {{
+        QTableView {{
             background-color: #404040;
             color: #ffffff;
             gridline-color: #555555;
@@ -0,0 +1,221 @@
+from operator import itemgetter
+
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, QEvent, QRect, QTimer
+from PyQt6.QtWidgets import (QStyledItemDelegate, QStyleOptionButton, QStyle,
+                             QApplication, QTableView, QAbstractItemView, QHeaderView)
+
+from edb.rows import format_value
+
+
+class RowTableModel(QAbstractTableModel):
+    """Табличная модель над списком кортежей.
+
+    Записи из Database хранятся кортежами значений полей fields,
+    а текст ячейки формируется только при отрисовке видимых строк:
+    форматтером колонки или format_value (даты - без микросекунд).
+
+    columns - список (заголовок, поле) или (заголовок, поле, форматтер).
+    fields - все хранимые поля, если нужны поля вне колонок.
+    actions - кнопки последней колонки: (надпись, обработчик) или
+    (надпись, обработчик, условие показа); обработчик и условие
+    получают запись строки словарем.
+    """
+
+    ACTIONS_HEADER = 'Действия'
+
+    def __init__(self, columns, fields=None, actions=None, actions_header=None, parent=None):
+        super().__init__(parent)
+        if fields is None:
+            fields = [column[1] for column in columns]
+        self.fields = list(fields)
+        self._field_index = {field: i for i, field in enumerate(self.fields)}
+        self._getter = itemgetter(*self.fields)
+        self.columns = [
+            (column[0], self._field_index[column[1]], column[2] if len(column) > 2 else None)
+            for column in columns
+        ]
+        self.actions = [(a[0], a[1], a[2] if len(a) > 2 else None) for a in actions or []]
+        self.actions_header = actions_header or self.ACTIONS_HEADER
+        self.rows = []
+
+    def _to_row(self, record):
+        values = self._getter(record)
+        return values if len(self.fields) > 1 else (values,)
+
+    def set_rows(self, records):
+        """Заменяет все строки модели записями из Database"""
+        self.beginResetModel()
+        self.rows = [self._to_row(record) for record in records]
+        self.endResetModel()
+
+    def append_rows(self, records):
+        if not records:
+            return
+        rows = [self._to_row(record) for record in records]
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+        self.rows.extend(rows)
+        self.endInsertRows()
+
+    def upsert_rows(self, records, keep=None, key='id', new_at_top=False):
+        """Применяет измененные записи к строкам модели.
+
+        Строки с тем же ключом key обновляются на месте, строки, для
+        которых keep(запись) ложно, удаляются, новые записи добавляются
+        в начало (new_at_top) или в конец в порядке records.
+        """
+        if not records:
+            return
+        key_index = self._field_index[key]
+        positions = {row[key_index]: i for i, row in enumerate(self.rows)}
+        # Запись могла прийти несколько раз - действует последняя
+        latest = {record[key]: record for record in records}
+
+        new_rows = []
+        removed = []
+        for record_key, record in latest.items():
+            position = positions.get(record_key)
+            if keep is not None and not keep(record):
+                if position is not None:
+                    removed.append(position)
+                continue
+            row = self._to_row(record)
+            if position is None:
+                new_rows.append(row)
+            elif self.rows[position] != row:
+                self.rows[position] = row
+                self.dataChanged.emit(self.index(position, 0),
+                                      self.index(position, self.columnCount() - 1))
+
+        # Удаляем с конца, чтобы номера оставшихся строк не сдвигались
+        for position in sorted(removed, reverse=True):
+            self.beginRemoveRows(QModelIndex(), position, position)
+            del self.rows[position]
+            self.endRemoveRows()
+
+        if new_rows:
+            start = 0 if new_at_top else len(self.rows)
+            self.beginInsertRows(QModelIndex(), start, start + len(new_rows) - 1)
+            self.rows[start:start] = new_rows
+            self.endInsertRows()
+
+    def remove_rows(self, keys, key='id'):
+        """Удаляет строки с ключами keys"""
+        keys = set(keys)
+        key_index = self._field_index[key]
+        for position in range(len(self.rows) - 1, -1, -1):
+            if self.rows[position][key_index] in keys:
+                self.beginRemoveRows(QModelIndex(), position, position)
+                del self.rows[position]
+                self.endRemoveRows()
+
+    def value(self, row, field):
+        return self.rows[row][self._field_index[field]]
+
+    def record(self, row):
+        """Запись строки словарем"""
+        return dict(zip(self.fields, self.rows[row]))
+
+    def set_value(self, row, field, value):
+        """Меняет одно поле строки без перезагрузки модели"""
+        values = list(self.rows[row])
+        values[self._field_index[field]] = value
+        self.rows[row] = tuple(values)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+
+    @property
+    def actions_column(self):
+        """Номер колонки кнопок или None, если кнопок нет"""
+        return len(self.columns) if self.actions else None
+
+    def row_actions(self, row):
+        """Кнопки, показываемые в строке: [(надпись, обработчик)]"""
+        record = self.record(row)
+        return [(label, handler) for label, handler, visible in self.actions
+                if visible is None or visible(record)]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.columns) + (1 if self.actions else 0)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if (not index.isValid() or role != Qt.ItemDataRole.DisplayRole
+                or index.column() >= len(self.columns)):
+            return None
+        _, position, formatter = self.columns[index.column()]
+        value = self.rows[index.row()][position]
+        if formatter is not None:
+            return formatter(value)
+        return format_value(value)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            if section < len(self.columns):
+                return self.columns[section][0]
+            return self.actions_header
+        return super().headerData(section, orientation, role)
+
+
+class ActionButtonsDelegate(QStyledItemDelegate):
+    """Рисует кнопки действий строки вместо виджетов в каждой ячейке"""
+
+    MARGIN = 2
+
+    def _button_rects(self, rect, count):
+        if not count:
+            return []
+        width = (rect.width() - self.MARGIN * (count + 1)) // count
+        return [
+            QRect(rect.left() + self.MARGIN + i * (width + self.MARGIN),
+                  rect.top() + self.MARGIN, width, rect.height() - 2 * self.MARGIN)
+            for i in range(count)
+        ]
+
+    def paint(self, painter, option, index):
+        actions = index.model().row_actions(index.row())
+        widget = option.widget
+        style = widget.style() if widget is not None else QApplication.style()
+        for rect, (label, _) in zip(self._button_rects(option.rect, len(actions)), actions):
+            button = QStyleOptionButton()
+            button.rect = rect
+            button.text = label
+            button.state = QStyle.StateFlag.State_Enabled | QStyle.StateFlag.State_Raised
+            style.drawControl(QStyle.ControlElement.CE_PushButton, button, painter, widget)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() not in (QEvent.Type.MouseButtonPress, QEvent.Type.MouseButtonRelease):
+            return False
+        if event.button() != Qt.MouseButton.LeftButton:
+            return False
+
+        actions = model.row_actions(index.row())
+        position = event.position().toPoint()
+        for rect, (_, handler) in zip(self._button_rects(option.rect, len(actions)), actions):
+            if rect.contains(position):
+                if event.type() == QEvent.Type.MouseButtonRelease:
+                    record = model.record(index.row())
+                    # Обработчик может перезагрузить модель - вызываем его после события
+                    QTimer.singleShot(0, lambda: handler(record))
+                return True
+        return False
+
+
+def table_view(model, parent=None):
+    """QTableView с растянутыми колонками и кнопками действий модели"""
+    view = QTableView(parent)
+    view.setModel(model)
+    view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+    view.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+    view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+    if model.actions_column is not None:
+        view.setItemDelegateForColumn(model.actions_column, ActionButtonsDelegate(view))
+    return view
+
+
+def selected_row(view):
+    """Номер выбранной строки или None"""
+    indexes = view.selectionModel().selectedIndexes()
+    return indexes[0].row() if indexes else None